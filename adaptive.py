@@ -0,0 +1,94 @@
+import asyncio
+from typing import Dict, List, Optional
+
+
+class AdaptiveLimiter:
+    """
+    Limits how many SQS messages are in flight, adjusting the limit with
+    additive increase / multiplicative decrease.
+
+    Every `adjust` call looks at the per-job stage latencies recorded since
+    the last one, the CPU utilisation and the queue backlog:
+
+    * some stage well above its baseline latency: the machine is
+      oversubscribed, shrink the limit
+    * CPU saturated: more jobs can't run any faster, hold the limit
+    * otherwise, if the limit was reached and messages are waiting: grow it by one
+
+    A stage's baseline is the lowest average latency seen for it, allowed to
+    drift up slowly so that a lasting change in image sizes doesn't pin the
+    limit low. Slowdowns under `min_slowdown` seconds are ignored as noise.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 64, cpu_high: float = 90.0,
+                 latency_tolerance: float = 2.0, min_slowdown: float = 0.01, decrease: float = 0.75,
+                 baseline_drift: float = 0.05):
+        if not 1 <= minimum <= maximum:
+            raise ValueError("Need 1 <= minimum <= maximum")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cpu_high = cpu_high
+        self.latency_tolerance = latency_tolerance
+        self.min_slowdown = min_slowdown
+        self.decrease = decrease
+        self.baseline_drift = baseline_drift
+        self.baselines: Dict[str, float] = {}
+
+        self._limit = max(minimum, min(initial, maximum))
+        self._inflight = 0
+        self._reached_limit = False
+        self._latencies: Dict[str, List[float]] = {}
+        self._slot_free = asyncio.Event()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    async def acquire(self, wanted: int) -> int:
+        """Wait for at least one free slot and take up to `wanted` of them."""
+        while self._inflight >= self._limit:
+            self._reached_limit = True
+            self._slot_free.clear()
+            await self._slot_free.wait()
+        taken = min(wanted, self._limit - self._inflight)
+        self._inflight += taken
+        if self._inflight >= self._limit:
+            self._reached_limit = True
+        return taken
+
+    def release(self, count: int = 1) -> None:
+        self._inflight -= count
+        self._slot_free.set()
+
+    def record_latency(self, stage: str, seconds: float) -> None:
+        self._latencies.setdefault(stage, []).append(seconds)
+
+    def _slowed_down(self, latencies: Dict[str, List[float]]) -> bool:
+        slowed = False
+        for stage, samples in latencies.items():
+            average = sum(samples) / len(samples)
+            baseline = self.baselines.get(stage, average)
+            if average > baseline * self.latency_tolerance and average - baseline > self.min_slowdown:
+                slowed = True
+            self.baselines[stage] = min(average, baseline * (1 + self.baseline_drift))
+        return slowed
+
+    def adjust(self, cpu_percent: Optional[float], backlog: Optional[int]) -> int:
+        """Update and return the limit from the signals gathered since the last call."""
+        latencies, self._latencies = self._latencies, {}
+        reached_limit, self._reached_limit = self._reached_limit, self._inflight >= self._limit
+
+        if self._slowed_down(latencies):
+            self._limit = max(self.minimum, int(self._limit * self.decrease))
+        elif cpu_percent is not None and cpu_percent >= self.cpu_high:
+            pass
+        elif reached_limit and backlog:
+            self._limit = min(self.maximum, self._limit + 1)
+
+        # A higher limit may unblock waiters
+        self._slot_free.set()
+        return self._limit
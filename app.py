@@ -1,21 +1,48 @@
+import time
+
+# Measured from here so /health/ready can report import time and time-to-ready
+IMPORT_STARTED = time.perf_counter()
+
+import io
+import mimetypes
 import os
+import socket
 import uuid
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import FileResponse
-from PIL import Image
-from ultralytics import YOLO
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 import boto3
-import torch
+from botocore.exceptions import ClientError
+import psutil
 import json
 import asyncio
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
 
 
 from storage.sqlite_storage import SQLiteStorage
 from storage.dynamodb_storage import DynamoDBStorage
+from storage.base import InvalidCursorError, stage_reached
+from storage.async_sqlite_storage import AsyncSQLiteStorage
+from storage.async_dynamodb_storage import AsyncDynamoDBStorage
+from storage.instrumented import InstrumentedStorage
+from storage.cached import AsyncCachedStorage, CachedStorage, cache_hits, cache_misses
+from storage.retention import prune_sqlite
+from adaptive import AdaptiveLimiter
+from callbacks import CallbackDispatcher
+from render_cache import RenderCache
+from file_cache import LocalFileCache
+from image_responses import RangeNotSatisfiable, bytes_response, file_response, not_modified, parse_range
+from lazy import Lazy
+from pipeline import BatchStage, Pipeline, Stage
+from inference import get_engine
+from inference.base import results_from_detections
+from imaging import decode_fitted, decode_image, encode_image, prepare_image, sha256_bytes, sha256_file
+import metrics
+import telemetry
 
-# Disable GPU usage
-torch.cuda.is_available = lambda: False
+# Export metrics (and sampled traces) over OTLP when configured
+telemetry.setup()
 
 # Initialize FastAPI
 app = FastAPI()
@@ -23,27 +50,243 @@ app = FastAPI()
 # Set up directories
 UPLOAD_DIR = "uploads/original"
 PREDICTED_DIR = "uploads/predicted"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(PREDICTED_DIR, exist_ok=True)
+# The only image files jobs take and the image routes serve
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png"]
 
-# Load YOLO model
-model = YOLO("yolov8n.pt")
+# The model, AWS clients, storage and callback dispatcher are built on first
+# use, so importing the app stays cheap. Startup warms them up in the background.
+
+# YOLO model (PyTorch, ONNX Runtime or OpenVINO, see INFERENCE_ENGINE)
+model = Lazy(get_engine)
 
 # Set up S3
 S3_BUCKET_NAME = os.environ.get("S3_BUCKET_NAME")
-s3_client = boto3.client("s3")
-# Set up SQS and callback URL
-SQS_QUEUE_URL = os.environ["SQS_QUEUE_URL"]
-POLYBOT_CALLBACK_URL = os.environ["POLYBOT_CALLBACK_URL"]
-sqs_client = boto3.client("sqs", region_name="eu-west-2")
+s3_client = Lazy(lambda: boto3.client("s3"))
+# Set up SQS and callback URL; both are required once the worker starts
+SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
+POLYBOT_CALLBACK_URL = os.getenv("POLYBOT_CALLBACK_URL")
+sqs_client = Lazy(lambda: boto3.client("sqs", region_name="eu-west-2"))
+
+
+def create_callbacks() -> CallbackDispatcher:
+    if not POLYBOT_CALLBACK_URL:
+        raise RuntimeError("POLYBOT_CALLBACK_URL is not set")
+    return CallbackDispatcher(
+        POLYBOT_CALLBACK_URL,
+        outbox_path=os.getenv("CALLBACK_OUTBOX_DB", "callbacks.db"),
+        concurrency=int(os.getenv("CALLBACK_CONCURRENCY", "4")),
+        timeout=float(os.getenv("CALLBACK_TIMEOUT", "5")),
+        max_attempts=int(os.getenv("CALLBACK_MAX_ATTEMPTS", "5")),
+    )
+
+
+# Callbacks are delivered in the background from a persistent outbox, so a
+# slow or unavailable Polybot never holds up the pipeline.
+callbacks = Lazy(create_callbacks)
+
+# Pipeline tuning
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+# An in-process model is shared by the inference threads and its predictor is
+# not thread-safe, so this defaults to 1. With a process pool
+# (INFERENCE_PROCESSES) each thread feeds one worker process.
+INFERENCE_PROCESSES = int(os.getenv("INFERENCE_PROCESSES", "0"))
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(max(INFERENCE_PROCESSES, 1))))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+MAX_INFLIGHT_JOBS = int(os.getenv("MAX_INFLIGHT_JOBS", "16"))
+# With ADAPTIVE_CONCURRENCY the in-flight limit starts at MAX_INFLIGHT_JOBS and
+# moves between ADAPTIVE_MIN_INFLIGHT and ADAPTIVE_MAX_INFLIGHT
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+ADAPTIVE_MIN_INFLIGHT = int(os.getenv("ADAPTIVE_MIN_INFLIGHT", "1"))
+ADAPTIVE_MAX_INFLIGHT = int(os.getenv("ADAPTIVE_MAX_INFLIGHT", "64"))
+ADAPTIVE_INTERVAL = float(os.getenv("ADAPTIVE_INTERVAL", "5"))
+ADAPTIVE_CPU_HIGH = float(os.getenv("ADAPTIVE_CPU_HIGH", "90"))
+# Read from the queue unless set; visibility is extended every third of it
+SQS_VISIBILITY_TIMEOUT = int(os.getenv("SQS_VISIBILITY_TIMEOUT", "0")) or None
+# SQS returns at most 10 messages per receive call
+SQS_BATCH_SIZE = min(int(os.getenv("SQS_BATCH_SIZE", "10")), 10)
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "8"))
+INFERENCE_BATCH_WAIT_MS = int(os.getenv("INFERENCE_BATCH_WAIT_MS", "50"))
+
+# In-memory mode keeps images in buffers from S3 download to S3 upload;
+# the local copies under uploads/ are then only written if LOCAL_IMAGE_CACHE is on.
+IN_MEMORY_IMAGES = os.getenv("IN_MEMORY_IMAGES", "false").lower() == "true"
+LOCAL_IMAGE_CACHE = os.getenv("LOCAL_IMAGE_CACHE", "false" if IN_MEMORY_IMAGES else "true").lower() == "true"
+
+# The files under uploads/ are deleted, least recently used first, once they
+# take more than LOCAL_FILES_MAX_MB or go unused for LOCAL_FILES_MAX_AGE_HOURS
+# (0 keeps them regardless of age). Files of running jobs are kept.
+LOCAL_FILES_MAX_MB = float(os.getenv("LOCAL_FILES_MAX_MB", "10240"))
+LOCAL_FILES_MAX_AGE_HOURS = float(os.getenv("LOCAL_FILES_MAX_AGE_HOURS", "0"))
+LOCAL_FILES_SWEEP_INTERVAL = float(os.getenv("LOCAL_FILES_SWEEP_INTERVAL", "30"))
+
+# Identical images reuse the detections of the first prediction made for them.
+# With DEDUP_USE_ETAG the S3 ETag (the MD5 of single-part, non-KMS uploads)
+# is used as the key, which lets a repeat skip the download as well.
+DEDUP_IMAGES = os.getenv("DEDUP_IMAGES", "true").lower() == "true"
+DEDUP_USE_ETAG = os.getenv("DEDUP_USE_ETAG", "false").lower() == "true"
+dedup_hits = metrics.counter("dedup.hits", "Jobs answered from a stored prediction of the same image")
+dedup_misses = metrics.counter("dedup.misses", "Jobs whose image had not been seen before")
+dedup_expired = metrics.counter("dedup.expired", "Duplicates whose stored prediction expired before it was copied")
+
+
+# RENDER_MODE=lazy skips drawing and uploading the annotated image: only the
+# detections are stored, and /prediction/{uid}/image renders the boxes onto the
+# original when it is first requested. Rendered images are kept in an LRU cache
+# of RENDER_CACHE_MB, in memory or under RENDER_CACHE_DIR.
+RENDER_MODE = os.getenv("RENDER_MODE", "eager").lower()
+if RENDER_MODE not in ("eager", "lazy"):
+    raise ValueError(f"Unsupported RENDER_MODE: {RENDER_MODE}")
+LAZY_RENDER = RENDER_MODE == "lazy"
 
+# With REDUCED_DECODE the preprocess stage decodes JPEGs at a fraction of their
+# size (DCT scaling) just big enough for the model's INFERENCE_IMGSZ input and
+# letterboxes them; boxes are mapped back to the full-size image before they are
+# stored, at slightly lower precision. ANNOTATED_MAX_SIDE caps the long side of
+# the annotated image (0 keeps the original resolution). Eager full-size
+# annotations need the full decode anyway, so there it only adds a second one.
+ANNOTATED_MAX_SIDE = int(os.getenv("ANNOTATED_MAX_SIDE", "0"))
+REDUCED_DECODE = os.getenv("REDUCED_DECODE", "false").lower() == "true"
+if REDUCED_DECODE and not (LAZY_RENDER or ANNOTATED_MAX_SIDE):
+    print("⚠️ REDUCED_DECODE only applies with RENDER_MODE=lazy or ANNOTATED_MAX_SIDE, decoding in full")
+    REDUCED_DECODE = False
+INFERENCE_IMGSZ = int(os.getenv("INFERENCE_IMGSZ", "640"))
+render_cache = RenderCache(
+    int(float(os.getenv("RENDER_CACHE_MB", "256")) * 1024 * 1024),
+    os.getenv("RENDER_CACHE_DIR") or None,
+)
 
-# Select storage backend
-storage_type = os.getenv("STORAGE_TYPE", "sqlite")
-if storage_type == "dynamodb":
-    storage = DynamoDBStorage()
-else:
-    storage = SQLiteStorage()
+# Images missing from uploads/ (fresh container, other replica) are served from
+# S3: fetched through a read-through LRU cache of IMAGE_CACHE_MB, or with
+# IMAGE_S3_REDIRECT=true redirected to a presigned URL. Every image response
+# carries a content-hash ETag and IMAGE_CACHE_CONTROL.
+IMAGE_CACHE_CONTROL = os.getenv("IMAGE_CACHE_CONTROL", "public, max-age=86400")
+IMAGE_S3_REDIRECT = os.getenv("IMAGE_S3_REDIRECT", "false").lower() == "true"
+PRESIGNED_URL_EXPIRES = int(os.getenv("PRESIGNED_URL_EXPIRES", "300"))
+# Annotated images are uploaded under this prefix, apart from the originals
+# (which keep the key they were uploaded with). Ones uploaded before the prefix
+# existed are still found under their bare key.
+PREDICTED_S3_PREFIX = os.getenv("PREDICTED_S3_PREFIX", "predicted/")
+image_cache = RenderCache(
+    int(float(os.getenv("IMAGE_CACHE_MB", "256")) * 1024 * 1024),
+    os.getenv("IMAGE_CACHE_DIR") or None,
+    name="image_cache",
+)
+
+# Every job's progress is recorded in storage, so a redelivered message resumes
+# where the last attempt stopped. A job is owned by one worker at a time; the
+# lease lets another worker take over if this one dies.
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+
+# Listing endpoints
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+
+# get_prediction / get_prediction_image_path results are cached for
+# PREDICTION_CACHE_TTL seconds (not-found for PREDICTION_CACHE_NEGATIVE_TTL) in an
+# LRU of PREDICTION_CACHE_SIZE entries, 0 to disable. PREDICTION_CACHE_REDIS_URL
+# adds a Redis cache shared by the replicas.
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "60"))
+PREDICTION_CACHE_NEGATIVE_TTL = float(os.getenv("PREDICTION_CACHE_NEGATIVE_TTL", "2"))
+PREDICTION_CACHE_REDIS_URL = os.getenv("PREDICTION_CACHE_REDIS_URL")
+
+
+def create_storage():
+    # Select storage backend
+    storage_type = os.getenv("STORAGE_TYPE", "sqlite")
+    if storage_type == "dynamodb":
+        backend = InstrumentedStorage(DynamoDBStorage())
+    else:
+        backend = InstrumentedStorage(SQLiteStorage())
+    if not PREDICTION_CACHE_SIZE:
+        return backend
+    return CachedStorage(backend, PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL, PREDICTION_CACHE_NEGATIVE_TTL,
+                         PREDICTION_CACHE_REDIS_URL)
+
+
+storage = Lazy(create_storage)
+
+# With ASYNC_STORAGE=true the API routes and the SQS worker await storage
+# directly (aiosqlite or aioboto3) instead of running every call on a thread.
+# SQLite keeps one writer and ASYNC_STORAGE_READERS reader connections open,
+# DynamoDB one pool of up to DYNAMODB_MAX_CONNECTIONS HTTP connections. The
+# pipeline stages run on threads anyway and keep using `storage`.
+ASYNC_STORAGE = os.getenv("ASYNC_STORAGE", "false").lower() == "true"
+ASYNC_STORAGE_READERS = int(os.getenv("ASYNC_STORAGE_READERS", "4"))
+DYNAMODB_MAX_CONNECTIONS = int(os.getenv("DYNAMODB_MAX_CONNECTIONS", "50"))
+
+
+def create_async_storage():
+    storage_type = os.getenv("STORAGE_TYPE", "sqlite")
+    if storage_type == "dynamodb":
+        backend = InstrumentedStorage(AsyncDynamoDBStorage(max_connections=DYNAMODB_MAX_CONNECTIONS))
+    else:
+        backend = InstrumentedStorage(AsyncSQLiteStorage(readers=ASYNC_STORAGE_READERS))
+    if not PREDICTION_CACHE_SIZE:
+        return backend
+    # Shares the blocking storage's cache, so the pipeline's saves invalidate it
+    return AsyncCachedStorage(backend, storage.get())
+
+
+async_storage = Lazy(create_async_storage)
+
+
+async def storage_call(operation: str, *args):
+    """
+    Call a storage method from the event loop: awaited directly with
+    ASYNC_STORAGE, otherwise run on a worker thread.
+    """
+    if ASYNC_STORAGE:
+        return await getattr(async_storage, operation)(*args)
+    return await asyncio.to_thread(getattr(storage, operation), *args)
+
+# Predictions are kept RETENTION_DAYS (0 keeps them forever). SQLite is pruned by
+# the worker every RETENTION_INTERVAL_HOURS, after exporting the expired rows to
+# Parquet in ARCHIVE_DIR if it is set. DynamoDB items get a TTL instead; archive
+# them with `python -m storage.retention archive-dynamodb` before they expire.
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "0"))
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "24"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR") or None
+
+# Warm-up (model download, storage and AWS clients) is tried WARM_UP_ATTEMPTS
+# times, waiting WARM_UP_RETRY_SECONDS and doubling after each failure. Once it
+# gives up, or the SQS worker stops on an error, /health/live answers 503 so the
+# orchestrator restarts the container.
+WARM_UP_ATTEMPTS = int(os.getenv("WARM_UP_ATTEMPTS", "5"))
+WARM_UP_RETRY_SECONDS = float(os.getenv("WARM_UP_RETRY_SECONDS", "2"))
+
+local_files = Lazy(lambda: LocalFileCache(
+    [UPLOAD_DIR, PREDICTED_DIR], int(LOCAL_FILES_MAX_MB * 1024 * 1024), LOCAL_FILES_MAX_AGE_HOURS * 3600
+))
+
+sqs_received = metrics.counter("sqs.messages.received", "Messages received from SQS")
+sqs_deleted = metrics.counter("sqs.messages.deleted", "Messages processed and deleted from SQS")
+sqs_failed = metrics.counter("sqs.messages.failed", "Messages that failed and were left for redelivery")
+jobs_inflight = metrics.gauge("jobs.inflight", "Jobs currently in the pipeline")
+inflight_limit = metrics.gauge("jobs.inflight.limit", "Current limit on jobs in flight")
+visibility_extended = metrics.counter("sqs.visibility.extended", "Visibility timeout extensions of slow messages")
+http_duration = metrics.histogram("http.server.duration", "HTTP request latency per route", "s")
+
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Use the route template so /prediction/{uid} is one series, not one per uid
+        route = request.scope.get("route")
+        http_duration.record(time.perf_counter() - started, {
+            "route": getattr(route, "path", "unmatched"),
+            "method": request.method,
+            "status": str(status),
+        })
 
 
 @app.post("/predict")
@@ -102,60 +345,489 @@ else:
 
 
 @app.get("/prediction/{uid}")
-def get_prediction_by_uid(uid: str):
+async def get_prediction_by_uid(uid: str):
     try:
-        return storage.get_prediction(uid)
+        return await storage_call("get_prediction", uid)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/predictions/label/{label}")
-def get_predictions_by_label(label: str):
-    if label not in model.names.values():
-        raise HTTPException(status_code=404, detail="Label not found")
+def ndjson_stream(first, rows):
+    if first is not None:
+        yield json.dumps(first, default=str) + "\n"
+    for row in rows:
+        yield json.dumps(row, default=str) + "\n"
+
+
+async def ndjson_stream_async(first, rows):
+    if first is not None:
+        yield json.dumps(first, default=str) + "\n"
+    async for row in rows:
+        yield json.dumps(row, default=str) + "\n"
+
+
+async def list_predictions(query: str, args: tuple, limit: Optional[int], cursor: Optional[str], stream: bool):
+    """
+    Shared handling for the listing endpoints, backed by the storage methods
+    get_predictions_by_<query>, get_predictions_by_<query>_page and
+    iter_predictions_by_<query>: a plain list when no paging parameters are
+    given, a keyset page with `limit`/`cursor`, or NDJSON streamed row by row
+    with `stream=true`.
+    """
     try:
-        return storage.get_predictions_by_label(label)
+        if stream:
+            # The first row is read before the headers go out, so a query the
+            # storage can't run still fails with a status code
+            if ASYNC_STORAGE:
+                rows = getattr(async_storage, f"iter_predictions_by_{query}")(*args).__aiter__()
+                body = ndjson_stream_async(await anext(rows, None), rows)
+            else:
+                rows = iter(getattr(storage, f"iter_predictions_by_{query}")(*args))
+                body = ndjson_stream(await asyncio.to_thread(next, rows, None), rows)
+            return StreamingResponse(body, media_type="application/x-ndjson")
+        if limit is None and cursor is None:
+            return await storage_call(f"get_predictions_by_{query}", *args)
+        items, next_cursor = await storage_call(
+            f"get_predictions_by_{query}_page", *args, limit or DEFAULT_PAGE_SIZE, cursor
+        )
+        return {"items": items, "next_cursor": next_cursor}
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def known_label(label: str) -> bool:
+    # Reading the names loads the model if warm-up hasn't yet, keep that off the event loop
+    names = model.names if model.loaded else await asyncio.to_thread(lambda: model.names)
+    return label in names.values()
+
+
+@app.get("/predictions/label/{label}")
+async def get_predictions_by_label(label: str, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                                   cursor: Optional[str] = None, stream: bool = False):
+    if not await known_label(label):
+        raise HTTPException(status_code=404, detail="Label not found")
+    return await list_predictions("label", (label,), limit, cursor, stream)
+
+
 @app.get("/predictions/score/{min_score}")
-def get_predictions_by_score(min_score: float):
+async def get_predictions_by_score(min_score: float, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                                   cursor: Optional[str] = None, stream: bool = False):
     if not (0.0 <= min_score <= 1.0):
         raise HTTPException(status_code=400, detail="Score must be between 0 and 1")
+    return await list_predictions("score", (min_score,), limit, cursor, stream)
+
+
+@app.get("/stats")
+async def get_stats(hours: int = Query(24, ge=1, le=24 * 31)):
     try:
-        return storage.get_predictions_by_score(min_score)
+        return await storage_call("get_stats", hours)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/predictions/boxes")
+async def get_predictions_by_box(label: Optional[str] = None, x1: Optional[float] = None,
+                                 y1: Optional[float] = None, x2: Optional[float] = None, y2: Optional[float] = None,
+                                 min_area: Optional[float] = Query(None, ge=0),
+                                 limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                                 cursor: Optional[str] = None, stream: bool = False):
+    corners = (x1, y1, x2, y2)
+    if any(v is None for v in corners) and any(v is not None for v in corners):
+        raise HTTPException(status_code=400, detail="A region needs all of x1, y1, x2 and y2")
+    region = corners if x1 is not None else None
+    if region and (x1 > x2 or y1 > y2):
+        raise HTTPException(status_code=400, detail="Region must have x1 <= x2 and y1 <= y2")
+    if label is None and region is None and min_area is None:
+        raise HTTPException(status_code=400, detail="Give a label, a region or min_area")
+    if label is not None and not await known_label(label):
+        raise HTTPException(status_code=404, detail="Label not found")
+    return await list_predictions("box", (label, region, min_area), limit, cursor, stream)
+
+
 @app.get("/image/{type}/{filename}")
-def get_image(type: str, filename: str):
+def get_image(type: str, filename: str, request: Request):
     if type not in ["original", "predicted"]:
         raise HTTPException(status_code=400, detail="Invalid image type")
-    path = os.path.join("uploads", type, filename)
-    if not os.path.exists(path):
+    if os.path.splitext(filename)[1] not in IMAGE_EXTENSIONS:
         raise HTTPException(status_code=404, detail="Image not found")
-    return FileResponse(path)
+    media_type = mimetypes.guess_type(filename)[0]
+    path = os.path.join("uploads", type, filename)
+    if local_files.lookup(path):
+        return file_response(request, path, media_type, IMAGE_CACHE_CONTROL)
+    if type == "original":
+        return s3_image_response(request, filename, media_type)
+    return s3_image_response(request, predicted_key(filename), media_type, legacy_key=filename)
+
+
+def predicted_key(image_name: str) -> str:
+    return PREDICTED_S3_PREFIX + image_name
+
+
+def get_s3_object(key: str, **kwargs) -> dict:
+    try:
+        return s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=key, **kwargs)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            raise HTTPException(status_code=404, detail="Image not found")
+        raise
+
+
+def s3_object_exists(key: str) -> bool:
+    try:
+        s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=key)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return False
+        raise
+
+
+def s3_image_response(request: Request, key: str, media_type: str, legacy_key: str = None):
+    """
+    Serve an image from S3, falling back to `legacy_key` when there is
+    nothing under `key` (annotated images uploaded before PREDICTED_S3_PREFIX).
+    """
+    if IMAGE_S3_REDIRECT:
+        if legacy_key and not s3_object_exists(key) and s3_object_exists(legacy_key):
+            key = legacy_key
+        url = s3_client.generate_presigned_url(
+            "get_object", Params={"Bucket": S3_BUCKET_NAME, "Key": key}, ExpiresIn=PRESIGNED_URL_EXPIRES
+        )
+        return RedirectResponse(url, status_code=307)
+
+    data = image_cache.get(key)
+    if data is None:
+        try:
+            response = get_s3_object(key)
+        except HTTPException:
+            if not legacy_key:
+                raise
+            return s3_image_response(request, legacy_key, media_type)
+        if response["ContentLength"] > image_cache.max_bytes:
+            return s3_stream_response(request, key, response, media_type)
+        data = response["Body"].read()
+        image_cache.put(key, data)
+    return bytes_response(request, data, media_type, IMAGE_CACHE_CONTROL)
+
+
+def s3_stream_response(request: Request, key: str, response: dict, media_type: str):
+    """
+    Stream an object too big to cache straight from S3 with its ETag, a
+    single byte range being read from S3 with a ranged GET.
+    """
+    size, etag = response["ContentLength"], response["ETag"]
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if not_modified(request, etag):
+        response["Body"].close()
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            response["Body"].close()
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range:
+            response["Body"].close()
+            start, end = byte_range
+            # IfMatch keeps the range from coming out of a newer upload of another size
+            ranged = get_s3_object(key, Range=f"bytes={start}-{end}", IfMatch=etag)
+            headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)})
+            return StreamingResponse(ranged["Body"].iter_chunks(), status_code=206, media_type=media_type,
+                                     headers=headers)
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(response["Body"].iter_chunks(), media_type=media_type, headers=headers)
+
+
+def load_original(original_image: str):
+    """The original image's local path, or its bytes read from S3."""
+    path = os.path.join(UPLOAD_DIR, original_image)
+    if local_files.lookup(path):
+        return path
+    return get_s3_object(original_image)["Body"].read()
+
+
+def draw_detections(source, detections: List[dict]):
+    """
+    Draw detections (in full-size pixels) onto the original image, read
+    from a path or bytes and capped at ANNOTATED_MAX_SIDE. Returns a BGR array.
+    """
+    image, (scale_x, scale_y) = decode_fitted(source, ANNOTATED_MAX_SIDE)
+    if (scale_x, scale_y) != (1.0, 1.0):
+        detections = [
+            dict(d, box=[d["box"][0] * scale_x, d["box"][1] * scale_y, d["box"][2] * scale_x, d["box"][3] * scale_y])
+            for d in detections
+        ]
+    return results_from_detections(image, detections, model.names).plot()
+
+
+def render_prediction_image(uid: str, media_type: str) -> bytes:
+    """Draw the stored detections onto the original image, cached per format."""
+    key = f"{uid}:{media_type}"
+    cached = render_cache.get(key)
+    if cached is not None:
+        return cached
+
+    prediction = storage.get_prediction(uid)
+    detections = [
+        {"label": d["label"], "score": float(d["score"]), "box": [float(v) for v in d["box"]]}
+        for d in prediction["detection_objects"]
+    ]
+    annotated = draw_detections(load_original(prediction["original_image"]), detections)
+    data = encode_image(annotated, "annotated.png" if media_type == "image/png" else "annotated.jpg")
+    render_cache.put(key, data)
+    return data
+
+
+def accepted_image_type(request: Request) -> str:
+    accept = request.headers.get("accept", "")
+    if "image/png" in accept:
+        return "image/png"
+    elif "image/jpeg" in accept or "image/jpg" in accept:
+        return "image/jpeg"
+    raise HTTPException(status_code=406, detail="Client does not accept an image format")
 
 
 @app.get("/prediction/{uid}/image")
 def get_prediction_image(uid: str, request: Request):
-    accept = request.headers.get("accept", "")
+    if LAZY_RENDER:
+        media_type = accepted_image_type(request)
+        try:
+            data = render_prediction_image(uid, media_type)
+        except ValueError:
+            raise HTTPException(status_code=404, detail="Prediction not found")
+        return bytes_response(request, data, media_type, IMAGE_CACHE_CONTROL)
+
     try:
-        image_path = storage.get_prediction_image_path(uid)
+        image_name = os.path.basename(storage.get_prediction_image_path(uid))
     except Exception:
         raise HTTPException(status_code=404, detail="Prediction not found")
 
-    if not os.path.exists(image_path):
-        raise HTTPException(status_code=404, detail="Predicted image file not found")
+    media_type = accepted_image_type(request)
+    path = os.path.join(PREDICTED_DIR, image_name)
+    if local_files.lookup(path):
+        return file_response(request, path, media_type, IMAGE_CACHE_CONTROL)
+    return s3_image_response(request, predicted_key(image_name), media_type, legacy_key=image_name)
 
-    if "image/png" in accept:
-        return FileResponse(image_path, media_type="image/png")
-    elif "image/jpeg" in accept or "image/jpg" in accept:
-        return FileResponse(image_path, media_type="image/jpeg")
+
+@dataclass
+class PredictionJob:
+    uid: str
+    chat_id: str
+    original_key: str
+    original_path: str
+    predicted_path: str
+    original_bytes: bytes = None
+    image: object = None
+    # Maps boxes found on `image` back to the original, when it was decoded reduced
+    transform: object = None
+    predicted_bytes: bytes = None
+    result: object = None
+    content_hash: str = None
+    duplicate_of: str = None
+    labels: List[str] = field(default_factory=list)
+    detections: List[dict] = field(default_factory=list)
+    state: Optional[dict] = None
+
+
+class JobInProgressError(Exception):
+    pass
+
+
+def record_stage(job: PredictionJob, stage: str):
+    data = {
+        "labels": job.labels,
+        "detections": job.detections,
+        "content_hash": job.content_hash,
+        "duplicate_of": job.duplicate_of,
+    }
+    storage.update_job_state(job.uid, stage, data, JOB_LEASE_SECONDS)
+    job.state = {"stage": stage, "data": data}
+
+
+def resume(job: PredictionJob, state: dict):
+    """Restore what earlier attempts of this job already worked out."""
+    job.state = state
+    data = state["data"]
+    job.labels = data.get("labels", [])
+    job.detections = data.get("detections", [])
+    job.content_hash = data.get("content_hash")
+    job.duplicate_of = data.get("duplicate_of")
+
+
+def write_local_copy(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+    local_files.add(path)
+
+
+def trusted_etag(key: str) -> Optional[str]:
+    """The object's ETag if it is a plain MD5 of the content, else None."""
+    etag = s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=key)["ETag"].strip('"')
+    # Multipart ETags look like "<md5>-<parts>" and don't identify the content
+    return None if "-" in etag else f"etag:{etag}"
+
+
+def find_duplicate(job: PredictionJob):
+    job.duplicate_of = storage.find_prediction_by_hash(job.content_hash)
+    if job.duplicate_of:
+        dedup_hits.add()
+    else:
+        dedup_misses.add()
+
+
+def download_stage(job: PredictionJob):
+    # Past inference the original is only needed to redraw the boxes
+    if stage_reached(job.state, "uploaded") or (stage_reached(job.state, "inferred") and job.duplicate_of):
+        return
+    resumed = stage_reached(job.state, "inferred")
+
+    # A content hash without a duplicate means an earlier attempt already looked
+    if DEDUP_IMAGES and DEDUP_USE_ETAG and not job.content_hash and not resumed:
+        job.content_hash = trusted_etag(job.original_key)
+        if job.content_hash:
+            find_duplicate(job)
+            if job.duplicate_of:
+                return
+
+    if not IN_MEMORY_IMAGES:
+        s3_client.download_file(S3_BUCKET_NAME, job.original_key, job.original_path)
+        local_files.add(job.original_path)
+    else:
+        buffer = io.BytesIO()
+        s3_client.download_fileobj(S3_BUCKET_NAME, job.original_key, buffer)
+        job.original_bytes = buffer.getvalue()
+        if LOCAL_IMAGE_CACHE:
+            write_local_copy(job.original_path, job.original_bytes)
+
+    if DEDUP_IMAGES and not job.content_hash and not resumed:
+        if IN_MEMORY_IMAGES:
+            job.content_hash = sha256_bytes(job.original_bytes)
+        else:
+            job.content_hash = sha256_file(job.original_path)
+        find_duplicate(job)
+
+
+def preprocess_stage(job: PredictionJob):
+    if job.duplicate_of or stage_reached(job.state, "inferred"):
+        return
+    if REDUCED_DECODE:
+        source = job.original_bytes if job.original_bytes is not None else job.original_path
+        job.image, job.transform = prepare_image(source, INFERENCE_IMGSZ)
+    elif IN_MEMORY_IMAGES:
+        job.image = decode_image(job.original_bytes)
+
+
+def infer_stage(jobs: List[PredictionJob]):
+    jobs = [job for job in jobs if not job.duplicate_of and not stage_reached(job.state, "inferred")]
+    if not jobs:
+        return
+    # One forward pass for the whole micro-batch; results come back in order. If it
+    # raises (e.g. on an unreadable image) the pipeline re-runs the jobs one by one.
+    sources = [job.image if job.image is not None else job.original_path for job in jobs]
+    results = model.predict(sources)
+    for job, result in zip(jobs, results):
+        job.result = result
+        job.image = None
+
+
+def annotate_stage(job: PredictionJob):
+    if not stage_reached(job.state, "inferred"):
+        if not job.duplicate_of:
+            boxes = job.result.boxes
+            xyxy = boxes.xyxy
+            if job.transform is not None:
+                xyxy = job.transform.restore(xyxy)
+            job.detections = [
+                {"label": model.names[int(cls)], "score": float(conf), "box": box.tolist()}
+                for box, conf, cls in zip(xyxy, boxes.conf.tolist(), boxes.cls.tolist())
+            ]
+            job.labels = [d["label"] for d in job.detections]
+        record_stage(job, "inferred")
+
+    if job.duplicate_of or LAZY_RENDER or stage_reached(job.state, "uploaded"):
+        job.result = None
+        return
+    if job.result is not None and job.transform is None and not ANNOTATED_MAX_SIDE:
+        # Inferred on the full-size image; plot() returns a BGR array
+        annotated = job.result.plot()
     else:
-        raise HTTPException(status_code=406, detail="Client does not accept an image format")
+        # Inferred on a reduced copy, or resumed after inference: draw the
+        # stored boxes onto the original instead of running the model again
+        annotated = draw_detections(
+            job.original_bytes if job.original_bytes is not None else job.original_path, job.detections
+        )
+    job.result = None
+    job.predicted_bytes = encode_image(annotated, job.predicted_path)
+    if not IN_MEMORY_IMAGES or LOCAL_IMAGE_CACHE:
+        write_local_copy(job.predicted_path, job.predicted_bytes)
+
+
+def upload_stage(job: PredictionJob):
+    if job.duplicate_of or LAZY_RENDER or stage_reached(job.state, "uploaded"):
+        return
+    s3_client.upload_fileobj(io.BytesIO(job.predicted_bytes), S3_BUCKET_NAME,
+                             predicted_key(os.path.basename(job.predicted_path)))
+    job.predicted_bytes = None
+    record_stage(job, "uploaded")
+
+
+def persist_stage(job: PredictionJob):
+    if stage_reached(job.state, "persisted"):
+        return
+    # Both writes replace an earlier partial attempt instead of failing on it
+    if job.duplicate_of:
+        try:
+            storage.copy_prediction(job.duplicate_of, job.uid, job.original_key)
+        except ValueError:
+            # The stored prediction expired since it was found. Start over
+            # without it: the redelivered message runs inference instead.
+            dedup_expired.add()
+            job.duplicate_of = None
+            record_stage(job, "received")
+            raise
+        job.labels = [d["label"] for d in storage.get_prediction(job.uid)["detection_objects"]]
+    else:
+        storage.save_prediction_with_detections(
+            job.uid, job.original_key, os.path.basename(job.predicted_path), job.detections
+        )
+        if job.content_hash:
+            storage.save_content_hash(job.content_hash, job.uid)
+    record_stage(job, "persisted")
+
+
+def callback_stage(job: PredictionJob):
+    callbacks.enqueue(job.uid, {"chat_id": job.chat_id, "labels": job.labels})
+    record_stage(job, "notified")
+
+
+# Blocking work runs off the event loop: network/disk stages share the I/O
+# pool, inference gets its own executor so it never waits behind uploads.
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="yolo-io")
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="yolo-infer")
+
+pipeline = Pipeline([
+    Stage("download", download_stage, io_executor, concurrency=int(os.getenv("DOWNLOAD_CONCURRENCY", "4"))),
+    Stage("preprocess", preprocess_stage, io_executor, concurrency=int(os.getenv("PREPROCESS_CONCURRENCY", "2"))),
+    BatchStage("infer", infer_stage, inference_executor, concurrency=INFERENCE_WORKERS,
+               max_batch_size=INFERENCE_BATCH_SIZE, max_wait=INFERENCE_BATCH_WAIT_MS / 1000, isolate_failures=True),
+    Stage("annotate", annotate_stage, io_executor, concurrency=int(os.getenv("ANNOTATE_CONCURRENCY", "2"))),
+    Stage("upload", upload_stage, io_executor, concurrency=int(os.getenv("UPLOAD_CONCURRENCY", "4"))),
+    Stage("persist", persist_stage, io_executor, concurrency=int(os.getenv("PERSIST_CONCURRENCY", "1"))),
+    Stage("callback", callback_stage, io_executor),
+], queue_size=PIPELINE_QUEUE_SIZE)
+
+
+# Prediction UID -> task, for the jobs running in this process
+running_jobs = {}
 
 
 async def handle_prediction_job(body: dict):
@@ -164,76 +836,347 @@ async def handle_prediction_job(body: dict):
     image_url = body["image_s3_url"]
 
     ext = os.path.splitext(image_url)[1]
-    if ext not in [".jpg", ".jpeg", ".png"]:
+    if ext not in IMAGE_EXTENSIONS:
         print(f"Invalid image extension: {ext}")
         return
 
     original_key = os.path.basename(image_url)
-    original_path = os.path.join(UPLOAD_DIR, original_key)
-    predicted_path = os.path.join(PREDICTED_DIR, original_key)
+    job = PredictionJob(
+        uid=uid,
+        chat_id=chat_id,
+        original_key=original_key,
+        original_path=os.path.join(UPLOAD_DIR, original_key),
+        predicted_path=os.path.join(PREDICTED_DIR, original_key),
+    )
 
-    # Step 1: Download from S3
-    s3_client.download_file(S3_BUCKET_NAME, original_key, original_path)
+    # Copies of the same message arriving together share one execution
+    running = running_jobs.get(uid)
+    if running is None:
+        running = asyncio.create_task(run_prediction_job(job))
+        running_jobs[uid] = running
+        running.add_done_callback(lambda _: running_jobs.pop(uid, None))
+    else:
+        print(f"⏳ Prediction {uid} is already running, waiting for it")
+    # Shielded so one cancelled waiter doesn't cancel the run for the others
+    await asyncio.shield(running)
 
-    # Step 2: Run YOLO
-    results = model(original_path, device="cpu")
-    annotated = results[0].plot()
-    Image.fromarray(annotated).save(predicted_path)
 
-    # Step 3: Upload prediction result to S3
-    with open(predicted_path, "rb") as f:
-        s3_client.upload_fileobj(f, S3_BUCKET_NAME, os.path.basename(predicted_path))
+async def run_prediction_job(job: PredictionJob):
+    state = await storage_call("get_job_state", job.uid)
+    if stage_reached(state, "notified"):
+        print(f"✅ Prediction {job.uid} was already completed")
+        return
+    if not await storage_call("claim_job", job.uid, WORKER_ID, JOB_LEASE_SECONDS):
+        raise JobInProgressError(f"Prediction {job.uid} is being processed by another worker")
 
-    # Step 4: Save to DB
-    storage.save_prediction(uid, original_key, os.path.basename(predicted_path))
+    try:
+        # Read again now that we own it: the previous owner may have got further
+        resume(job, await storage_call("get_job_state", job.uid))
+        if job.state["stage"] != "received":
+            print(f"🔁 Resuming prediction {job.uid} after stage {job.state['stage']}")
+        # The sweeper must not delete this job's files from under it
+        with local_files.pinned(job.original_path, job.predicted_path):
+            await pipeline.submit(job)
+    finally:
+        await storage_call("release_job", job.uid, WORKER_ID)
 
-    labels = []
-    for box in results[0].boxes:
-        label = model.names[int(box.cls[0])]
-        score = float(box.conf[0])
-        bbox = box.xyxy[0].tolist()
-        storage.save_detection(uid, label, score, bbox)
-        labels.append(label)
 
-    # Step 5: Send result to Polybot
+async def process_message(msg: dict) -> bool:
+    jobs_inflight.add(1)
     try:
-        callback_url = f"{POLYBOT_CALLBACK_URL}/predictions/{uid}"
-        res = requests.post(callback_url, json={"chat_id": chat_id, "labels": labels})
-        print(f"POSTed result to {callback_url}: {res.status_code}")
+        with telemetry.span("sqs.message", telemetry.extract_context(msg),
+                            {"messaging.message.id": msg.get("MessageId", "")}):
+            body = json.loads(msg["Body"])
+            await handle_prediction_job(body)
+        return True
+    except JobInProgressError as e:
+        print(f"⏳ {e}, leaving the message for redelivery")
+        return False
     except Exception as e:
-        print(f"Failed to notify Polybot: {e}")
+        print(f"❌ Error processing message: {e}")
+        sqs_failed.add()
+        return False
+    finally:
+        jobs_inflight.add(-1)
 
 
-async def sqs_worker():
-    print("🔁 Starting SQS polling loop...")
+async def extend_visibility(messages: List[dict], pending: set, visibility_timeout: int):
+    """
+    Heartbeat: keep pushing back the visibility timeout of the messages still
+    being processed, so a slow job is never redelivered and run twice.
+    """
     while True:
-        response = sqs_client.receive_message(
+        await asyncio.sleep(visibility_timeout / 3)
+        entries = [
+            {"Id": str(i), "ReceiptHandle": messages[i]["ReceiptHandle"], "VisibilityTimeout": visibility_timeout}
+            for i in sorted(pending)
+        ]
+        if not entries:
+            return
+        try:
+            response = await asyncio.to_thread(
+                sqs_client.change_message_visibility_batch,
+                QueueUrl=SQS_QUEUE_URL,
+                Entries=entries
+            )
+            visibility_extended.add(len(response.get("Successful", [])))
+            for failure in response.get("Failed", []):
+                print(f"❌ Failed to extend visibility of message {failure['Id']}: {failure.get('Message')}")
+        except Exception as e:
+            print(f"❌ Error extending message visibility: {e}")
+
+
+async def process_batch(messages: List[dict], limiter: AdaptiveLimiter, visibility_timeout: int):
+    pending = set(range(len(messages)))
+
+    async def run(i, msg):
+        try:
+            return await process_message(msg)
+        finally:
+            pending.discard(i)
+            limiter.release()
+
+    heartbeat = asyncio.create_task(extend_visibility(messages, pending, visibility_timeout))
+    try:
+        succeeded = await asyncio.gather(*(run(i, msg) for i, msg in enumerate(messages)))
+    finally:
+        heartbeat.cancel()
+
+    # Failed messages are left on the queue and redelivered after the visibility timeout
+    entries = [
+        {"Id": str(i), "ReceiptHandle": msg["ReceiptHandle"]}
+        for i, (msg, ok) in enumerate(zip(messages, succeeded)) if ok
+    ]
+    if not entries:
+        return
+    try:
+        response = await asyncio.to_thread(
+            sqs_client.delete_message_batch,
             QueueUrl=SQS_QUEUE_URL,
-            MaxNumberOfMessages=1,
-            WaitTimeSeconds=10
+            Entries=entries
         )
+        sqs_deleted.add(len(response.get("Successful", [])))
+        for failure in response.get("Failed", []):
+            print(f"❌ Failed to delete message {failure['Id']}: {failure.get('Message')}")
+    except Exception as e:
+        print(f"❌ Error deleting messages: {e}")
+
+
+def queue_attribute(name: str) -> Optional[int]:
+    try:
+        attributes = sqs_client.get_queue_attributes(QueueUrl=SQS_QUEUE_URL, AttributeNames=[name])
+        return int(attributes["Attributes"][name])
+    except Exception as e:
+        print(f"❌ Error reading queue attribute {name}: {e}")
+        return None
+
+
+async def adapt_concurrency(limiter: AdaptiveLimiter):
+    psutil.cpu_percent(None)  # the first call only sets the reference point
+    while True:
+        await asyncio.sleep(ADAPTIVE_INTERVAL)
+        cpu = psutil.cpu_percent(None)
+        backlog = await asyncio.to_thread(queue_attribute, "ApproximateNumberOfMessages")
+        previous = limiter.limit
+        limit = limiter.adjust(cpu, backlog)
+        inflight_limit.set(limit)
+        if limit != previous:
+            print(f"🎚️ In-flight limit {previous} → {limit} (CPU {cpu:.0f}%, backlog {backlog})")
+
+
+async def sweep_local_files():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(LOCAL_FILES_SWEEP_INTERVAL)
+        try:
+            removed = await loop.run_in_executor(io_executor, local_files.sweep)
+            if removed:
+                print(f"🧹 Deleted {removed} local files, {local_files.size / 1024 / 1024:.0f} MB left")
+        except Exception as e:
+            print(f"❌ Local file sweep failed: {e}")
+
+
+async def prune_storage():
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            # Pruned predictions are dropped from the prediction cache as they go
+            result = await loop.run_in_executor(io_executor, lambda: prune_sqlite(
+                "predictions.db", RETENTION_DAYS, ARCHIVE_DIR, on_pruned=storage.invalidate
+            ))
+            if result["predictions"] or result["jobs"]:
+                print(f"🗑️ Pruned {result['predictions']} predictions and {result['jobs']} jobs older than "
+                      f"{RETENTION_DAYS:g} days, freed {result['pages_freed']} pages")
+            for path in result["archived"]:
+                print(f"📦 Archived to {path}")
+        except Exception as e:
+            print(f"❌ Retention run failed: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL_HOURS * 3600)
+
+
+async def sqs_worker():
+    if not SQS_QUEUE_URL:
+        raise RuntimeError("SQS_QUEUE_URL is not set")
+    print("🔁 Starting SQS polling loop...")
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(PREDICTED_DIR, exist_ok=True)
+    await pipeline.start()
+    await callbacks.start()
+
+    visibility_timeout = SQS_VISIBILITY_TIMEOUT or await asyncio.to_thread(queue_attribute, "VisibilityTimeout") or 30
+    if ADAPTIVE_CONCURRENCY:
+        limiter = AdaptiveLimiter(MAX_INFLIGHT_JOBS, ADAPTIVE_MIN_INFLIGHT, ADAPTIVE_MAX_INFLIGHT,
+                                  cpu_high=ADAPTIVE_CPU_HIGH)
+    else:
+        limiter = AdaptiveLimiter(MAX_INFLIGHT_JOBS, MAX_INFLIGHT_JOBS, MAX_INFLIGHT_JOBS)
+    inflight_limit.set(limiter.limit)
+    # Per-job stage time (not queue wait) is what rises when the machine is oversubscribed
+    pipeline.on_stage_done = lambda stage, seconds, jobs: limiter.record_latency(stage.name, seconds / jobs)
+    tasks = set()
+    if ADAPTIVE_CONCURRENCY:
+        tasks.add(asyncio.create_task(adapt_concurrency(limiter)))
+    tasks.add(asyncio.create_task(sweep_local_files()))
+    if RETENTION_DAYS and os.getenv("STORAGE_TYPE", "sqlite") != "dynamodb":
+        tasks.add(asyncio.create_task(prune_storage()))
+
+    while True:
+        # Messages pulled while the pipeline is full would only sit in memory
+        # with their visibility timeout running
+        while pipeline.saturated:
+            await asyncio.sleep(0.05)
+
+        # Only ask for as many messages as we have room for
+        wanted = await limiter.acquire(SQS_BATCH_SIZE)
+        try:
+            response = await asyncio.to_thread(
+                sqs_client.receive_message,
+                QueueUrl=SQS_QUEUE_URL,
+                MaxNumberOfMessages=wanted,
+                MessageAttributeNames=["All"],
+                WaitTimeSeconds=10
+            )
+        except Exception as e:
+            print(f"❌ Error receiving messages: {e}")
+            response = {}
+            await asyncio.sleep(1)
+
+        messages = response.get("Messages", [])
+        sqs_received.add(len(messages))
+        limiter.release(wanted - len(messages))
+
+        if messages:
+            task = asyncio.create_task(process_batch(messages, limiter, visibility_timeout))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+# Filled in by warm_up(); /health/ready reports them
+startup = {"import_seconds": round(IMPORT_SECONDS, 3), "model_seconds": None, "ready_seconds": None,
+           "model_warm": False, "error": None}
+
+
+async def warm_up():
+    """
+    Load the model and run one inference on the inference executor, so the
+    first real batch runs at full speed.
+    """
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        await loop.run_in_executor(inference_executor, lambda: model.get().warmup())
+        # Storage and AWS clients are cheap next to the model, build them now too
+        await asyncio.to_thread(lambda: (storage.get(), s3_client.get(), sqs_client.get(), local_files.get()))
+        if ASYNC_STORAGE:
+            await async_storage.start()
+    except Exception as e:
+        startup["error"] = str(e)
+        print(f"❌ Warm-up failed: {e}")
+        raise
+    startup["model_seconds"] = round(time.perf_counter() - started, 3)
+    startup["model_warm"] = True
+    startup["ready_seconds"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+    print(f"✅ Model warm after {startup['model_seconds']}s, "
+          f"{startup['ready_seconds']}s after import started (import took {startup['import_seconds']}s)")
+
 
-        for msg in response.get("Messages", []):
-            try:
-                body = json.loads(msg["Body"])
-                await handle_prediction_job(body)
-                sqs_client.delete_message(
-                    QueueUrl=SQS_QUEUE_URL,
-                    ReceiptHandle=msg["ReceiptHandle"]
-                )
-            except Exception as e:
-                print(f"❌ Error processing message: {e}")
+async def start_worker():
+    delay = WARM_UP_RETRY_SECONDS
+    for attempt in range(1, WARM_UP_ATTEMPTS + 1):
+        try:
+            await warm_up()
+            break
+        except Exception:
+            if attempt == WARM_UP_ATTEMPTS:
+                raise
+            print(f"🔁 Retrying warm-up in {delay}s (attempt {attempt} of {WARM_UP_ATTEMPTS} failed)")
+            await asyncio.sleep(delay)
+            delay *= 2
+    await sqs_worker()
 
-        await asyncio.sleep(0.1)
 
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(sqs_worker())
+    # Don't block startup on the model: /health/live answers right away and
+    # /health/ready turns true once warm_up() is done.
+    app.state.worker = asyncio.create_task(start_worker())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if callbacks.loaded:
+        await callbacks.stop()
+    if async_storage.loaded:
+        await async_storage.close()
+
+
 
+@app.get("/metrics")
+def get_metrics():
+    return {
+        "counters": metrics.snapshot(),
+        "histograms": metrics.histogram_snapshot(),
+        "dedup_hit_rate": metrics.ratio(dedup_hits, dedup_misses),
+        "prediction_cache_hit_rate": metrics.ratio(cache_hits, cache_misses),
+        "callbacks_pending": callbacks.pending() if callbacks.loaded else 0,
+        "startup": startup,
+    }
+
+
+def worker_error() -> Optional[BaseException]:
+    """The error the warm-up and SQS worker task stopped on, if it has."""
+    worker = getattr(app.state, "worker", None)
+    if worker is None or not worker.done() or worker.cancelled():
+        return None
+    return worker.exception()
 
 
 @app.get("/health")
 def health():
+    return health_live()
+
+
+@app.get("/health/live")
+def health_live():
+    error = worker_error()
+    if error is not None:
+        return JSONResponse({"status": "failed", "error": str(error)}, status_code=503)
     return {"status": "ok"}
 
 
+@app.get("/health/ready")
+async def health_ready():
+    """Ready once the model is warm and storage answers."""
+    checks = {"model": startup["model_warm"], "storage": False}
+    if (async_storage if ASYNC_STORAGE else storage).loaded:
+        try:
+            await storage_call("ping")
+            checks["storage"] = True
+        except Exception as e:
+            checks["storage_error"] = str(e)
+    ready = checks["model"] and checks["storage"]
+    body = {"status": "ready" if ready else "starting", "checks": checks, **startup}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+
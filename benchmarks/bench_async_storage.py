@@ -0,0 +1,130 @@
+"""
+Throughput of storage calls made from the event loop: the blocking backends
+run on threads with asyncio.to_thread (what the app does by default) against
+the async backends awaited directly (ASYNC_STORAGE=true).
+
+Each run issues --operations calls from --concurrency coroutines at once,
+a mix of get_prediction reads and, with --write-ratio, job claim/release
+writes, and reports operations per second with p50/p95/p99 latency. DynamoDB
+runs against moto's server mode (pip install "moto[server]"), which serves a
+few dozen requests per second in-process: its numbers only check that the
+async client works under load, use a real table to compare throughput (and
+fewer --operations against moto).
+
+    python benchmarks/bench_async_storage.py [--backends sqlite dynamodb] [--concurrency 1 16 64]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import create_predictions_table, percentiles, print_table, write_results  # noqa: E402
+
+TABLE_NAME = "PredictionsBench"
+DETECTIONS = [{"label": "person", "score": 0.5 + i / 20, "box": [i, i, i + 10.0, i + 10.0]} for i in range(10)]
+
+
+async def run_load(call, uids, operations, concurrency, write_ratio):
+    rng = random.Random(0)
+    plan = iter([(rng.random() < write_ratio, rng.choice(uids)) for _ in range(operations)])
+    samples = []
+
+    async def client(number):
+        # The coroutines take turns pulling from one shared plan
+        for write, uid in plan:
+            started = time.perf_counter()
+            if write:
+                await call("claim_job", uid, f"bench-{number}", 60)
+                await call("release_job", uid, f"bench-{number}")
+            else:
+                await call("get_prediction", uid)
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return dict(percentiles(samples), ops_per_sec=operations / elapsed)
+
+
+async def bench(sync_storage, async_storage, args):
+    uids = [f"pred-{i}" for i in range(args.predictions)]
+    for uid in uids:
+        sync_storage.save_prediction_with_detections(uid, "a.jpg", "a.jpg", DETECTIONS)
+
+    def threaded(operation, *call_args):
+        return asyncio.to_thread(getattr(sync_storage, operation), *call_args)
+
+    def awaited(operation, *call_args):
+        return getattr(async_storage, operation)(*call_args)
+
+    results = {}
+    await async_storage.start()
+    try:
+        for concurrency in args.concurrency:
+            for mode, call in (("threaded", threaded), ("async", awaited)):
+                results[f"{mode}_c{concurrency}"] = await run_load(
+                    call, uids, args.operations, concurrency, args.write_ratio
+                )
+    finally:
+        await async_storage.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", choices=["sqlite", "dynamodb"], default=["sqlite", "dynamodb"])
+    parser.add_argument("--predictions", type=int, default=200)
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--readers", type=int, default=4, help="reader connections of the async SQLite pool")
+    parser.add_argument("--max-connections", type=int, default=50, help="HTTP pool of the async DynamoDB client")
+    parser.add_argument("--output", help="results file, defaults to benchmarks/results/async_storage-<commit>.json")
+    args = parser.parse_args()
+
+    results = {}
+    for backend in args.backends:
+        if backend == "sqlite":
+            from storage.async_sqlite_storage import AsyncSQLiteStorage
+            from storage.sqlite_storage import SQLiteStorage
+            with tempfile.TemporaryDirectory() as workdir:
+                db_path = os.path.join(workdir, "predictions.db")
+                results[backend] = asyncio.run(bench(
+                    SQLiteStorage(db_path), AsyncSQLiteStorage(db_path, readers=args.readers), args
+                ))
+        else:
+            os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+            os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+            from moto.server import ThreadedMotoServer
+            from storage.async_dynamodb_storage import AsyncDynamoDBStorage
+            from storage.dynamodb_storage import DynamoDBStorage
+            server = ThreadedMotoServer(port=0, verbose=False)
+            server.start()
+            try:
+                # Read by both boto3 and aioboto3
+                os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = f"http://127.0.0.1:{server.get_host_and_port()[1]}"
+                create_predictions_table(TABLE_NAME)
+                results[backend] = asyncio.run(bench(
+                    DynamoDBStorage(TABLE_NAME),
+                    AsyncDynamoDBStorage(TABLE_NAME, max_connections=args.max_connections),
+                    args,
+                ))
+            finally:
+                server.stop()
+
+        print(backend)
+        print_table(results[backend])
+        for name, summary in results[backend].items():
+            print(f"{name:<32} {summary['ops_per_sec']:>10.0f} ops/s")
+        print()
+
+    write_results("async_storage", results, vars(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
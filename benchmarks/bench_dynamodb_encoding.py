@@ -0,0 +1,105 @@
+"""
+Compare the DynamoDB detection item encodings and detection_id hashes.
+
+Reports the billed item size (DynamoDB rounds writes up to 1 KB units) and the
+CPU cost of building and decoding items for the "decimal" and "packed" box
+encodings, plus the cost of the MD5 detection_id against cheaper digests.
+
+    python benchmarks/bench_dynamodb_encoding.py [--boxes 50] [--repeat 2000]
+"""
+import argparse
+import hashlib
+import math
+import os
+import random
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from boto3.dynamodb.types import Binary  # noqa: E402
+
+from storage.dynamodb_storage import decode_box, detection_id, encode_box  # noqa: E402
+
+
+def attribute_size(value) -> int:
+    """Approximate DynamoDB attribute value size in bytes."""
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, Decimal):
+        digits = len(value.normalize().as_tuple().digits)
+        return math.ceil(digits / 2) + 1
+    if isinstance(value, Binary):
+        return len(value.value)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, list):
+        return 3 + sum(1 + attribute_size(v) for v in value)
+    raise TypeError(type(value))
+
+
+def item_size(item: dict) -> int:
+    return sum(len(name) + attribute_size(value) for name, value in item.items())
+
+
+def random_detection():
+    x1, y1 = random.uniform(0, 4000), random.uniform(0, 3000)
+    return (
+        random.choice(["person", "car", "dog", "traffic light"]),
+        random.random(),
+        [x1, y1, x1 + random.uniform(1, 500), y1 + random.uniform(1, 500)],
+    )
+
+
+def build_item(label, score, box, encoding):
+    return {
+        "PK": "PRED#3f1c7f5e-8a52-4a4e-9d1e-0b6c1c3c2d11",
+        "SK": f"DETECT#{label}#{detection_id(label, score, box)}",
+        "label": label,
+        "score": Decimal(str(score)),
+        "box": encode_box(box, encoding),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--boxes", type=int, default=50, help="detections per prediction")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    detections = [random_detection() for _ in range(args.boxes)]
+
+    print(f"{'encoding':<10} {'bytes/item':>10} {'WCU/pred':>9} {'build us':>9} {'decode us':>10}")
+    for encoding in ("decimal", "packed"):
+        items = [build_item(label, score, box, encoding) for label, score, box in detections]
+        size = sum(item_size(item) for item in items) / len(items)
+        wcu = sum(math.ceil(item_size(item) / 1024) for item in items)
+        build = timeit.timeit(
+            lambda: [build_item(label, score, box, encoding) for label, score, box in detections],
+            number=args.repeat,
+        )
+        decode = timeit.timeit(lambda: [decode_box(item["box"]) for item in items], number=args.repeat)
+        per_item = 1e6 / (args.repeat * len(detections))
+        print(f"{encoding:<10} {size:>10.1f} {wcu:>9} {build * per_item:>9.2f} {decode * per_item:>10.2f}")
+
+    print()
+    print(f"{'detection_id':<14} {'us/id':>7}")
+    keys = [f"{label}-{score}-{box}".encode() for label, score, box in detections]
+    digests = {
+        "md5": lambda k: hashlib.md5(k).hexdigest(),
+        "sha1": lambda k: hashlib.sha1(k).hexdigest(),
+        "blake2b-16": lambda k: hashlib.blake2b(k, digest_size=16).hexdigest(),
+    }
+    for name, digest in digests.items():
+        elapsed = timeit.timeit(lambda: [digest(k) for k in keys], number=args.repeat)
+        print(f"{name:<14} {elapsed * 1e6 / (args.repeat * len(keys)):>7.3f}")
+    formatting = timeit.timeit(
+        lambda: [f"{label}-{score}-{box}" for label, score, box in detections], number=args.repeat
+    )
+    print(f"{'(key format)':<14} {formatting * 1e6 / (args.repeat * len(keys)):>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
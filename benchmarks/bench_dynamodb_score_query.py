@@ -0,0 +1,104 @@
+"""
+Benchmark get_predictions_by_score on a local DynamoDB stand-in (moto):
+full-table scan versus the score-bucket GSI.
+
+Besides wall time it reports how many items DynamoDB had to read, which is
+what the read capacity bill is based on (moto's timings are only indicative).
+
+    python benchmarks/bench_dynamodb_score_query.py [--detections 100000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+import boto3  # noqa: E402
+from moto import mock_aws  # noqa: E402
+
+from storage.dynamodb_migrations import create_score_index  # noqa: E402
+from storage.dynamodb_storage import DynamoDBStorage  # noqa: E402
+
+TABLE_NAME = "PredictionsBench"
+LABELS = ["person", "car", "dog", "cat", "bicycle", "traffic light"]
+
+
+def create_table():
+    table = boto3.resource("dynamodb", region_name="eu-west-2").create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{"AttributeName": "PK", "KeyType": "HASH"}, {"AttributeName": "SK", "KeyType": "RANGE"}],
+        AttributeDefinitions=[
+            {"AttributeName": "PK", "AttributeType": "S"},
+            {"AttributeName": "SK", "AttributeType": "S"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    create_score_index(table)
+    return table
+
+
+def load(storage, detections, per_prediction):
+    random.seed(0)
+    for p in range(0, detections, per_prediction):
+        boxes = [
+            {"label": random.choice(LABELS), "score": random.random(), "box": [i, i, i + 10.0, i + 10.0]}
+            for i in range(min(per_prediction, detections - p))
+        ]
+        storage.save_prediction_with_detections(f"pred-{p}", "a.jpg", "a.jpg", boxes)
+
+
+def count_reads(storage, min_score):
+    """Run the query the same way the storage does, summing ScannedCount."""
+    client_calls = []
+    operation_names = ("query", "scan")
+    originals = {name: getattr(storage.table, name) for name in operation_names}
+
+    def counting(name):
+        def wrapper(**kwargs):
+            response = originals[name](**kwargs)
+            client_calls.append(response.get("ScannedCount", 0))
+            return response
+        return wrapper
+
+    for name in operation_names:
+        setattr(storage.table, name, counting(name))
+    try:
+        start = time.perf_counter()
+        result = storage.get_predictions_by_score(min_score)
+        elapsed = time.perf_counter() - start
+    finally:
+        for name in operation_names:
+            setattr(storage.table, name, originals[name])
+    return len(result), elapsed, sum(client_calls), len(client_calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--detections", type=int, default=100_000)
+    parser.add_argument("--per-prediction", type=int, default=20)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.9, 0.99])
+    args = parser.parse_args()
+
+    with mock_aws():
+        create_table()
+        indexed = DynamoDBStorage(TABLE_NAME)
+        scanning = DynamoDBStorage(TABLE_NAME, score_index="")
+
+        start = time.perf_counter()
+        load(indexed, args.detections, args.per_prediction)
+        print(f"Loaded {args.detections} detections in {time.perf_counter() - start:.1f}s")
+
+        print(f"{'min_score':>9} {'mode':<6} {'matches':>8} {'items read':>10} {'requests':>8} {'seconds':>8}")
+        for threshold in args.thresholds:
+            for mode, storage in (("scan", scanning), ("index", indexed)):
+                matches, elapsed, read, requests = count_reads(storage, threshold)
+                print(f"{threshold:>9.2f} {mode:<6} {matches:>8} {read:>10} {requests:>8} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
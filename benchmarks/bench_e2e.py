@@ -0,0 +1,204 @@
+"""
+End-to-end benchmark of the SQS worker with no network access.
+
+S3, SQS and DynamoDB are served by moto and Polybot by a local stub server.
+The queue is filled with N distinct images, then `app.sqs_worker` runs until
+every callback has arrived. Reports jobs/sec, per-job and per-stage
+p50/p95/p99 latency and peak RSS, and writes them as JSON.
+
+    python benchmarks/bench_e2e.py --images 100 [--storage dynamodb] [--weights yolov8n.pt] [--image-size 4032x3024]
+
+Any other setting of the app (INFERENCE_ENGINE, INFERENCE_PROCESSES,
+INFERENCE_BATCH_SIZE, ...) is taken from the environment as usual.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import ROOT, peak_rss_mb, percentiles, print_table, write_results  # noqa: E402
+
+BUCKET = "yolo-bench"
+TABLE_NAME = "PredictionsBench"
+
+
+class StubPolybot(ThreadingHTTPServer):
+    """Accepts callbacks and remembers when each one arrived."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.received = {}
+        self.all_received = threading.Event()
+        self.expected = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        server = self.server
+        server.received[self.path.rsplit("/", 1)[-1]] = time.perf_counter()
+        if len(server.received) >= server.expected:
+            server.all_received.set()
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def distinct_images(count, size=None):
+    """
+    Variants of the test image that differ slightly, so dedup never kicks in,
+    optionally resized to `size` (width, height) like a phone photo.
+    """
+    import cv2
+
+    base = cv2.imread(os.path.join(ROOT, "tests", "test_image.jpg"))
+    if size:
+        base = cv2.resize(base, size, interpolation=cv2.INTER_CUBIC)
+    for i in range(count):
+        image = base.copy()
+        image[i // base.shape[1] % base.shape[0], i % base.shape[1]] = (i % 256, (i // 256) % 256, 255)
+        yield cv2.imencode(".jpg", image)[1].tobytes()
+
+
+def time_stages(pipeline, samples):
+    """Wrap every stage function to record its duration per call."""
+    for stage in pipeline.stages:
+        durations = samples.setdefault(stage.name, [])
+
+        def timed(func, durations, arg):
+            started = time.perf_counter()
+            try:
+                return func(arg)
+            finally:
+                durations.append(time.perf_counter() - started)
+
+        stage.func = functools.partial(timed, stage.func, durations)
+
+
+async def run(app, sqs, queue_url, polybot, images, timeout):
+    job_latency = []
+    handle = app.handle_prediction_job
+
+    async def timed_handle(body):
+        started = time.perf_counter()
+        await handle(body)
+        job_latency.append(time.perf_counter() - started)
+
+    app.handle_prediction_job = timed_handle
+
+    await asyncio.get_running_loop().run_in_executor(app.inference_executor, app.model.warmup)
+    started = time.perf_counter()
+    worker = asyncio.create_task(app.sqs_worker())
+    try:
+        delivered = await asyncio.to_thread(polybot.all_received.wait, timeout)
+        elapsed = (max(polybot.received.values()) if delivered else time.perf_counter()) - started
+    finally:
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+        await app.pipeline.stop()
+        await app.callbacks.stop()
+
+    attributes = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=["All"])["Attributes"]
+    return {
+        "completed": len(polybot.received),
+        "timed_out": not delivered,
+        "seconds": elapsed,
+        "jobs_per_sec": len(polybot.received) / elapsed if elapsed else 0.0,
+        "left_in_queue": int(attributes["ApproximateNumberOfMessages"])
+        + int(attributes["ApproximateNumberOfMessagesNotVisible"]),
+        "job_latency": percentiles(job_latency),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--storage", choices=["sqlite", "dynamodb"], default="sqlite")
+    parser.add_argument("--weights", help="YOLO weights, defaults to YOLO_WEIGHTS or yolov8n.pt")
+    parser.add_argument("--image-size", type=lambda value: tuple(int(v) for v in value.split("x")),
+                        help="WIDTHxHEIGHT of the uploaded images, defaults to the test image's")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for all callbacks")
+    parser.add_argument("--output", help="results file, defaults to benchmarks/results/e2e-<commit>.json")
+    args = parser.parse_args()
+
+    polybot = StubPolybot()
+    polybot.expected = args.images
+    threading.Thread(target=polybot.serve_forever, daemon=True).start()
+
+    os.environ.update({
+        "AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing", "AWS_DEFAULT_REGION": "eu-west-2",
+        "S3_BUCKET_NAME": BUCKET, "POLYBOT_CALLBACK_URL": polybot.url,
+        "STORAGE_TYPE": args.storage, "DYNAMODB_TABLE": TABLE_NAME,
+    })
+    if args.weights:
+        os.environ["YOLO_WEIGHTS"] = os.path.abspath(args.weights)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    import boto3
+    from moto import mock_aws
+
+    with mock_aws(), tempfile.TemporaryDirectory() as workdir:
+        s3 = boto3.client("s3", region_name="eu-west-2")
+        s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+        sqs = boto3.client("sqs", region_name="eu-west-2")
+        queue_url = sqs.create_queue(QueueName="yolo-bench")["QueueUrl"]
+        os.environ["SQS_QUEUE_URL"] = queue_url
+        if args.storage == "dynamodb":
+            from common import create_predictions_table
+            create_predictions_table(TABLE_NAME)
+
+        for i, data in enumerate(distinct_images(args.images, args.image_size)):
+            key = f"bench-{i}.jpg"
+            s3.put_object(Bucket=BUCKET, Key=key, Body=data)
+            sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps(
+                {"prediction_id": f"bench-{i}", "chat_id": 1, "image_s3_url": key}
+            ))
+
+        # uploads/, the SQLite database and the callback outbox go to the temporary directory
+        os.chdir(workdir)
+        started = time.perf_counter()
+        import app
+        import_seconds = time.perf_counter() - started
+
+        stage_samples = {}
+        time_stages(app.pipeline, stage_samples)
+        results = asyncio.run(run(app, sqs, queue_url, polybot, args.images, args.timeout))
+        if hasattr(app.model, "close"):
+            app.model.close()
+
+    os.chdir(ROOT)
+    results["import_seconds"] = import_seconds
+    results["stages"] = {name: percentiles(samples) for name, samples in stage_samples.items()}
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    print(f"{results['completed']}/{args.images} jobs in {results['seconds']:.2f}s "
+          f"= {results['jobs_per_sec']:.2f} jobs/s, peak RSS {results['peak_rss_mb']:.0f} MB")
+    print_table({"job": results["job_latency"], **{f"stage {k}": v for k, v in results["stages"].items()}})
+
+    params = {"images": args.images, "storage": args.storage, "image_size": args.image_size}
+    params.update({key: value for key, value in os.environ.items() if key.startswith(
+        ("INFERENCE_", "SQS_BATCH", "MAX_INFLIGHT", "PIPELINE_", "IO_WORKERS", "IN_MEMORY", "YOLO_WEIGHTS",
+         "REDUCED_DECODE", "ANNOTATED_MAX_SIDE")
+    )})
+    write_results("e2e", results, params, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Microbenchmark of inference alone: images/sec and per-call latency for each
+engine and batch size, on already-decoded images.
+
+    python benchmarks/bench_inference.py [--engines torch onnx openvino] [--batch-sizes 1 4 8]
+
+Weights and engine options come from the usual environment variables
+(YOLO_WEIGHTS, INFERENCE_THREADS, INFERENCE_IMGSZ, INFERENCE_INT8, ...).
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import ROOT, peak_rss_mb, percentiles, print_table, write_results  # noqa: E402
+
+from imaging import load_image  # noqa: E402
+from inference import build_engine  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", nargs="+", default=["torch"], choices=["torch", "onnx", "openvino"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--repeat", type=int, default=10, help="calls per batch size")
+    parser.add_argument("--image", default=os.path.join(ROOT, "tests", "test_image.jpg"))
+    parser.add_argument("--output", help="results file, defaults to benchmarks/results/inference-<commit>.json")
+    args = parser.parse_args()
+
+    image = load_image(args.image)
+    threads = int(os.getenv("INFERENCE_THREADS", "0")) or None
+    results = {}
+    for engine_type in args.engines:
+        started = time.perf_counter()
+        engine = build_engine(engine_type, threads)
+        engine.warmup()
+        load_seconds = time.perf_counter() - started
+
+        results[engine_type] = {"load_seconds": load_seconds}
+        for batch_size in args.batch_sizes:
+            batch = [image] * batch_size
+            latencies = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                engine.predict(batch)
+                latencies.append(time.perf_counter() - started)
+            summary = percentiles(latencies)
+            summary["images_per_sec"] = batch_size * len(latencies) / sum(latencies)
+            results[engine_type][f"batch_{batch_size}"] = summary
+
+        print(f"{engine_type} (loaded in {load_seconds:.1f}s)")
+        print_table({
+            f"batch {size}": results[engine_type][f"batch_{size}"] for size in args.batch_sizes
+        })
+        for size in args.batch_sizes:
+            print(f"  batch {size}: {results[engine_type][f'batch_{size}']['images_per_sec']:.1f} images/s")
+        print()
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    write_results("inference", results, vars(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Microbenchmark of the storage write and query paths for SQLiteStorage and
+DynamoDBStorage (on moto, so DynamoDB timings are only indicative).
+
+Measures save_prediction_with_detections, get_prediction and one page of the
+label and score listings, and writes p50/p95/p99 per operation as JSON.
+
+    python benchmarks/bench_storage.py [--backends sqlite dynamodb] [--predictions 500]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import create_predictions_table, percentiles, print_table, write_results  # noqa: E402
+
+TABLE_NAME = "PredictionsBench"
+LABELS = ["person", "car", "dog", "cat", "bicycle", "traffic light"]
+
+
+def detections(count):
+    return [
+        {"label": random.choice(LABELS), "score": random.random(), "box": [i, i, i + 10.0, i + 10.0]}
+        for i in range(count)
+    ]
+
+
+def timed(samples, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    samples.append(time.perf_counter() - started)
+    return result
+
+
+def bench(storage, predictions, per_prediction, queries, page_size):
+    random.seed(0)
+    samples = {"save": [], "get_prediction": [], "label_page": [], "score_page": []}
+    uids = [f"pred-{i}" for i in range(predictions)]
+    for uid in uids:
+        timed(samples["save"], storage.save_prediction_with_detections, uid, "a.jpg", "a.jpg",
+              detections(per_prediction))
+    for _ in range(queries):
+        timed(samples["get_prediction"], storage.get_prediction, random.choice(uids))
+        timed(samples["label_page"], storage.get_predictions_by_label_page, random.choice(LABELS), page_size, None)
+        timed(samples["score_page"], storage.get_predictions_by_score_page, random.uniform(0.5, 0.99), page_size, None)
+    return {operation: percentiles(values) for operation, values in samples.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", choices=["sqlite", "dynamodb"], default=["sqlite", "dynamodb"])
+    parser.add_argument("--predictions", type=int, default=500)
+    parser.add_argument("--per-prediction", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--output", help="results file, defaults to benchmarks/results/storage-<commit>.json")
+    args = parser.parse_args()
+
+    results = {}
+    for backend in args.backends:
+        if backend == "sqlite":
+            from storage.sqlite_storage import SQLiteStorage
+            with tempfile.TemporaryDirectory() as workdir:
+                storage = SQLiteStorage(os.path.join(workdir, "predictions.db"))
+                results[backend] = bench(storage, args.predictions, args.per_prediction, args.queries, args.page_size)
+        else:
+            os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+            os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+            from moto import mock_aws
+            from storage.dynamodb_storage import DynamoDBStorage
+            with mock_aws():
+                create_predictions_table(TABLE_NAME)
+                storage = DynamoDBStorage(TABLE_NAME)
+                results[backend] = bench(storage, args.predictions, args.per_prediction, args.queries, args.page_size)
+
+        print(backend)
+        print_table(results[backend])
+        print()
+
+    write_results("storage", results, vars(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Helpers shared by the benchmark scripts: percentiles, peak memory and
+machine-readable result files that can be compared between commits.
+"""
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+def percentiles(samples: List[float], points=(50, 95, 99)) -> Dict[str, float]:
+    """Nearest-rank percentiles, plus the mean and sample count."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    summary = {"count": len(ordered), "mean": sum(ordered) / len(ordered)}
+    for point in points:
+        rank = max(0, min(len(ordered) - 1, round(point / 100 * len(ordered) + 0.5) - 1))
+        summary[f"p{point}"] = ordered[rank]
+    return summary
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process plus its largest waited-for child."""
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return (self_kb + children_kb) / scale
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_results(name: str, results: Dict, params: Dict, output: Optional[str] = None) -> str:
+    """
+    Write results as JSON, by default to benchmarks/results/<name>-<commit>.json,
+    and return the path.
+    """
+    commit = git_commit()
+    path = output or os.path.join(RESULTS_DIR, f"{name}-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    document = {
+        "benchmark": name,
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+    print(f"Results written to {path}")
+    return path
+
+
+def print_table(rows: Dict[str, Dict[str, float]], unit_scale: float = 1000.0, unit: str = "ms"):
+    print(f"{'':<32} {'count':>7} {'p50 ' + unit:>10} {'p95 ' + unit:>10} {'p99 ' + unit:>10}")
+    for name, summary in rows.items():
+        if not summary.get("count"):
+            continue
+        print(f"{name:<32} {summary['count']:>7} {summary['p50'] * unit_scale:>10.2f} "
+              f"{summary['p95'] * unit_scale:>10.2f} {summary['p99'] * unit_scale:>10.2f}")
+
+
+def create_predictions_table(table_name: str, region: str = "eu-west-2"):
+    """Create the predictions table (with its label and score indexes) on a DynamoDB stand-in."""
+    import boto3
+    from storage.dynamodb_migrations import create_score_index
+
+    table = boto3.resource("dynamodb", region_name=region).create_table(
+        TableName=table_name,
+        KeySchema=[{"AttributeName": "PK", "KeyType": "HASH"}, {"AttributeName": "SK", "KeyType": "RANGE"}],
+        AttributeDefinitions=[
+            {"AttributeName": "PK", "AttributeType": "S"},
+            {"AttributeName": "SK", "AttributeType": "S"},
+            {"AttributeName": "label", "AttributeType": "S"},
+        ],
+        GlobalSecondaryIndexes=[{
+            "IndexName": "LabelIndex",
+            "KeySchema": [{"AttributeName": "label", "KeyType": "HASH"}],
+            "Projection": {"ProjectionType": "ALL"},
+        }],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    create_score_index(table)
+    return table
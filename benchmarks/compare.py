@@ -0,0 +1,62 @@
+"""
+Compare two benchmark result files, e.g. from two commits:
+
+    python benchmarks/compare.py benchmarks/results/e2e-abc1234.json benchmarks/results/e2e-def5678.json
+
+Prints every numeric result side by side and marks changes larger than
+--threshold (default 10%). Latencies, durations and memory are better when
+lower, everything else (jobs_per_sec, images_per_sec) when higher. Exits with
+status 1 if anything regressed, so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+LOWER_IS_BETTER = ("mean", "p50", "p95", "p99", "seconds", "rss", "left_in_queue")
+IGNORED = ("count", "completed", "timed_out")
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    before = dict(flatten(baseline["results"]))
+    after = dict(flatten(candidate["results"]))
+    print(f"{baseline['benchmark']}: {baseline['commit']} -> {candidate['commit']}")
+    print(f"{'metric':<44} {'before':>12} {'after':>12} {'change':>8}")
+
+    regressions = 0
+    for name in sorted(before.keys() & after.keys()):
+        leaf = name.rsplit(".", 1)[-1]
+        if leaf in IGNORED:
+            continue
+        old, new = before[name], after[name]
+        change = (new - old) / old if old else 0.0
+        lower_is_better = any(marker in leaf for marker in LOWER_IS_BETTER)
+        worse = change > args.threshold if lower_is_better else change < -args.threshold
+        better = change < -args.threshold if lower_is_better else change > args.threshold
+        flag = "  REGRESSION" if worse else ("  improved" if better else "")
+        regressions += worse
+        print(f"{name:<44} {old:>12.4f} {new:>12.4f} {change:>+7.1%}{flag}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import random
+import sqlite3
+import time
+from typing import Dict, Optional
+
+import httpx
+
+import metrics
+
+delivered = metrics.counter("callbacks.delivered", "Callbacks accepted by Polybot")
+retried = metrics.counter("callbacks.retries", "Callback attempts that failed and were retried")
+rejected = metrics.counter("callbacks.rejected", "Callbacks dropped after a non-retryable 4xx response")
+
+
+class CallbackDispatcher:
+    """
+    Delivers prediction results to Polybot without blocking the pipeline.
+
+    `enqueue` records the callback in an SQLite outbox and hands it to a pool
+    of sender tasks sharing one keep-alive HTTP client. Failed deliveries are
+    retried with exponential backoff and full jitter. Whatever is still in the
+    outbox (failed, or pending at shutdown) is picked up again by a periodic
+    sweep and after a restart.
+
+    The outbox is keyed by prediction UID, so callbacks for a prediction that
+    hasn't been delivered yet are coalesced: only the latest payload is sent.
+    """
+
+    def __init__(self, base_url: str, outbox_path: str = "callbacks.db", concurrency: int = 4,
+                 queue_size: int = 1000, timeout: float = 5.0, max_attempts: int = 5,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0, sweep_interval: float = 30.0):
+        self.base_url = base_url
+        self.outbox_path = outbox_path
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sweep_interval = sweep_interval
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._scheduled = set()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._tasks = []
+        self._init_outbox()
+
+    def _init_outbox(self):
+        with sqlite3.connect(self.outbox_path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS callback_outbox (
+                    prediction_uid TEXT PRIMARY KEY,
+                    payload TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at REAL DEFAULT 0
+                )
+            """)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout),
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+        )
+        self._tasks = [asyncio.create_task(self._sender()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        self._scheduled.clear()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def enqueue(self, prediction_uid: str, payload: Dict) -> None:
+        """
+        Schedule a callback. Safe to call from any thread; never blocks on delivery.
+        """
+        with sqlite3.connect(self.outbox_path) as conn:
+            conn.execute("""
+                INSERT INTO callback_outbox (prediction_uid, payload, attempts, next_attempt_at)
+                VALUES (?, ?, 0, 0)
+                ON CONFLICT (prediction_uid) DO UPDATE SET payload = excluded.payload
+            """, (prediction_uid, json.dumps(payload)))
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._offer, prediction_uid)
+
+    def pending(self) -> int:
+        with sqlite3.connect(self.outbox_path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM callback_outbox").fetchone()[0]
+
+    def _offer(self, prediction_uid: str) -> None:
+        # Already queued or being sent: the sender reads the latest payload, and
+        # anything enqueued after the send is left for the next sweep
+        if prediction_uid in self._scheduled:
+            return
+        try:
+            self._queue.put_nowait(prediction_uid)
+            self._scheduled.add(prediction_uid)
+        except asyncio.QueueFull:
+            # Stays in the outbox; the sweep retries it once there's room
+            pass
+
+    def _load(self, prediction_uid: str) -> Optional[tuple]:
+        with sqlite3.connect(self.outbox_path) as conn:
+            return conn.execute("""
+                SELECT payload, attempts FROM callback_outbox WHERE prediction_uid = ?
+            """, (prediction_uid,)).fetchone()
+
+    def _delete(self, prediction_uid: str, payload: str) -> None:
+        # Only delete what was sent; a newer payload enqueued meanwhile stays
+        with sqlite3.connect(self.outbox_path) as conn:
+            conn.execute("""
+                DELETE FROM callback_outbox WHERE prediction_uid = ? AND payload = ?
+            """, (prediction_uid, payload))
+
+    def _reschedule(self, prediction_uid: str, attempts: int, delay: float) -> None:
+        with sqlite3.connect(self.outbox_path) as conn:
+            conn.execute("""
+                UPDATE callback_outbox SET attempts = ?, next_attempt_at = ? WHERE prediction_uid = ?
+            """, (attempts, time.time() + delay, prediction_uid))
+
+    def _due(self) -> list:
+        with sqlite3.connect(self.outbox_path) as conn:
+            rows = conn.execute("""
+                SELECT prediction_uid FROM callback_outbox WHERE next_attempt_at <= ?
+                ORDER BY next_attempt_at
+            """, (time.time(),)).fetchall()
+            return [row[0] for row in rows]
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _sweeper(self) -> None:
+        while True:
+            for prediction_uid in await asyncio.to_thread(self._due):
+                self._offer(prediction_uid)
+            await asyncio.sleep(self.sweep_interval)
+
+    async def _sender(self) -> None:
+        while True:
+            prediction_uid = await self._queue.get()
+            try:
+                await self._deliver(prediction_uid)
+            except Exception as e:
+                print(f"Failed to notify Polybot for {prediction_uid}: {e}")
+            finally:
+                self._scheduled.discard(prediction_uid)
+                self._queue.task_done()
+
+    async def _deliver(self, prediction_uid: str) -> None:
+        row = await asyncio.to_thread(self._load, prediction_uid)
+        if row is None:
+            return
+        payload, attempts = row
+        url = f"{self.base_url}/predictions/{prediction_uid}"
+
+        for attempt in range(self.max_attempts):
+            try:
+                res = await self._client.post(url, content=payload, headers={"Content-Type": "application/json"})
+                if res.status_code < 500 and res.status_code not in (408, 429):
+                    print(f"POSTed result to {url}: {res.status_code}")
+                    # 4xx other than 408/429 won't succeed on retry either
+                    (delivered if res.status_code < 400 else rejected).add()
+                    await asyncio.to_thread(self._delete, prediction_uid, payload)
+                    return
+                error = f"HTTP {res.status_code}"
+            except httpx.HTTPError as e:
+                error = repr(e)
+            retried.add()
+            if attempt < self.max_attempts - 1:
+                await asyncio.sleep(self._backoff(attempts + attempt))
+
+        attempts += self.max_attempts
+        delay = self.backoff_max + self._backoff(attempts)
+        print(f"Failed to notify Polybot at {url} ({error}), retrying in {delay:.0f}s")
+        await asyncio.to_thread(self._reschedule, prediction_uid, attempts, delay)
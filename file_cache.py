@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterable
+
+import metrics
+
+
+class LocalFileCache:
+    """
+    Keeps the files under some working directories within a byte budget.
+
+    Files are tracked in least-recently-used order: `add` registers a newly
+    written file, `lookup` marks one as used. `sweep` deletes the least
+    recently used files until the total is under `max_bytes`, and any file
+    unused for `max_age` seconds (0 disables the age limit). Pinned files,
+    such as those of jobs still running, are never deleted.
+
+    The index is rebuilt from the directories at construction, ordered by
+    modification time.
+    """
+
+    def __init__(self, directories: Iterable[str], max_bytes: int, max_age: float = 0, name: str = "local_files"):
+        self.directories = list(directories)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = metrics.counter(f"{name}.hits", "Files found in the local cache")
+        self.misses = metrics.counter(f"{name}.misses", "Files missing from the local cache")
+        self.evictions = metrics.counter(f"{name}.evictions", "Files deleted from the local cache")
+        self.bytes = metrics.gauge(f"{name}.bytes", "Bytes of files in the local cache")
+        # path -> (size, last used)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._pins = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        self._rebuild()
+
+    @property
+    def size(self) -> int:
+        return self._total
+
+    def _rebuild(self):
+        files = []
+        for directory in self.directories:
+            os.makedirs(directory, exist_ok=True)
+            # scandir reuses the directory listing's stat data where it can
+            for entry in os.scandir(directory):
+                if entry.is_file():
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.path, stat.st_size))
+        with self._lock:
+            for mtime, path, size in sorted(files):
+                self._entries[path] = (size, mtime)
+                self._total += size
+            self.bytes.set(self._total)
+
+    def add(self, path: str) -> None:
+        """Register a file that was just written."""
+        size = os.path.getsize(path)
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous:
+                self._total -= previous[0]
+            self._entries[path] = (size, time.time())
+            self._total += size
+            self.bytes.set(self._total)
+
+    def lookup(self, path: str) -> bool:
+        """Whether the file is on disk, marking it as recently used."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and os.path.isfile(path):
+                self._entries[path] = (entry[0], time.time())
+                self._entries.move_to_end(path)
+                self.hits.add()
+                return True
+        if os.path.isfile(path):
+            # Written without add(), e.g. by another process
+            self.add(path)
+            self.hits.add()
+            return True
+        self._forget(path)
+        self.misses.add()
+        return False
+
+    @contextmanager
+    def pinned(self, *paths: str):
+        """Keep these files from being deleted while the block runs."""
+        with self._lock:
+            for path in paths:
+                self._pins[path] = self._pins.get(path, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for path in paths:
+                    self._pins[path] -= 1
+                    if not self._pins[path]:
+                        del self._pins[path]
+
+    def sweep(self) -> int:
+        """Delete files over the byte budget or age limit; returns how many."""
+        expired_before = time.time() - self.max_age if self.max_age else None
+        removed = 0
+        with self._lock:
+            # Least recently used first, so the first file within both limits
+            # ends the sweep; a pinned file is skipped but doesn't stop it
+            for path, (size, last_used) in list(self._entries.items()):
+                too_old = expired_before is not None and last_used < expired_before
+                if self._total <= self.max_bytes and not too_old:
+                    break
+                if path in self._pins:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                del self._entries[path]
+                self._total -= size
+                removed += 1
+            self.bytes.set(self._total)
+        if removed:
+            self.evictions.add(removed)
+        return removed
+
+    def _forget(self, path: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry:
+                self._total -= entry[0]
+                self.bytes.set(self._total)
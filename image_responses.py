@@ -0,0 +1,98 @@
+import os
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+from imaging import sha256_bytes, sha256_file
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def etag_for_bytes(data: bytes) -> str:
+    return f'"{sha256_bytes(data)[:32]}"'
+
+
+@lru_cache(maxsize=4096)
+def _file_etag(path: str, mtime_ns: int, size: int) -> str:
+    # Keyed on mtime and size too, so a rewritten file is hashed again
+    return f'"{sha256_file(path)[:32]}"'
+
+
+def etag_for_file(path: str) -> str:
+    stat = os.stat(path)
+    return _file_etag(path, stat.st_mtime_ns, stat.st_size)
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """Whether the client's If-None-Match already names this ETag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `bytes=` range into inclusive (start, end) offsets.
+
+    Returns None when the header should be ignored (not a byte range, or
+    several ranges), in which case the whole body is sent.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def bytes_response(request: Request, data: bytes, media_type: str, cache_control: str,
+                   etag: Optional[str] = None) -> Response:
+    """Serve an in-memory image with ETag revalidation and single byte ranges."""
+    etag = etag or etag_for_bytes(data)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range == etag):
+        try:
+            byte_range = parse_range(range_header, len(data))
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{len(data)}"
+            return Response(status_code=416, headers=headers)
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return Response(data[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+
+    return Response(data, media_type=media_type, headers=headers)
+
+
+def file_response(request: Request, path: str, media_type: Optional[str], cache_control: str) -> Response:
+    """Serve a local image with a content-hash ETag; FileResponse handles Range."""
+    etag = etag_for_file(path)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
@@ -0,0 +1,177 @@
+import hashlib
+import io
+import math
+import os
+from typing import NamedTuple, Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+PIL_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG"}
+
+# EXIF orientation -> the transpose that turns the image upright
+EXIF_ORIENTATION = 0x0112
+ORIENTATION_TRANSPOSES = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def open_image(source: Union[str, bytes]) -> Image.Image:
+    """Open an image file or encoded image bytes without decoding the pixels yet."""
+    return Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+
+
+def upright_bgr(image: Image.Image) -> np.ndarray:
+    """
+    Decode an open image into a BGR uint8 array, the layout YOLO expects for
+    numpy sources, turned upright by its EXIF orientation as OpenCV (and so
+    YOLO reading a file) does.
+    """
+    transpose = ORIENTATION_TRANSPOSES.get(image.getexif().get(EXIF_ORIENTATION))
+    rgb = image.convert("RGB")
+    if transpose is not None:
+        rgb = rgb.transpose(transpose)
+    return cv2.cvtColor(np.asarray(rgb), cv2.COLOR_RGB2BGR)
+
+
+def upright_size(image: Image.Image) -> Tuple[int, int]:
+    """(width, height) of an open image once turned upright."""
+    width, height = image.size
+    if image.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+
+def decode_image(data: bytes) -> np.ndarray:
+    """Decode encoded image bytes into an upright BGR uint8 array."""
+    with open_image(data) as image:
+        return upright_bgr(image)
+
+
+def load_image(path: str) -> np.ndarray:
+    """Read an image file into an upright BGR uint8 array."""
+    with open_image(path) as image:
+        return upright_bgr(image)
+
+
+def decode_reduced(source: Union[str, bytes], max_side: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Decode an image at no more resolution than fitting it in a max_side
+    square needs. JPEGs are decoded with DCT scaling (PIL's draft mode) at
+    1/2, 1/4 or 1/8 of their size, the smallest scale still at least that
+    big, which skips most of the decoding work and memory of a large photo.
+    Other formats, and images that already fit, are decoded in full.
+
+    Returns the upright BGR image and the (width, height) of the full-size
+    upright image.
+    """
+    with open_image(source) as image:
+        full_size = upright_size(image)
+        width, height = image.size
+        ratio = max_side / max(width, height)
+        if ratio < 1:
+            image.draft("RGB", (math.ceil(width * ratio), math.ceil(height * ratio)))
+        return upright_bgr(image), full_size
+
+
+def decode_fitted(source: Union[str, bytes], max_side: int) -> Tuple[np.ndarray, Tuple[float, float]]:
+    """
+    Decode an image resized to fit in a max_side square (0 for the full
+    size), for drawing on. Returns the BGR image and its (x, y) scale
+    relative to the full-size upright image.
+    """
+    if not max_side:
+        with open_image(source) as image:
+            return upright_bgr(image), (1.0, 1.0)
+    image, (full_width, full_height) = decode_reduced(source, max_side)
+    height, width = image.shape[:2]
+    ratio = max_side / max(width, height)
+    if ratio < 1:
+        width, height = round(width * ratio), round(height * ratio)
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    return image, (width / full_width, height / full_height)
+
+
+class BoxTransform(NamedTuple):
+    """
+    How an image given to the model relates to the full-size original:
+    letterbox `ratio` and `pad`, the decoded image's `scale` down from the
+    original and the original's `full_size`.
+    """
+    ratio: float
+    pad: Tuple[int, int]
+    scale: Tuple[float, float]
+    full_size: Tuple[int, int]
+
+    def restore(self, boxes: np.ndarray) -> np.ndarray:
+        """Map (n, 4) xyxy boxes from model input pixels back to full-size image pixels."""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        restored = np.empty_like(boxes)
+        for axis in (0, 1):
+            restored[:, axis::2] = np.clip(
+                (boxes[:, axis::2] - self.pad[axis]) / self.ratio / self.scale[axis], 0, self.full_size[axis]
+            )
+        return restored
+
+
+def prepare_image(source: Union[str, bytes], size: int = 640) -> Tuple[np.ndarray, BoxTransform]:
+    """
+    Decode an image straight to the model's size x size letterboxed input,
+    at reduced resolution when possible (see `decode_reduced`). Boxes
+    detected on it map back to the original with the returned transform.
+    """
+    image, full_size = decode_reduced(source, size)
+    height, width = image.shape[:2]
+    padded, ratio, pad = letterbox(image, size)
+    return padded, BoxTransform(ratio, pad, (width / full_size[0], height / full_size[1]), full_size)
+
+
+def letterbox(image: np.ndarray, size: int = 640, fill: int = 114):
+    """
+    Resize an image to fit in a size x size square, keeping the aspect ratio,
+    and pad the rest with `fill` (what YOLO was trained with).
+
+    Returns the padded image, the scale ratio and the (x, y) padding so boxes
+    can be mapped back with (xy - pad) / ratio.
+    """
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = round(width * ratio), round(height * ratio)
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    pad_x, pad_y = (size - new_width) / 2, (size - new_height) / 2
+    top, left = round(pad_y - 0.1), round(pad_x - 0.1)
+    padded = np.full((size, size, 3), fill, dtype=np.uint8)
+    padded[top:top + new_height, left:left + new_width] = image
+    return padded, ratio, (left, top)
+
+
+def encode_image(bgr: np.ndarray, filename: str) -> bytes:
+    """
+    Encode a BGR array (e.g. the output of `results[0].plot()`) using the
+    format implied by the file extension.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    buffer = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(bgr[:, :, ::-1])).save(buffer, format=PIL_FORMATS.get(ext, "PNG"))
+    return buffer.getvalue()
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
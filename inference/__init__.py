@@ -0,0 +1,47 @@
+import os
+from typing import Optional
+
+from .base import InferenceEngine
+
+
+def build_engine(engine_type: str, threads: Optional[int] = None) -> InferenceEngine:
+    """
+    Build a single in-process engine of the given type (torch, onnx or
+    openvino). Backends are imported lazily so only the chosen runtime needs
+    to be installed.
+    """
+    weights = os.getenv("YOLO_WEIGHTS", "yolov8n.pt")
+
+    if engine_type == "torch":
+        from .torch_engine import TorchEngine
+        return TorchEngine(weights, threads=threads)
+
+    options = {
+        "cache_dir": os.getenv("MODEL_CACHE_DIR", "models"),
+        "imgsz": int(os.getenv("INFERENCE_IMGSZ", "640")),
+        "threads": threads,
+        "int8": os.getenv("INFERENCE_INT8", "false").lower() == "true",
+    }
+    if engine_type == "onnx":
+        from .onnx_engine import OnnxEngine
+        return OnnxEngine(weights, **options)
+    elif engine_type == "openvino":
+        from .openvino_engine import OpenVINOEngine
+        return OpenVINOEngine(weights, **options)
+    else:
+        raise ValueError(f"Unsupported INFERENCE_ENGINE: {engine_type}")
+
+
+def get_engine() -> InferenceEngine:
+    """
+    Build the engine selected by INFERENCE_ENGINE. With INFERENCE_PROCESSES > 0
+    the model runs in that many worker processes instead of in this one.
+    """
+    engine_type = os.getenv("INFERENCE_ENGINE", "torch").lower()
+    threads = int(os.getenv("INFERENCE_THREADS", "0")) or None
+    processes = int(os.getenv("INFERENCE_PROCESSES", "0"))
+
+    if processes > 0:
+        from .process_pool import ProcessPoolEngine
+        return ProcessPoolEngine(engine_type, processes=processes, threads=threads)
+    return build_engine(engine_type, threads)
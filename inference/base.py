@@ -0,0 +1,49 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List
+
+import numpy as np
+
+
+class InferenceEngine(ABC):
+    """
+    Runs the YOLO detector. Every backend returns ultralytics `Results`
+    objects (one per source) so callers can use `.boxes` and `.plot()`
+    regardless of the runtime underneath.
+    """
+
+    @property
+    @abstractmethod
+    def names(self) -> Dict[int, str]:
+        """
+        Class index to label mapping, identical for every backend.
+        """
+        pass
+
+    @abstractmethod
+    def predict(self, sources: List) -> List:
+        """
+        Run detection on a batch of sources (file paths or BGR numpy arrays).
+        """
+        pass
+
+    def warmup(self, imgsz: int = 640) -> None:
+        """
+        Run one inference on a blank image so the first real job doesn't pay
+        for lazy initialization (graph compilation, memory allocation, ...).
+        """
+        self.predict([np.zeros((imgsz, imgsz, 3), dtype=np.uint8)])
+
+
+def results_from_detections(image: np.ndarray, detections: List[Dict], names: Dict[int, str]):
+    """
+    Rebuild a `Results` from stored detections (label/score/box dicts) so
+    it can be plotted again without running the model.
+    """
+    import torch
+    from ultralytics.engine.results import Results
+
+    class_ids = {name: index for index, name in names.items()}
+    boxes = torch.tensor(
+        [[*d["box"], d["score"], class_ids[d["label"]]] for d in detections], dtype=torch.float32
+    ).reshape(-1, 6)
+    return Results(image, path="", names=names, boxes=boxes)
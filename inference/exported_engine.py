@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+from abc import abstractmethod
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+import torchvision
+from filelock import FileLock
+from ultralytics.engine.results import Results
+
+from imaging import letterbox, load_image
+from inference.base import InferenceEngine
+
+
+class ExportedEngine(InferenceEngine):
+    """
+    Base for runtimes that execute a YOLO model exported from the PyTorch
+    weights. The export runs once and is cached in `cache_dir` together with
+    the label mapping of the source model; later starts load the cached file.
+
+    Pre- and post-processing (letterbox, NMS, rescaling back to the original
+    image) run here with ultralytics' predict defaults for conf, iou and
+    max_det, so the runtime only has to execute the raw network.
+    """
+
+    export_format = None
+
+    def __init__(self, weights: str = "yolov8n.pt", cache_dir: str = "models", imgsz: int = 640,
+                 threads: Optional[int] = None, int8: bool = False,
+                 conf: float = 0.25, iou: float = 0.7, max_det: int = 300):
+        self.imgsz = imgsz
+        self.threads = threads
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+
+        stem = os.path.splitext(os.path.basename(weights))[0]
+        suffix = "-int8" if int8 else ""
+        self.model_path = os.path.join(cache_dir, f"{stem}-{imgsz}{suffix}{self.cache_suffix}")
+        names_path = os.path.join(cache_dir, f"{stem}.names.json")
+
+        if not os.path.exists(self.model_path) or not os.path.exists(names_path):
+            os.makedirs(cache_dir, exist_ok=True)
+            # Inference worker processes start together: one exports, the others
+            # wait for it and load its result
+            with FileLock(self.model_path + ".lock"):
+                if not os.path.exists(self.model_path) or not os.path.exists(names_path):
+                    print(f"⚙️ Exporting {weights} to {self.export_format} ({self.model_path})")
+                    self._export(weights, names_path, int8)
+
+        with open(names_path) as f:
+            self._names = {int(k): v for k, v in json.load(f).items()}
+        self._load()
+
+    @property
+    @abstractmethod
+    def cache_suffix(self) -> str:
+        """
+        File name suffix of the exported model (extension or directory name).
+        """
+        pass
+
+    @abstractmethod
+    def _load(self) -> None:
+        """
+        Create the runtime session for `self.model_path`.
+        """
+        pass
+
+    @abstractmethod
+    def _run(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Run the raw model on a float32 NCHW batch and return its output.
+        """
+        pass
+
+    def _quantize(self, exported_path: str) -> str:
+        raise ValueError(f"int8 quantization is not supported for {self.export_format}")
+
+    def _export_model(self, weights: str, int8: bool):
+        """
+        Export the weights and return the exported path and the label mapping.
+        """
+        from ultralytics import YOLO
+
+        model = YOLO(weights)
+        exported = model.export(format=self.export_format, imgsz=self.imgsz, dynamic=True, device="cpu")
+        if int8:
+            exported = self._quantize(exported)
+        return exported, model.names
+
+    def _export(self, weights: str, names_path: str, int8: bool) -> None:
+        """
+        Export into the cache. Both files are written next to their final
+        path and renamed into place, the label mapping last, so a process that
+        finds the mapping also finds a complete model.
+        """
+        exported, names = self._export_model(weights, int8)
+        staged = f"{self.model_path}.{os.getpid()}.tmp"
+        shutil.move(exported, staged)
+        if os.path.isdir(self.model_path):
+            shutil.rmtree(self.model_path)
+        os.replace(staged, self.model_path)
+
+        staged = f"{names_path}.{os.getpid()}.tmp"
+        with open(staged, "w") as f:
+            json.dump(names, f)
+        os.replace(staged, names_path)
+
+    @property
+    def names(self) -> Dict[int, str]:
+        return self._names
+
+    def predict(self, sources: List) -> List:
+        images = [load_image(source) if isinstance(source, str) else source for source in sources]
+        boxed = [letterbox(image, self.imgsz) for image in images]
+        # BGR HWC uint8 -> RGB CHW float32 in [0, 1]
+        batch = np.stack([padded for padded, _, _ in boxed])[..., ::-1].transpose(0, 3, 1, 2)
+        batch = np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+        output = torch.from_numpy(np.asarray(self._run(batch)))
+        results = []
+        for i, (image, (_, ratio, pad)) in enumerate(zip(images, boxed)):
+            detections = self._postprocess(output[i], ratio, pad, image.shape)
+            path = sources[i] if isinstance(sources[i], str) else f"image{i}.jpg"
+            results.append(Results(image, path=path, names=self._names, boxes=detections))
+        return results
+
+    def _postprocess(self, prediction: torch.Tensor, ratio: float, pad, shape) -> torch.Tensor:
+        """
+        (4 + classes, anchors) raw output -> (n, 6) xyxy/conf/cls in original image pixels.
+        """
+        prediction = prediction.transpose(0, 1)
+        scores, classes = prediction[:, 4:].max(dim=1)
+        keep = scores >= self.conf
+        xywh, scores, classes = prediction[keep, :4], scores[keep], classes[keep]
+
+        boxes = torch.cat([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], dim=1)
+        kept = torchvision.ops.batched_nms(boxes, scores, classes, self.iou)[:self.max_det]
+        boxes, scores, classes = boxes[kept], scores[kept], classes[kept]
+
+        # Undo the letterbox
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad[0]) / ratio).clamp(0, shape[1])
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad[1]) / ratio).clamp(0, shape[0])
+        return torch.cat([boxes, scores[:, None], classes[:, None].float()], dim=1)
@@ -0,0 +1,34 @@
+import os
+
+import numpy as np
+import onnxruntime
+
+from inference.exported_engine import ExportedEngine
+
+
+class OnnxEngine(ExportedEngine):
+    export_format = "onnx"
+
+    @property
+    def cache_suffix(self) -> str:
+        return ".onnx"
+
+    def _quantize(self, exported_path: str) -> str:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = exported_path.replace(".onnx", "-int8.onnx")
+        quantize_dynamic(exported_path, quantized_path, weight_type=QuantType.QUInt8)
+        os.remove(exported_path)
+        return quantized_path
+
+    def _load(self) -> None:
+        options = onnxruntime.SessionOptions()
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _run(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch})[0]
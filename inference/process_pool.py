@@ -0,0 +1,220 @@
+import atexit
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+from imaging import load_image
+from inference.base import InferenceEngine
+
+# How often the monitor thread checks for crashed workers (seconds)
+MONITOR_INTERVAL = 1.0
+# How long to wait for the first worker to load its model (seconds)
+STARTUP_TIMEOUT = 600
+# Workers that die sooner than this after starting are restarted with an
+# exponential backoff (capped at MAX_RESTART_DELAY) instead of immediately
+MIN_HEALTHY_UPTIME = 30.0
+MAX_RESTART_DELAY = 60.0
+
+
+def _worker_main(index: int, engine_type: str, threads: Optional[int], tasks, results) -> None:
+    """
+    Worker process: load the model once, then run batches whose pixels are
+    read straight out of shared memory. Only (n, 6) float32 arrays of
+    xyxy/conf/cls go back to the parent.
+    """
+    from inference import build_engine
+
+    engine = build_engine(engine_type, threads)
+    results.put(("ready", index, engine.names))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, shm_name, layout = task
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            images = [
+                np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+                for offset, shape in layout
+            ]
+            detections = [r.boxes.data.numpy().astype(np.float32) for r in engine.predict(images)]
+            results.put(("done", task_id, detections))
+        except Exception as e:
+            results.put(("error", task_id, repr(e)))
+        finally:
+            images = None
+            try:
+                shm.close()
+            except BufferError:
+                # A view is still referenced somewhere; the mapping goes away with it
+                pass
+
+
+class ProcessPoolEngine(InferenceEngine):
+    """
+    Runs inference in `processes` worker processes, each with its own model
+    and `threads` intra-op threads, so inference is not limited by the GIL or
+    by one interpreter's thread pool.
+
+    Decoded images are copied once into a shared memory block per batch
+    instead of being pickled. Crashed workers are restarted and the batches
+    they were running fail with an error. `predict` is thread-safe; call it
+    from as many threads as there are processes to keep them all busy.
+    """
+
+    def __init__(self, engine_type: str = "torch", processes: int = 2, threads: Optional[int] = None):
+        self.engine_type = engine_type
+        self.threads = threads
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._pending: Dict[int, tuple] = {}
+        self._workers: List[dict] = []
+        self._names = None
+        self._ready = threading.Event()
+        self._closed = False
+
+        for index in range(processes):
+            self._workers.append(self._start_worker(index))
+
+        threading.Thread(target=self._collect_results, name="inference-pool-results", daemon=True).start()
+        threading.Thread(target=self._monitor, name="inference-pool-monitor", daemon=True).start()
+        atexit.register(self.close)
+        if not self._ready.wait(STARTUP_TIMEOUT):
+            self.close()
+            raise RuntimeError("Inference workers did not start")
+
+    def _start_worker(self, index: int) -> dict:
+        tasks = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.engine_type, self.threads, tasks, self._results),
+            name=f"inference-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        return {"process": process, "tasks": tasks, "inflight": set(), "started": time.monotonic(), "failures": 0}
+
+    @property
+    def names(self) -> Dict[int, str]:
+        return self._names
+
+    def predict(self, sources: List) -> List:
+        images = [load_image(source) if isinstance(source, str) else np.ascontiguousarray(source, dtype=np.uint8)
+                  for source in sources]
+
+        layout, offset = [], 0
+        for image in images:
+            layout.append((offset, image.shape))
+            offset += image.nbytes
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        try:
+            for (start, shape), image in zip(layout, images):
+                np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=start)[:] = image
+            detections = self._submit(shm.name, layout).result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return [
+            Results(image, path=source if isinstance(source, str) else f"image{i}.jpg",
+                    names=self._names, boxes=torch.from_numpy(boxes))
+            for i, (source, image, boxes) in enumerate(zip(sources, images, detections))
+        ]
+
+    def _submit(self, shm_name: str, layout: list) -> Future:
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Inference pool is closed")
+            alive = [w for w in self._workers if "died" not in w and w["process"].is_alive()]
+            if not alive:
+                raise RuntimeError("No inference workers available")
+            task_id = next(self._task_ids)
+            worker = min(alive, key=lambda w: len(w["inflight"]))
+            worker["inflight"].add(task_id)
+            self._pending[task_id] = (future, worker)
+            worker["tasks"].put((task_id, shm_name, layout))
+        return future
+
+    def _collect_results(self) -> None:
+        while True:
+            try:
+                message = self._results.get()
+            except (EOFError, OSError):
+                return
+            kind, key, payload = message
+            if kind == "ready":
+                self._names = payload
+                self._ready.set()
+                continue
+
+            with self._lock:
+                entry = self._pending.pop(key, None)
+                if entry is None:
+                    continue
+                future, worker = entry
+                worker["inflight"].discard(key)
+            if kind == "done":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(f"Inference worker failed: {payload}"))
+
+    def _monitor(self) -> None:
+        while not self._closed:
+            time.sleep(MONITOR_INTERVAL)
+            with self._lock:
+                if self._closed:
+                    return
+                for index, worker in enumerate(self._workers):
+                    if worker["process"].is_alive():
+                        continue
+                    self._handle_exit(index, worker)
+
+    def _handle_exit(self, index: int, worker: dict) -> None:
+        """Fail the dead worker's batches and restart it once its backoff has passed."""
+        if "died" not in worker:
+            worker["died"] = time.monotonic()
+            print(f"❌ Inference worker {index} exited with code {worker['process'].exitcode}")
+            crashed_early = worker["died"] - worker["started"] < MIN_HEALTHY_UPTIME
+            worker["failures"] = worker["failures"] + 1 if crashed_early else 0
+
+        for task_id in worker["inflight"]:
+            future, _ = self._pending.pop(task_id)
+            future.set_exception(RuntimeError("Inference worker crashed"))
+        worker["inflight"] = set()
+
+        delay = min(2 ** worker["failures"], MAX_RESTART_DELAY) if worker["failures"] else 0
+        if time.monotonic() - worker["died"] < delay:
+            return
+
+        print(f"🔁 Restarting inference worker {index}")
+        self._workers[index] = self._start_worker(index)
+        self._workers[index]["failures"] = worker["failures"]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._workers)
+        for worker in workers:
+            try:
+                worker["tasks"].put(None)
+            except (ValueError, OSError):
+                pass
+        for worker in workers:
+            worker["process"].join(timeout=5)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
@@ -0,0 +1,22 @@
+from typing import Dict, List, Optional
+
+import torch
+from ultralytics import YOLO
+
+from inference.base import InferenceEngine
+
+
+class TorchEngine(InferenceEngine):
+    def __init__(self, weights: str = "yolov8n.pt", threads: Optional[int] = None):
+        # Disable GPU usage
+        torch.cuda.is_available = lambda: False
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = YOLO(weights)
+
+    @property
+    def names(self) -> Dict[int, str]:
+        return self.model.names
+
+    def predict(self, sources: List) -> List:
+        return self.model(sources, device="cpu", batch=len(sources))
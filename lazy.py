@@ -0,0 +1,33 @@
+import threading
+from typing import Any, Callable
+
+
+class Lazy:
+    """
+    Builds an object on first use instead of at import time.
+
+    Attribute access is forwarded to the built object, so a Lazy can stand in
+    wherever the object itself was used. Building is thread-safe and happens
+    once; if the factory raises, the next access tries again.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self) -> Any:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._value = self._factory()
+                    self._loaded = True
+        return self._value
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
@@ -0,0 +1,152 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+try:
+    from opentelemetry import metrics as otel_metrics
+except ImportError:  # OpenTelemetry is optional, values are still kept in-process
+    otel_metrics = None
+
+METER_NAME = "yolo-service"
+
+Attributes = Optional[Dict[str, str]]
+
+
+def _meter():
+    # Instruments created before telemetry.setup() are bound once a provider is set
+    return otel_metrics.get_meter(METER_NAME) if otel_metrics else None
+
+
+class Counter:
+    """A monotonically increasing, thread-safe counter."""
+
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self._value = 0
+        self._lock = threading.Lock()
+        meter = _meter()
+        self._otel = meter.create_counter(name, description=description) if meter else None
+
+    def add(self, amount: int = 1, attributes: Attributes = None) -> None:
+        with self._lock:
+            self._value += amount
+        if self._otel:
+            self._otel.add(amount, attributes)
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+class Gauge:
+    """A value that goes up and down, such as the number of jobs in flight."""
+
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self._value = 0
+        self._lock = threading.Lock()
+        meter = _meter()
+        self._otel = meter.create_up_down_counter(name, description=description) if meter else None
+
+    def add(self, amount: int = 1, attributes: Attributes = None) -> None:
+        with self._lock:
+            self._value += amount
+        if self._otel:
+            self._otel.add(amount, attributes)
+
+    def set(self, value: int) -> None:
+        with self._lock:
+            delta = value - self._value
+            self._value = value
+        if self._otel and delta:
+            self._otel.add(delta)
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+class Histogram:
+    """
+    Records a distribution, e.g. latencies in seconds.
+
+    In-process it keeps count, sum and max per attribute set for /metrics;
+    percentiles come from the buckets of the exported OpenTelemetry histogram.
+    """
+
+    def __init__(self, name: str, description: str = "", unit: str = ""):
+        self.name = name
+        self.description = description
+        self.unit = unit
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+        meter = _meter()
+        self._otel = meter.create_histogram(name, unit=unit, description=description) if meter else None
+
+    def record(self, value: float, attributes: Attributes = None) -> None:
+        key = tuple(sorted((attributes or {}).items()))
+        with self._lock:
+            series = self._series.setdefault(key, [0, 0.0, 0.0])
+            series[0] += 1
+            series[1] += value
+            series[2] = max(series[2], value)
+        if self._otel:
+            self._otel.record(value, attributes)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                ",".join(f"{k}={v}" for k, v in key) or "all": {
+                    "count": count, "mean": total / count, "max": peak,
+                }
+                for key, (count, total, peak) in sorted(self._series.items())
+            }
+
+
+_counters: Dict[str, Counter] = {}
+_gauges: Dict[str, Gauge] = {}
+_histograms: Dict[str, Histogram] = {}
+_registry_lock = threading.Lock()
+
+
+def counter(name: str, description: str = "") -> Counter:
+    """Get or create the process-wide counter with this name."""
+    with _registry_lock:
+        if name not in _counters:
+            _counters[name] = Counter(name, description)
+        return _counters[name]
+
+
+def gauge(name: str, description: str = "") -> Gauge:
+    """Get or create the process-wide gauge with this name."""
+    with _registry_lock:
+        if name not in _gauges:
+            _gauges[name] = Gauge(name, description)
+        return _gauges[name]
+
+
+def histogram(name: str, description: str = "", unit: str = "") -> Histogram:
+    """Get or create the process-wide histogram with this name."""
+    with _registry_lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(name, description, unit)
+        return _histograms[name]
+
+
+def ratio(hits: Counter, misses: Counter) -> float:
+    total = hits.value + misses.value
+    return hits.value / total if total else 0.0
+
+
+def snapshot() -> Dict[str, int]:
+    with _registry_lock:
+        values = {name: c.value for name, c in _counters.items()}
+        values.update({name: g.value for name, g in _gauges.items()})
+        return dict(sorted(values.items()))
+
+
+def histogram_snapshot() -> Dict[str, Dict[str, Dict[str, float]]]:
+    with _registry_lock:
+        histograms = sorted(_histograms.items())
+    return {name: h.summary() for name, h in histograms}
@@ -0,0 +1,194 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from contextlib import ExitStack
+from typing import Any, Callable, List, Optional, Tuple
+
+import metrics
+import telemetry
+
+stage_duration = metrics.histogram("pipeline.stage.duration", "Time spent running a stage", "s")
+queue_wait = metrics.histogram("pipeline.queue.wait", "Time a job waited in front of a stage", "s")
+batch_size = metrics.histogram("pipeline.batch.size", "Jobs handed to a batch stage in one call")
+batch_splits = metrics.counter("pipeline.batch.splits", "Failed batches re-run one job at a time")
+
+
+class Stage:
+    """
+    One step of the prediction pipeline.
+
+    `func` is a blocking callable that receives the job and runs on `executor`
+    (None means the event loop's default thread pool). At most `concurrency`
+    jobs are inside the stage at the same time.
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], None],
+                 executor: Optional[Executor] = None, concurrency: int = 1):
+        if concurrency < 1:
+            raise ValueError("Stage concurrency must be at least 1")
+        self.name = name
+        self.func = func
+        self.executor = executor
+        self.concurrency = concurrency
+
+
+class BatchStage(Stage):
+    """
+    A stage whose `func` receives a list of jobs instead of a single job.
+
+    Workers collect up to `max_batch_size` queued jobs, waiting at most
+    `max_wait` seconds after the first one arrives, and hand them to `func`
+    in one call. If `func` raises, every job in the batch fails, unless
+    `isolate_failures` is set: then the batch is run again one job at a time
+    (`func` gets a list of one) and only the jobs that still raise fail, so
+    one bad job can't take its neighbours down with it. `func` must leave
+    the jobs untouched when it raises for this to be safe.
+    """
+
+    def __init__(self, name: str, func: Callable[[List[Any]], None],
+                 executor: Optional[Executor] = None, concurrency: int = 1,
+                 max_batch_size: int = 8, max_wait: float = 0.05, isolate_failures: bool = False):
+        super().__init__(name, func, executor, concurrency)
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.isolate_failures = isolate_failures
+
+
+class Pipeline:
+    """
+    Runs jobs through a chain of stages connected by bounded queues.
+
+    Each stage has its own workers, so while one job is being downloaded
+    another can be in inference. When a downstream queue is full the upstream
+    stage waits, which keeps the number of jobs held in memory bounded.
+
+    Every stage reports its run time and queue wait to the metrics registry.
+    `on_stage_done`, if set, is also called on the event loop with
+    (stage, seconds, jobs) after each run.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 8,
+                 on_stage_done: Optional[Callable[[Stage, float, int], None]] = None):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_stage_done = on_stage_done
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    @property
+    def saturated(self) -> bool:
+        """
+        True when the first stage's queue is full. Back-pressure fills the
+        queues from the slowest stage upwards, so new jobs would only wait.
+        """
+        return bool(self._queues) and self._queues[0].full()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.concurrency):
+                self._workers.append(asyncio.create_task(self._run_stage(index)))
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queues = []
+
+    async def submit(self, job: Any) -> Any:
+        """
+        Queue a job at the first stage and wait until it has left the last one.
+        Exceptions raised by any stage are re-raised here.
+        """
+        if not self.running:
+            raise RuntimeError("Pipeline is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[0].put((job, future, telemetry.current_context(), time.monotonic()))
+        return await future
+
+    async def _collect(self, stage: Stage, queue: asyncio.Queue) -> List[Tuple]:
+        """Take the next job, or the next micro-batch of jobs for a BatchStage."""
+        items = [await queue.get()]
+        if not isinstance(stage, BatchStage):
+            return items
+
+        deadline = time.monotonic() + stage.max_wait
+        while len(items) < stage.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _run_stage(self, index: int) -> None:
+        stage = self.stages[index]
+        queue = self._queues[index]
+        is_last = index == len(self.stages) - 1
+        loop = asyncio.get_running_loop()
+
+        while True:
+            collected = await self._collect(stage, queue)
+            try:
+                # Skip jobs whose submitter gave up on them (e.g. cancelled).
+                items = [item for item in collected if not item[1].done()]
+                if not items:
+                    continue
+
+                attributes = {"stage": stage.name}
+                started = time.monotonic()
+                for *_, enqueued_at in items:
+                    queue_wait.record(started - enqueued_at, attributes)
+
+                if isinstance(stage, BatchStage):
+                    arg = [job for job, *_ in items]
+                    batch_size.record(len(items), attributes)
+                else:
+                    arg = items[0][0]
+
+                with ExitStack() as spans:
+                    for _, _, context, _ in items:
+                        spans.enter_context(telemetry.span(f"stage.{stage.name}", context, {"batch.size": len(items)}))
+                    # Wait without re-raising here so the error's traceback never
+                    # references this long-lived worker frame.
+                    result = loop.run_in_executor(stage.executor, stage.func, arg)
+                    await asyncio.wait([result])
+                    errors = [result.exception()] * len(items)
+                    if errors[0] is not None and len(items) > 1 and isinstance(stage, BatchStage) \
+                            and stage.isolate_failures:
+                        batch_splits.add(1, attributes)
+                        errors = []
+                        for job, *_ in items:
+                            single = loop.run_in_executor(stage.executor, stage.func, [job])
+                            await asyncio.wait([single])
+                            errors.append(single.exception())
+                elapsed = time.monotonic() - started
+                stage_duration.record(elapsed, attributes)
+                if self.on_stage_done is not None:
+                    self.on_stage_done(stage, elapsed, len(items))
+
+                for (job, future, context, _), error in zip(items, errors):
+                    if error is not None:
+                        if not future.done():
+                            future.set_exception(error)
+                    elif is_last:
+                        if not future.done():
+                            future.set_result(job)
+                    else:
+                        await self._queues[index + 1].put((job, future, context, time.monotonic()))
+            finally:
+                for _ in collected:
+                    queue.task_done()
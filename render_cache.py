@@ -0,0 +1,110 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import metrics
+
+class RenderCache:
+    """
+    Size-bounded LRU cache of images, keyed by a string.
+
+    Entries live in memory, or as files under `directory` if one is given;
+    either way at most `max_bytes` are kept and the least recently used
+    entries are evicted first. Files left by a previous run are picked up
+    again, oldest first. Hits, misses and evictions are counted under `name`.
+    """
+
+    def __init__(self, max_bytes: int, directory: Optional[str] = None, name: str = "render_cache"):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.hits = metrics.counter(f"{name}.hits", "Images served from the cache")
+        self.misses = metrics.counter(f"{name}.misses", "Images not found in the cache")
+        self.evictions = metrics.counter(f"{name}.evictions", "Images evicted from the cache")
+        self._entries: "OrderedDict[str, object]" = OrderedDict()
+        self._sizes = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_directory()
+
+    @property
+    def size(self) -> int:
+        return self._total
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    def _load_directory(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            # Keys aren't recoverable from the file names, so index by file name
+            self._entries[name] = None
+            self._sizes[name] = size
+            self._total += size
+        with self._lock:
+            self._evict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            name = self._name(key)
+            if name not in self._sizes:
+                self.misses.add()
+                return None
+            self._entries.move_to_end(name)
+            value = self._entries[name]
+        if value is None:
+            try:
+                with open(os.path.join(self.directory, name), "rb") as f:
+                    value = f.read()
+            except FileNotFoundError:
+                self._discard(name)
+                self.misses.add()
+                return None
+        self.hits.add()
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        name = self._name(key)
+        if self.directory:
+            # Write then rename, so a reader never sees a half-written file
+            path = os.path.join(self.directory, name)
+            with open(path + ".tmp", "wb") as f:
+                f.write(value)
+            os.replace(path + ".tmp", path)
+        with self._lock:
+            if name in self._sizes:
+                self._total -= self._sizes[name]
+            self._entries[name] = None if self.directory else value
+            self._entries.move_to_end(name)
+            self._sizes[name] = len(value)
+            self._total += len(value)
+            self._evict()
+
+    def _name(self, key: str) -> str:
+        return os.path.basename(self._path(key)) if self.directory else key
+
+    def _discard(self, name: str) -> None:
+        with self._lock:
+            if name in self._sizes:
+                self._total -= self._sizes.pop(name)
+                del self._entries[name]
+
+    def _evict(self) -> None:
+        while self._total > self.max_bytes and self._entries:
+            name, _ = self._entries.popitem(last=False)
+            self._total -= self._sizes.pop(name)
+            self.evictions.add()
+            if self.directory:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
@@ -2,7 +2,12 @@ import os
 
 from .sqlite_storage import SQLiteStorage
 from .dynamodb_storage import DynamoDBStorage
+from .async_sqlite_storage import AsyncSQLiteStorage
+from .async_dynamodb_storage import AsyncDynamoDBStorage
 from .base import BaseStorage
+from .async_base import AsyncBaseStorage
+from .instrumented import InstrumentedStorage
+from .cached import AsyncCachedStorage, CachedStorage
 
 
 def get_storage() -> BaseStorage:
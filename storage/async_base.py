@@ -0,0 +1,212 @@
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from storage.base import ITER_PAGE_SIZE
+
+
+class AsyncBaseStorage(ABC):
+    """
+    The asyncio counterpart of BaseStorage, for code running on the event
+    loop: the same operations and results, as coroutines. The single-row
+    save_prediction and save_detection are left out; the batched save
+    replaces them. Backends keep a pool of connections, opened by `start`
+    (or on first use) and closed by `close`; `async with` does both.
+    """
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @abstractmethod
+    async def start(self) -> None:
+        """
+        Open the connection pool. Safe to call more than once.
+        """
+        pass
+
+    @abstractmethod
+    async def close(self) -> None:
+        """
+        Close every pooled connection.
+        """
+        pass
+
+    @abstractmethod
+    async def save_prediction_with_detections(self, uid: str, original_image: str, predicted_image: str,
+                                              detections: List[Dict]) -> None:
+        """
+        Save a prediction session together with all of its detections,
+        replacing an earlier save of the same prediction.
+        """
+        pass
+
+    @abstractmethod
+    async def save_content_hash(self, content_hash: str, prediction_uid: str) -> None:
+        """
+        Remember which prediction was computed for an image with this content hash.
+        The first prediction recorded for a hash is kept.
+        """
+        pass
+
+    @abstractmethod
+    async def find_prediction_by_hash(self, content_hash: str) -> Optional[str]:
+        """
+        Get the UID of a stored prediction for an image with this content hash, or None.
+        """
+        pass
+
+    async def copy_prediction(self, source_uid: str, uid: str, original_image: str) -> None:
+        """
+        Store the predicted image and detections of `source_uid` under a new prediction UID.
+        """
+        source = await self.get_prediction(source_uid)
+        await self.save_prediction_with_detections(uid, original_image, source["predicted_image"], [
+            {"label": d["label"], "score": d["score"], "box": d["box"]}
+            for d in source["detection_objects"]
+        ])
+
+    @abstractmethod
+    async def get_job_state(self, uid: str) -> Optional[Dict]:
+        """
+        Get the processing state of a prediction job, as BaseStorage.get_job_state.
+        """
+        pass
+
+    @abstractmethod
+    async def claim_job(self, uid: str, owner: str, lease_seconds: float) -> bool:
+        """
+        Take ownership of a job for `lease_seconds`, as BaseStorage.claim_job.
+        """
+        pass
+
+    @abstractmethod
+    async def update_job_state(self, uid: str, stage: str, data: Dict, lease_seconds: float) -> None:
+        """
+        Record that a claimed job completed `stage`, renewing the lease.
+        """
+        pass
+
+    @abstractmethod
+    async def release_job(self, uid: str, owner: str) -> None:
+        """
+        Give up ownership of a job, so a redelivery can claim it right away.
+        """
+        pass
+
+    @abstractmethod
+    async def ping(self) -> None:
+        """
+        Check that the backend is reachable. Raises if it is not.
+        """
+        pass
+
+    @abstractmethod
+    async def get_prediction(self, uid: str) -> Dict:
+        """
+        Retrieve full prediction session including metadata and all detections.
+        """
+        pass
+
+    @abstractmethod
+    async def get_prediction_image_path(self, uid: str) -> str:
+        """
+        Get the path to the predicted image file for a given prediction UID.
+        """
+        pass
+
+    @abstractmethod
+    async def get_stats(self, hours: int = 24) -> Dict:
+        """
+        The aggregates described in BaseStorage.get_stats.
+        """
+        pass
+
+    @abstractmethod
+    async def get_predictions_by_label_page(self, label: str, limit: int,
+                                            cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Get one page of prediction sessions with a detection of the given label.
+        Returns the page and the cursor for the next one (None on the last page).
+        """
+        pass
+
+    @abstractmethod
+    async def get_predictions_by_score_page(self, min_score: float, limit: int,
+                                            cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Get one page of prediction sessions with a detection scoring >= min_score.
+        Returns the page and the cursor for the next one (None on the last page).
+        """
+        pass
+
+    @abstractmethod
+    async def get_predictions_by_box_page(self, label: Optional[str],
+                                          region: Optional[Tuple[float, float, float, float]],
+                                          min_area: Optional[float], limit: int,
+                                          cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Get one page of prediction sessions with a detection matching the box
+        filters, as BaseStorage.get_predictions_by_box_page.
+        """
+        pass
+
+    async def get_predictions_by_label(self, label: str) -> List[Dict]:
+        """
+        Get all prediction sessions that include a detection with a specific label.
+        """
+        return await self._unique(self.iter_predictions_by_label(label))
+
+    async def get_predictions_by_score(self, min_score: float) -> List[Dict]:
+        """
+        Get all prediction sessions that include detections with score >= min_score.
+        """
+        return await self._unique(self.iter_predictions_by_score(min_score))
+
+    async def get_predictions_by_box(self, label: Optional[str], region: Optional[Tuple[float, float, float, float]],
+                                     min_area: Optional[float]) -> List[Dict]:
+        """
+        Get all prediction sessions with a detection matching the box filters.
+        """
+        return await self._unique(self.iter_predictions_by_box(label, region, min_area))
+
+    def iter_predictions_by_label(self, label: str) -> AsyncIterator[Dict]:
+        """
+        Yield every prediction session with the given label, one page at a time.
+        """
+        return self._iter_pages(lambda cursor: self.get_predictions_by_label_page(label, ITER_PAGE_SIZE, cursor))
+
+    def iter_predictions_by_score(self, min_score: float) -> AsyncIterator[Dict]:
+        """
+        Yield every prediction session with a detection scoring >= min_score, one page at a time.
+        """
+        return self._iter_pages(lambda cursor: self.get_predictions_by_score_page(min_score, ITER_PAGE_SIZE, cursor))
+
+    def iter_predictions_by_box(self, label: Optional[str], region: Optional[Tuple[float, float, float, float]],
+                                min_area: Optional[float]) -> AsyncIterator[Dict]:
+        """
+        Yield every prediction session with a detection matching the box filters, one page at a time.
+        """
+        return self._iter_pages(
+            lambda cursor: self.get_predictions_by_box_page(label, region, min_area, ITER_PAGE_SIZE, cursor)
+        )
+
+    @staticmethod
+    async def _iter_pages(fetch_page) -> AsyncIterator[Dict]:
+        cursor = None
+        while True:
+            page, cursor = await fetch_page(cursor)
+            for row in page:
+                yield row
+            if cursor is None:
+                return
+
+    @staticmethod
+    async def _unique(rows: AsyncIterator[Dict]) -> List[Dict]:
+        # Pages of some backends can repeat a prediction
+        unique = {}
+        async for row in rows:
+            unique.setdefault(row["uid"], row)
+        return list(unique.values())
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+from contextlib import AsyncExitStack
+from typing import Dict, List, Optional, Tuple
+
+from boto3.dynamodb.conditions import Key
+
+try:
+    import aioboto3
+    from aiobotocore.config import AioConfig
+except ImportError:  # Only needed with ASYNC_STORAGE
+    aioboto3 = None
+
+from storage.async_base import AsyncBaseStorage
+from storage.dynamodb_storage import (
+    BATCH_WRITE_RETRIES, TRANSACT_WRITE_LIMIT, DynamoDBSchema, batch_write_delay, is_condition_failure
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDynamoDBStorage(DynamoDBSchema, AsyncBaseStorage):
+    """
+    The DynamoDB backend on aioboto3. Every call goes through one client and
+    so one pool of up to `max_connections` keep-alive HTTP connections,
+    opened by `start`; requests are sent from the event loop itself.
+    """
+
+    def __init__(self, table_name: str = None, box_encoding: str = None, score_index: str = None,
+                 retention_days: float = None, max_connections: int = 50, region_name: str = "eu-west-2",
+                 endpoint_url: str = None):
+        if aioboto3 is None:
+            raise RuntimeError("AsyncDynamoDBStorage needs the aioboto3 package (pip install aioboto3)")
+        super().__init__(table_name, box_encoding, score_index, retention_days)
+        self.max_connections = max_connections
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url
+        self.table = None
+        self._resources = None
+        self._start_lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        async with self._start_lock:
+            if self.table is not None:
+                return
+            resources = AsyncExitStack()
+            resource = await resources.enter_async_context(aioboto3.Session().resource(
+                "dynamodb", region_name=self.region_name, endpoint_url=self.endpoint_url,
+                config=AioConfig(max_pool_connections=self.max_connections),
+            ))
+            self.table = await resource.Table(self.table_name)
+            self._resources = resources
+
+    async def close(self) -> None:
+        resources, self._resources, self.table = self._resources, None, None
+        if resources is not None:
+            await resources.aclose()
+
+    async def _table(self):
+        if self.table is None:
+            await self.start()
+        return self.table
+
+    async def _batch_write(self, writes: List[Dict]) -> None:
+        """
+        Apply put/delete requests with BatchWriteItem in chunks of 25,
+        retrying unprocessed items with exponential backoff and jitter.
+        """
+        client = (await self._table()).meta.client
+        for request in self._batch_requests(writes):
+            for attempt in range(BATCH_WRITE_RETRIES):
+                response = await client.batch_write_item(RequestItems=request)
+                request = response.get("UnprocessedItems") or {}
+                if not request:
+                    break
+                await asyncio.sleep(batch_write_delay(attempt))
+            else:
+                raise self._unprocessed_error(request)
+
+    async def save_prediction_with_detections(self, uid: str, original_image: str, predicted_image: str,
+                                              detections: List[Dict]) -> None:
+        items = self._detection_items(uid, detections)
+        logger.debug("Saving prediction %s with %d detections", uid, len(items))
+        await self._batch_write(self._puts(items))
+
+        table = await self._table()
+        meta = self._meta_item(uid, original_image, predicted_image)
+        actions = self._save_actions(meta, items)
+        client = table.meta.client
+        try:
+            await client.transact_write_items(TransactItems=actions[:TRANSACT_WRITE_LIMIT])
+        except client.exceptions.TransactionCanceledException as e:
+            if not is_condition_failure(e):
+                raise
+            # Saved before: replace the metadata without counting it again and
+            # drop the detections the new save doesn't have
+            await table.put_item(Item=meta)
+            saved = await self._query_all(**self._detections_query(uid))
+            await self._batch_write(self._stale_deletes(saved, items))
+            return
+        for action in actions[TRANSACT_WRITE_LIMIT:]:
+            await client.update_item(**action["Update"])
+
+    async def save_content_hash(self, content_hash: str, prediction_uid: str) -> None:
+        table = await self._table()
+        try:
+            await table.put_item(**self._hash_put(content_hash, prediction_uid))
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    async def find_prediction_by_hash(self, content_hash: str) -> Optional[str]:
+        table = await self._table()
+        response = await table.get_item(Key={"PK": f"HASH#{content_hash}", "SK": "META"})
+        return self._hash_prediction(response.get("Item"))
+
+    async def get_job_state(self, uid: str) -> Optional[Dict]:
+        table = await self._table()
+        response = await table.get_item(Key=self._job_key(uid), ConsistentRead=True)
+        return self._job_state(response.get("Item"))
+
+    async def claim_job(self, uid: str, owner: str, lease_seconds: float) -> bool:
+        table = await self._table()
+        try:
+            await table.update_item(**self._claim_update(uid, owner, lease_seconds))
+            return True
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    async def update_job_state(self, uid: str, stage: str, data: Dict, lease_seconds: float) -> None:
+        table = await self._table()
+        await table.update_item(**self._stage_update(uid, stage, data, lease_seconds))
+
+    async def release_job(self, uid: str, owner: str) -> None:
+        table = await self._table()
+        try:
+            await table.update_item(**self._release_update(uid, owner))
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    async def ping(self) -> None:
+        table = await self._table()
+        await table.get_item(Key={"PK": "PING", "SK": "META"})
+
+    async def get_prediction(self, uid: str) -> Dict:
+        table = await self._table()
+        response = await table.query(KeyConditionExpression=Key("PK").eq(f"PRED#{uid}"))
+        return self._prediction(uid, response.get("Items", []))
+
+    async def get_prediction_image_path(self, uid: str) -> str:
+        table = await self._table()
+        response = await table.get_item(Key={"PK": f"PRED#{uid}", "SK": "META"})
+        item = response.get("Item")
+        if not item:
+            raise ValueError("Prediction not found")
+        return item["predicted_image"]
+
+    async def _query_all(self, **kwargs) -> List[Dict]:
+        """Every item of a query, following LastEvaluatedKey."""
+        table = await self._table()
+        items = []
+        while True:
+            response = await table.query(**kwargs)
+            items.extend(response.get("Items", []))
+            last_key = response.get("LastEvaluatedKey")
+            if not last_key:
+                return items
+            kwargs["ExclusiveStartKey"] = last_key
+
+    async def get_stats(self, hours: int = 24) -> Dict:
+        label_query, hour_query = self._stats_queries(hours)
+        return self._stats(await self._query_all(**label_query), await self._query_all(**hour_query))
+
+    async def _unique_predictions_page(self, requests: List[Tuple], limit: int,
+                                       cursor: Optional[str]) -> Tuple[List[Dict], Optional[str]]:
+        table = await self._table()
+        steps = self._page_steps(requests, limit, cursor)
+        try:
+            operation, kwargs = next(steps)
+            while True:
+                operation, kwargs = steps.send(await getattr(table, operation)(**kwargs))
+        except StopIteration as done:
+            return done.value
+
+    async def get_predictions_by_label_page(self, label: str, limit: int,
+                                            cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        return await self._unique_predictions_page(self._label_requests(label), limit, cursor)
+
+    async def get_predictions_by_score_page(self, min_score: float, limit: int,
+                                            cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        return await self._unique_predictions_page(self._score_requests(min_score), limit, cursor)
+
+    async def get_predictions_by_box_page(self, label: Optional[str],
+                                          region: Optional[Tuple[float, float, float, float]],
+                                          min_area: Optional[float], limit: int,
+                                          cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        return await self._unique_predictions_page(self._box_requests(label, region, min_area), limit, cursor)
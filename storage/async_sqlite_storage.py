@@ -0,0 +1,258 @@
+import asyncio
+import json
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import aiosqlite
+except ImportError:  # Only needed with ASYNC_STORAGE
+    aiosqlite = None
+
+from storage.async_base import AsyncBaseStorage
+from storage.base import build_stats
+from storage.sqlite_storage import (
+    WRITER_PRAGMAS, box_match, box_values, detection_match, has_text_boxes, init_schema, page_query, page_result,
+    row_box
+)
+
+READER_PRAGMAS = (
+    "PRAGMA query_only=1",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+class AsyncSQLiteStorage(AsyncBaseStorage):
+    """
+    The SQLite backend on aiosqlite, with a pool of reused connections: one
+    writer, as SQLite runs one write transaction at a time, and `readers`
+    read-only connections that WAL mode lets read alongside it. aiosqlite
+    runs each connection's queries on a thread of its own, so callers only
+    wait for their query, never for a slot in a shared thread pool.
+    """
+
+    def __init__(self, db_path: str = "predictions.db", readers: int = 4):
+        if aiosqlite is None:
+            raise RuntimeError("AsyncSQLiteStorage needs the aiosqlite package (pip install aiosqlite)")
+        self.db_path = db_path
+        self.readers = readers
+        self._text_boxes = False
+        self._writer = None
+        self._reader_pool: Optional[asyncio.Queue] = None
+        self._connections = []
+        self._write_lock = asyncio.Lock()
+        self._start_lock = asyncio.Lock()
+
+    def _init_db(self) -> bool:
+        with sqlite3.connect(self.db_path) as conn:
+            init_schema(conn)
+            return has_text_boxes(conn)
+
+    async def _connect(self, pragmas) -> "aiosqlite.Connection":
+        conn = await aiosqlite.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        for pragma in pragmas:
+            await conn.execute(pragma)
+        self._connections.append(conn)
+        return conn
+
+    async def start(self) -> None:
+        async with self._start_lock:
+            if self._writer is not None:
+                return
+            # Creating or upgrading the schema is one-off work, done on a plain connection
+            self._text_boxes = await asyncio.to_thread(self._init_db)
+            # The writer switches the database to WAL before any reader opens
+            self._writer = await self._connect(WRITER_PRAGMAS)
+            pool = asyncio.Queue()
+            for _ in range(self.readers):
+                pool.put_nowait(await self._connect(READER_PRAGMAS))
+            self._reader_pool = pool
+
+    async def close(self) -> None:
+        connections, self._connections = self._connections, []
+        self._writer, self._reader_pool = None, None
+        for conn in connections:
+            await conn.close()
+
+    @asynccontextmanager
+    async def _reader(self):
+        if self._writer is None:
+            await self.start()
+        conn = await self._reader_pool.get()
+        try:
+            yield conn
+        finally:
+            self._reader_pool.put_nowait(conn)
+
+    @asynccontextmanager
+    async def _transaction(self):
+        """The writer connection for one transaction, committed at the end or rolled back on error."""
+        if self._writer is None:
+            await self.start()
+        async with self._write_lock:
+            conn = self._writer
+            try:
+                yield conn
+            except BaseException:
+                await conn.rollback()
+                raise
+            await conn.commit()
+
+    async def save_prediction_with_detections(self, uid: str, original_image: str, predicted_image: str,
+                                              detections: List[Dict]) -> None:
+        async with self._transaction() as conn:
+            await conn.execute("""
+                INSERT INTO prediction_sessions (uid, original_image, predicted_image)
+                VALUES (?, ?, ?)
+                ON CONFLICT (uid) DO UPDATE SET
+                    original_image = excluded.original_image, predicted_image = excluded.predicted_image
+            """, (uid, original_image, predicted_image))
+            await conn.execute("DELETE FROM detection_objects WHERE prediction_uid = ?", (uid,))
+            await conn.executemany("""
+                INSERT INTO detection_objects (prediction_uid, label, score, x1, y1, x2, y2, area)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(uid, d["label"], d["score"]) + box_values(d["box"]) for d in detections])
+
+    async def save_content_hash(self, content_hash: str, prediction_uid: str) -> None:
+        async with self._transaction() as conn:
+            await conn.execute("""
+                INSERT OR IGNORE INTO content_hashes (hash, prediction_uid)
+                VALUES (?, ?)
+            """, (content_hash, prediction_uid))
+
+    async def find_prediction_by_hash(self, content_hash: str) -> Optional[str]:
+        async with self._reader() as conn:
+            rows = await conn.execute_fetchall("""
+                SELECT prediction_uid FROM content_hashes WHERE hash = ?
+            """, (content_hash,))
+        return rows[0][0] if rows else None
+
+    async def copy_prediction(self, source_uid: str, uid: str, original_image: str) -> None:
+        async with self._transaction() as conn:
+            cursor = await conn.execute("""
+                INSERT INTO prediction_sessions (uid, original_image, predicted_image)
+                SELECT ?, ?, predicted_image FROM prediction_sessions WHERE uid = ?
+                ON CONFLICT (uid) DO UPDATE SET
+                    original_image = excluded.original_image, predicted_image = excluded.predicted_image
+            """, (uid, original_image, source_uid))
+            if not cursor.rowcount:
+                raise ValueError("Prediction not found")
+            await conn.execute("DELETE FROM detection_objects WHERE prediction_uid = ?", (uid,))
+            if self._text_boxes:
+                # migrate-boxes may have dropped the text column since we looked
+                columns = await conn.execute_fetchall("PRAGMA table_info(detection_objects)")
+                self._text_boxes = any(column[1] == "box" for column in columns)
+            columns = "label, score, x1, y1, x2, y2, area" + (", box" if self._text_boxes else "")
+            await conn.execute(f"""
+                INSERT INTO detection_objects (prediction_uid, {columns})
+                SELECT ?, {columns} FROM detection_objects WHERE prediction_uid = ?
+            """, (uid, source_uid))
+
+    async def get_job_state(self, uid: str) -> Optional[Dict]:
+        async with self._reader() as conn:
+            rows = await conn.execute_fetchall("""
+                SELECT stage, data, owner, lease_until FROM job_states WHERE uid = ?
+            """, (uid,))
+        if not rows:
+            return None
+        row = rows[0]
+        return {"stage": row[0], "data": json.loads(row[1]), "owner": row[2], "lease_until": row[3]}
+
+    async def claim_job(self, uid: str, owner: str, lease_seconds: float) -> bool:
+        now = time.time()
+        async with self._transaction() as conn:
+            await conn.execute("""
+                INSERT OR IGNORE INTO job_states (uid, stage, updated_at) VALUES (?, 'received', ?)
+            """, (uid, now))
+            cursor = await conn.execute("""
+                UPDATE job_states SET owner = ?, lease_until = ?
+                WHERE uid = ? AND (owner IS NULL OR owner = ? OR lease_until < ?)
+            """, (owner, now + lease_seconds, uid, owner, now))
+        return cursor.rowcount == 1
+
+    async def update_job_state(self, uid: str, stage: str, data: Dict, lease_seconds: float) -> None:
+        now = time.time()
+        async with self._transaction() as conn:
+            await conn.execute("""
+                UPDATE job_states SET stage = ?, data = ?, lease_until = ?, updated_at = ? WHERE uid = ?
+            """, (stage, json.dumps(data), now + lease_seconds, now, uid))
+
+    async def release_job(self, uid: str, owner: str) -> None:
+        async with self._transaction() as conn:
+            await conn.execute("""
+                UPDATE job_states SET owner = NULL, lease_until = NULL WHERE uid = ? AND owner = ?
+            """, (uid, owner))
+
+    async def ping(self) -> None:
+        async with self._reader() as conn:
+            await conn.execute_fetchall("SELECT 1 FROM prediction_sessions LIMIT 1")
+
+    async def get_prediction(self, uid: str) -> Dict:
+        async with self._reader() as conn:
+            sessions = await conn.execute_fetchall("""
+                SELECT * FROM prediction_sessions WHERE uid = ?
+            """, (uid,))
+            if not sessions:
+                raise ValueError("Prediction not found")
+            detections = await conn.execute_fetchall("""
+                SELECT * FROM detection_objects WHERE prediction_uid = ?
+            """, (uid,))
+
+        session = sessions[0]
+        return {
+            "uid": session["uid"],
+            "timestamp": session["timestamp"],
+            "original_image": session["original_image"],
+            "predicted_image": session["predicted_image"],
+            "detection_objects": [
+                {
+                    "id": row["id"],
+                    "label": row["label"],
+                    "score": row["score"],
+                    "box": row_box(row, self._text_boxes)
+                } for row in detections
+            ]
+        }
+
+    async def get_prediction_image_path(self, uid: str) -> str:
+        async with self._reader() as conn:
+            rows = await conn.execute_fetchall("""
+                SELECT predicted_image FROM prediction_sessions WHERE uid = ?
+            """, (uid,))
+        if not rows:
+            raise ValueError("Prediction not found")
+        return rows[0][0]
+
+    async def get_stats(self, hours: int = 24) -> Dict:
+        async with self._reader() as conn:
+            label_bins = await conn.execute_fetchall("SELECT label, score_bin, count FROM label_stats")
+            hourly = await conn.execute_fetchall("""
+                SELECT hour, count FROM hourly_stats
+                WHERE hour > strftime('%Y-%m-%dT%H:00', 'now', ?)
+            """, (f"-{hours} hours",))
+        return build_stats(label_bins, hourly)
+
+    async def _page(self, match: str, params: tuple, limit: int,
+                    cursor: Optional[str]) -> Tuple[List[Dict], Optional[str]]:
+        sql, params = page_query(match, params, limit, cursor)
+        async with self._reader() as conn:
+            rows = await conn.execute_fetchall(sql, params)
+        return page_result(list(rows), limit)
+
+    async def get_predictions_by_label_page(self, label: str, limit: int,
+                                            cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        return await self._page(detection_match("do.label = ?"), (label,), limit, cursor)
+
+    async def get_predictions_by_score_page(self, min_score: float, limit: int,
+                                            cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        return await self._page(detection_match("do.score >= ?"), (min_score,), limit, cursor)
+
+    async def get_predictions_by_box_page(self, label: Optional[str],
+                                          region: Optional[Tuple[float, float, float, float]],
+                                          min_area: Optional[float], limit: int,
+                                          cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        match, params = box_match(label, region, min_area)
+        return await self._page(match, params, limit, cursor)
@@ -1,5 +1,61 @@
+import base64
+import json
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Page size used when iterating over a whole result set
+ITER_PAGE_SIZE = 500
+
+# Stages a prediction job goes through, in order; its job state records the last one completed
+JOB_STAGES = ("received", "inferred", "uploaded", "persisted", "notified")
+
+
+# /stats score histograms have one bin per 0.1, with a score of exactly 1.0 in the last one
+STATS_SCORE_BINS = 10
+
+
+def stats_bin(score: float) -> int:
+    return min(max(int(float(score) * STATS_SCORE_BINS), 0), STATS_SCORE_BINS - 1)
+
+
+def build_stats(label_bins: Iterable[Tuple[str, int, int]], hours: Iterable[Tuple[str, int]]) -> Dict:
+    """Shape (label, bin, count) and (hour, count) rows into the get_stats result."""
+    labels = {}
+    for label, score_bin, count in label_bins:
+        stats = labels.setdefault(label, {"detections": 0, "score_histogram": [0] * STATS_SCORE_BINS})
+        stats["detections"] += count
+        stats["score_histogram"][score_bin] += count
+    return {
+        "labels": {label: stats for label, stats in sorted(labels.items()) if stats["detections"]},
+        "predictions_per_hour": {hour: count for hour, count in sorted(hours) if count},
+    }
+
+
+def box_area(box: List[float]) -> float:
+    # DynamoDB hands decimal-encoded boxes back as Decimal
+    x1, y1, x2, y2 = (float(v) for v in box)
+    return max(x2 - x1, 0.0) * max(y2 - y1, 0.0)
+
+
+def stage_reached(state: Optional[Dict], stage: str) -> bool:
+    """Whether a job state (as returned by get_job_state) has completed `stage`."""
+    return state is not None and JOB_STAGES.index(state["stage"]) >= JOB_STAGES.index(stage)
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(value: Any) -> str:
+    """Opaque, URL-safe pagination cursor for a JSON-serializable position."""
+    return base64.urlsafe_b64encode(json.dumps(value, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Any:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursorError("Invalid cursor")
 
 
 class BaseStorage(ABC):
@@ -17,6 +73,83 @@ class BaseStorage(ABC):
         """
         pass
 
+    def save_prediction_with_detections(self, uid: str, original_image: str, predicted_image: str,
+                                        detections: List[Dict]) -> None:
+        """
+        Save a prediction session together with all of its detections.
+        Each detection is a dict with "label", "score" and "box" keys.
+        Backends should override this to write everything in one batch, and
+        saving the same prediction again must replace it rather than fail.
+        """
+        self.save_prediction(uid, original_image, predicted_image)
+        for detection in detections:
+            self.save_detection(uid, detection["label"], detection["score"], detection["box"])
+
+    @abstractmethod
+    def save_content_hash(self, content_hash: str, prediction_uid: str) -> None:
+        """
+        Remember which prediction was computed for an image with this content hash.
+        The first prediction recorded for a hash is kept.
+        """
+        pass
+
+    @abstractmethod
+    def find_prediction_by_hash(self, content_hash: str) -> Optional[str]:
+        """
+        Get the UID of a stored prediction for an image with this content hash, or None.
+        """
+        pass
+
+    def copy_prediction(self, source_uid: str, uid: str, original_image: str) -> None:
+        """
+        Store the predicted image and detections of `source_uid` under a new prediction UID.
+        """
+        source = self.get_prediction(source_uid)
+        self.save_prediction_with_detections(uid, original_image, source["predicted_image"], [
+            {"label": d["label"], "score": d["score"], "box": d["box"]}
+            for d in source["detection_objects"]
+        ])
+
+    @abstractmethod
+    def get_job_state(self, uid: str) -> Optional[Dict]:
+        """
+        Get the processing state of a prediction job: a dict with "stage" (one
+        of JOB_STAGES), "data" (a JSON-serializable dict), "owner" and
+        "lease_until", or None if the job was never claimed.
+        """
+        pass
+
+    @abstractmethod
+    def claim_job(self, uid: str, owner: str, lease_seconds: float) -> bool:
+        """
+        Take ownership of a job for `lease_seconds`, creating its state at
+        "received" if needed. Fails (returns False) while another owner holds
+        an unexpired lease.
+        """
+        pass
+
+    @abstractmethod
+    def update_job_state(self, uid: str, stage: str, data: Dict, lease_seconds: float) -> None:
+        """
+        Record that a claimed job completed `stage`, replacing its data and
+        renewing the lease.
+        """
+        pass
+
+    @abstractmethod
+    def release_job(self, uid: str, owner: str) -> None:
+        """
+        Give up ownership of a job, so a redelivery can claim it right away.
+        """
+        pass
+
+    @abstractmethod
+    def ping(self) -> None:
+        """
+        Check that the backend is reachable. Raises if it is not.
+        """
+        pass
+
     @abstractmethod
     def get_prediction(self, uid: str) -> Dict:
         """
@@ -24,6 +157,17 @@ class BaseStorage(ABC):
         """
         pass
 
+    @abstractmethod
+    def get_stats(self, hours: int = 24) -> Dict:
+        """
+        Aggregates kept up to date on every write, so reading them doesn't
+        depend on how many predictions are stored: per label the number of
+        detections and a score histogram (STATS_SCORE_BINS bins), and the
+        number of predictions saved in each of the last `hours` hours (UTC,
+        keyed "YYYY-MM-DDTHH:00").
+        """
+        pass
+
     @abstractmethod
     def get_predictions_by_label(self, label: str) -> List[Dict]:
         """
@@ -38,6 +182,73 @@ class BaseStorage(ABC):
         """
         pass
 
+    @abstractmethod
+    def get_predictions_by_label_page(self, label: str, limit: int,
+                                      cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Get one page of prediction sessions with a detection of the given label.
+        Returns the page and the cursor for the next one (None on the last page).
+        """
+        pass
+
+    @abstractmethod
+    def get_predictions_by_score_page(self, min_score: float, limit: int,
+                                      cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Get one page of prediction sessions with a detection scoring >= min_score.
+        Returns the page and the cursor for the next one (None on the last page).
+        """
+        pass
+
+    @abstractmethod
+    def get_predictions_by_box_page(self, label: Optional[str], region: Optional[Tuple[float, float, float, float]],
+                                    min_area: Optional[float], limit: int,
+                                    cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Get one page of prediction sessions with a detection matching all of the
+        given filters: its label, its box overlapping `region` (x1, y1, x2, y2)
+        and its box area >= `min_area`. At least one filter must be given.
+        Raises NotImplementedError for filters the backend can't answer.
+        """
+        pass
+
+    def get_predictions_by_box(self, label: Optional[str], region: Optional[Tuple[float, float, float, float]],
+                               min_area: Optional[float]) -> List[Dict]:
+        """
+        Get all prediction sessions with a detection matching the box filters.
+        """
+        return list(self.iter_predictions_by_box(label, region, min_area))
+
+    def iter_predictions_by_label(self, label: str) -> Iterator[Dict]:
+        """
+        Yield every prediction session with the given label, one page at a time.
+        """
+        return self._iter_pages(lambda cursor: self.get_predictions_by_label_page(label, ITER_PAGE_SIZE, cursor))
+
+    def iter_predictions_by_score(self, min_score: float) -> Iterator[Dict]:
+        """
+        Yield every prediction session with a detection scoring >= min_score, one page at a time.
+        """
+        return self._iter_pages(lambda cursor: self.get_predictions_by_score_page(min_score, ITER_PAGE_SIZE, cursor))
+
+    def iter_predictions_by_box(self, label: Optional[str], region: Optional[Tuple[float, float, float, float]],
+                                min_area: Optional[float]) -> Iterator[Dict]:
+        """
+        Yield every prediction session with a detection matching the box filters, one page at a time.
+        """
+        return self._iter_pages(
+            lambda cursor: self.get_predictions_by_box_page(label, region, min_area, ITER_PAGE_SIZE, cursor)
+        )
+
+    @staticmethod
+    def _iter_pages(fetch_page) -> Iterator[Dict]:
+        cursor = None
+        while True:
+            page, cursor = fetch_page(cursor)
+            yield from page
+            if cursor is None:
+                return
+
     @abstractmethod
     def get_prediction_image_path(self, uid: str) -> str:
         """
@@ -0,0 +1,256 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+import metrics
+from .async_base import AsyncBaseStorage
+from .base import BaseStorage
+
+try:
+    import redis
+except ImportError:  # Only needed for a shared cache
+    redis = None
+
+cache_hits = metrics.counter("storage.cache.hits", "Prediction lookups answered from the cache")
+cache_misses = metrics.counter("storage.cache.misses", "Prediction lookups that went to storage")
+cache_duration = metrics.histogram("storage.cache.duration", "Time to answer a cached prediction lookup", "s")
+
+# Lookups answered from the cache, all keyed by prediction uid
+CACHED_OPERATIONS = ("get_prediction", "get_prediction_image_path")
+_MISSING = {"missing": True}
+
+
+class LRUCache:
+    """A thread-safe LRU of at most `max_entries` values, each expiring after its own TTL."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class CachedStorage:
+    """
+    Read-through cache in front of any storage backend for the lookups
+    clients poll: get_prediction and get_prediction_image_path.
+
+    Results are kept in an in-process LRU for `ttl` seconds and, if
+    `redis_url` is given, in a Redis server shared by the replicas. A uid
+    that doesn't exist yet ("Prediction not found") is cached for
+    `negative_ttl` seconds. Saving or copying a prediction through this
+    wrapper drops its entries from both levels; other replicas can serve a
+    stale local entry until it expires. Every other call goes straight
+    through.
+    """
+
+    def __init__(self, storage: BaseStorage, max_entries: int = 10000, ttl: float = 60.0,
+                 negative_ttl: float = 2.0, redis_url: Optional[str] = None, key_prefix: str = "prediction:"):
+        self._storage = storage
+        self._local = LRUCache(max_entries)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.key_prefix = key_prefix
+        # Bumped by every invalidation, so a lookup that raced with a write
+        # doesn't cache what it read before the write
+        self._generation = 0
+        self._shared = None
+        if redis_url:
+            if redis is None:
+                raise RuntimeError("redis_url needs the redis package (pip install redis)")
+            self._shared = redis.Redis.from_url(redis_url, socket_timeout=0.5)
+
+    @property
+    def wrapped(self) -> BaseStorage:
+        return self._storage
+
+    def __getattr__(self, name):
+        return getattr(self._storage, name)
+
+    def _key(self, operation: str, uid: str) -> str:
+        return f"{self.key_prefix}{operation}:{uid}"
+
+    def _shared_get(self, key: str) -> Optional[Any]:
+        try:
+            raw = self._shared.get(key)
+        except redis.RedisError:
+            # The shared cache is an optimisation, storage still answers
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    def _shared_put(self, key: str, value: Any, ttl: float) -> None:
+        try:
+            # Decimal scores (DynamoDB) come back as floats
+            self._shared.set(key, json.dumps(value, default=float), px=int(ttl * 1000))
+        except redis.RedisError:
+            pass
+
+    def _lookup(self, operation: str, uid: str):
+        started = time.perf_counter()
+        key = self._key(operation, uid)
+        level = "local"
+        entry = self._local.get(key)
+        if entry is None and self._shared is not None:
+            level = "shared"
+            entry = self._shared_get(key)
+            if entry is not None:
+                self._local.put(key, entry, self.negative_ttl if entry == _MISSING else self.ttl)
+
+        if entry is None:
+            level = "storage"
+            cache_misses.add(1, {"operation": operation})
+            generation = self._generation
+            try:
+                entry = {"value": getattr(self._storage, operation)(uid)}
+                ttl = self.ttl
+            except ValueError:
+                entry, ttl = _MISSING, self.negative_ttl
+            if generation == self._generation:
+                self._local.put(key, entry, ttl)
+                if self._shared is not None:
+                    self._shared_put(key, entry, ttl)
+        else:
+            cache_hits.add(1, {"operation": operation, "level": level})
+        cache_duration.record(time.perf_counter() - started, {"operation": operation, "level": level})
+
+        if entry == _MISSING:
+            raise ValueError("Prediction not found")
+        return entry["value"]
+
+    def invalidate(self, *uids: str) -> None:
+        self._generation += 1
+        keys = [self._key(operation, uid) for uid in uids for operation in CACHED_OPERATIONS]
+        for key in keys:
+            self._local.delete(key)
+        if self._shared is not None:
+            try:
+                self._shared.delete(*keys)
+            except redis.RedisError:
+                pass
+
+    def get_prediction(self, uid: str):
+        return self._lookup("get_prediction", uid)
+
+    def get_prediction_image_path(self, uid: str) -> str:
+        return self._lookup("get_prediction_image_path", uid)
+
+    def save_prediction(self, uid: str, original_image: str, predicted_image: str) -> None:
+        try:
+            self._storage.save_prediction(uid, original_image, predicted_image)
+        finally:
+            self.invalidate(uid)
+
+    def save_detection(self, prediction_uid: str, label: str, score: float, box) -> None:
+        try:
+            self._storage.save_detection(prediction_uid, label, score, box)
+        finally:
+            self.invalidate(prediction_uid)
+
+    def save_prediction_with_detections(self, uid: str, original_image: str, predicted_image: str,
+                                        detections) -> None:
+        try:
+            self._storage.save_prediction_with_detections(uid, original_image, predicted_image, detections)
+        finally:
+            self.invalidate(uid)
+
+    def copy_prediction(self, source_uid: str, uid: str, original_image: str) -> None:
+        try:
+            self._storage.copy_prediction(source_uid, uid, original_image)
+        finally:
+            self.invalidate(uid)
+
+
+class AsyncCachedStorage:
+    """
+    The same cache in front of an async backend. It shares the in-process LRU
+    of the CachedStorage used by the blocking code, so a save made there
+    drops entries read here and the other way round. Lookups skip the Redis
+    level, as its client would block the event loop.
+    """
+
+    def __init__(self, storage: AsyncBaseStorage, cache: CachedStorage):
+        self._storage = storage
+        self._cache = cache
+
+    @property
+    def wrapped(self) -> AsyncBaseStorage:
+        return self._storage
+
+    def __getattr__(self, name):
+        return getattr(self._storage, name)
+
+    async def _lookup(self, operation: str, uid: str):
+        cache = self._cache
+        started = time.perf_counter()
+        key = cache._key(operation, uid)
+        level = "local"
+        entry = cache._local.get(key)
+        if entry is None:
+            level = "storage"
+            cache_misses.add(1, {"operation": operation})
+            generation = cache._generation
+            try:
+                entry = {"value": await getattr(self._storage, operation)(uid)}
+                ttl = cache.ttl
+            except ValueError:
+                entry, ttl = _MISSING, cache.negative_ttl
+            if generation == cache._generation:
+                cache._local.put(key, entry, ttl)
+        else:
+            cache_hits.add(1, {"operation": operation, "level": level})
+        cache_duration.record(time.perf_counter() - started, {"operation": operation, "level": level})
+
+        if entry == _MISSING:
+            raise ValueError("Prediction not found")
+        return entry["value"]
+
+    async def invalidate(self, *uids: str) -> None:
+        if self._cache._shared is not None:
+            # Deleting from Redis blocks
+            await asyncio.to_thread(self._cache.invalidate, *uids)
+        else:
+            self._cache.invalidate(*uids)
+
+    async def get_prediction(self, uid: str):
+        return await self._lookup("get_prediction", uid)
+
+    async def get_prediction_image_path(self, uid: str) -> str:
+        return await self._lookup("get_prediction_image_path", uid)
+
+    async def save_prediction_with_detections(self, uid: str, original_image: str, predicted_image: str,
+                                              detections) -> None:
+        try:
+            await self._storage.save_prediction_with_detections(uid, original_image, predicted_image, detections)
+        finally:
+            await self.invalidate(uid)
+
+    async def copy_prediction(self, source_uid: str, uid: str, original_image: str) -> None:
+        try:
+            await self._storage.copy_prediction(source_uid, uid, original_image)
+        finally:
+            await self.invalidate(uid)
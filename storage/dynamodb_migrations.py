@@ -0,0 +1,124 @@
+"""
+One-off maintenance helpers for the DynamoDB predictions table.
+
+    python -m storage.dynamodb_migrations create-score-index
+    python -m storage.dynamodb_migrations backfill-score-buckets
+    python -m storage.dynamodb_migrations enable-ttl
+"""
+import argparse
+import os
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+from storage.dynamodb_storage import TOP_SCORE, TTL_ATTRIBUTE, score_bucket
+
+SCORE_INDEX_NAME = "ScoreBucketIndex"
+
+
+def create_score_index(table, index_name: str = SCORE_INDEX_NAME, wait: bool = True) -> None:
+    """
+    Add the score-bucket GSI (score_bucket HASH, score RANGE) to an existing
+    table. Besides the keys it only projects the TOP_SCORE marker, all a
+    score query needs to return each prediction once.
+    """
+    table.reload()
+    if any(index["IndexName"] == index_name for index in table.global_secondary_indexes or []):
+        print(f"Index {index_name} already exists")
+        return
+
+    update = {
+        "Create": {
+            "IndexName": index_name,
+            "KeySchema": [
+                {"AttributeName": "score_bucket", "KeyType": "HASH"},
+                {"AttributeName": "score", "KeyType": "RANGE"},
+            ],
+            "Projection": {"ProjectionType": "INCLUDE", "NonKeyAttributes": [TOP_SCORE]},
+        }
+    }
+    if table.billing_mode_summary is None or table.billing_mode_summary.get("BillingMode") != "PAY_PER_REQUEST":
+        update["Create"]["ProvisionedThroughput"] = {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5}
+
+    table.meta.client.update_table(
+        TableName=table.name,
+        AttributeDefinitions=[
+            {"AttributeName": "score_bucket", "AttributeType": "N"},
+            {"AttributeName": "score", "AttributeType": "N"},
+        ],
+        GlobalSecondaryIndexUpdates=[update],
+    )
+    print(f"Creating index {index_name} on {table.name}")
+
+    while wait:
+        table.reload()
+        statuses = {index["IndexName"]: index["IndexStatus"] for index in table.global_secondary_indexes or []}
+        if statuses.get(index_name) == "ACTIVE":
+            break
+        time.sleep(5)
+
+
+def backfill_score_buckets(table, page_size: int = 500) -> int:
+    """
+    Set score_bucket on DETECT items written before the index existed so they
+    become visible to score queries. Safe to run more than once.
+    """
+    updated = 0
+    kwargs = {
+        "FilterExpression": Attr("SK").begins_with("DETECT#") & Attr("score_bucket").not_exists(),
+        "ProjectionExpression": "PK, SK, score",
+        "Limit": page_size,
+    }
+    while True:
+        response = table.scan(**kwargs)
+        for item in response.get("Items", []):
+            table.update_item(
+                Key={"PK": item["PK"], "SK": item["SK"]},
+                UpdateExpression="SET score_bucket = :bucket",
+                ExpressionAttributeValues={":bucket": score_bucket(item["score"])},
+            )
+            updated += 1
+        last_key = response.get("LastEvaluatedKey")
+        if not last_key:
+            break
+        kwargs["ExclusiveStartKey"] = last_key
+        print(f"Backfilled {updated} detections so far")
+
+    return updated
+
+
+def enable_ttl(table, attribute: str = TTL_ATTRIBUTE) -> None:
+    """
+    Turn on DynamoDB TTL for the expiry attribute the storage sets when
+    RETENTION_DAYS is configured. Items written before keep no expiry.
+    """
+    client = table.meta.client
+    status = client.describe_time_to_live(TableName=table.name)["TimeToLiveDescription"]
+    if status.get("TimeToLiveStatus") in ("ENABLED", "ENABLING"):
+        print(f"TTL is already enabled on {status.get('AttributeName')}")
+        return
+    client.update_time_to_live(
+        TableName=table.name,
+        TimeToLiveSpecification={"Enabled": True, "AttributeName": attribute},
+    )
+    print(f"Enabled TTL on {attribute} for {table.name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DynamoDB predictions table migrations")
+    parser.add_argument("command", choices=["create-score-index", "backfill-score-buckets", "enable-ttl"])
+    parser.add_argument("--table", default=os.getenv("DYNAMODB_TABLE", "PredictionsDev-merry"))
+    args = parser.parse_args()
+
+    table = boto3.resource("dynamodb", region_name="eu-west-2").Table(args.table)
+    if args.command == "create-score-index":
+        create_score_index(table)
+    elif args.command == "enable-ttl":
+        enable_ttl(table)
+    else:
+        print(f"Backfilled {backfill_score_buckets(table)} detections")
+
+
+if __name__ == "__main__":
+    main()
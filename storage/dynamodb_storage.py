@@ -1,46 +1,322 @@
 import boto3
-from boto3.dynamodb.conditions import Key
-from typing import List, Dict
-from storage.base import BaseStorage
+from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+from typing import List, Dict, Optional, Tuple
+from storage.base import (
+    STATS_SCORE_BINS, BaseStorage, InvalidCursorError, box_area, build_stats, decode_cursor, encode_cursor, stats_bin
+)
 import os
 import hashlib
+import json
+import logging
+import random
+import struct
+import time
+from collections import Counter
 from decimal import Decimal
 
-class DynamoDBStorage(BaseStorage):
-    def __init__(self, table_name: str = None):
+logger = logging.getLogger(__name__)
+
+# BatchWriteItem accepts at most 25 put/delete requests per call
+BATCH_WRITE_LIMIT = 25
+BATCH_WRITE_RETRIES = 6
+# TransactWriteItems accepts at most 100 actions per call
+TRANSACT_WRITE_LIMIT = 100
+# "decimal" stores the box as a list of numbers, "packed" as 16 bytes of float32
+BOX_ENCODINGS = ("decimal", "packed")
+# Detections are spread over SCORE_BUCKETS + 1 partitions of the score index
+# (0.0-0.1 -> 0, ..., 0.9-1.0 -> 9, exactly 1.0 -> 10)
+SCORE_BUCKETS = 10
+# Aggregate counters for get_stats: one item per label and one per hour
+STATS_PK = "STATS"
+# With a retention period, items carry their expiry time (epoch seconds) in this
+# attribute and DynamoDB TTL deletes them
+TTL_ATTRIBUTE = "expires_at"
+# Markers on the detection a label query (the prediction's first of that label,
+# by sort key) and a score query (its highest score) return the prediction at,
+# so paging skips the other detections without reading the prediction
+FIRST_OF_LABEL = "first_of_label"
+TOP_SCORE = "top_score"
+
+# Cursors carry DynamoDB keys in the typed wire format so numbers survive JSON
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def encode_box(box: List[float], encoding: str = "decimal"):
+    if encoding == "packed":
+        return Binary(struct.pack("<4f", *box))
+    return [Decimal(str(x)) for x in box]
+
+
+def decode_box(value) -> List[float]:
+    """Read a box stored with either encoding."""
+    if isinstance(value, Binary):
+        value = value.value
+    if isinstance(value, (bytes, bytearray)):
+        return list(struct.unpack("<4f", value))
+    return value
+
+
+def score_bucket(score: float) -> int:
+    return min(max(int(float(score) * SCORE_BUCKETS), 0), SCORE_BUCKETS)
+
+
+def stats_hour(timestamp: float = None) -> str:
+    return time.strftime("%Y-%m-%dT%H:00", time.gmtime(timestamp))
+
+
+def detection_id(label: str, score: float, box: List[float]) -> str:
+    return hashlib.md5(f"{label}-{score}-{box}".encode()).hexdigest()
+
+
+def batch_write_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter before retrying unprocessed items."""
+    return random.uniform(0, min(0.05 * (2 ** attempt), 2.0))
+
+
+def is_condition_failure(error) -> bool:
+    """Whether a TransactionCanceledException was caused by the META item's condition."""
+    reasons = error.response.get("CancellationReasons", [])
+    return bool(reasons) and reasons[0].get("Code") == "ConditionalCheckFailed"
+
+
+class DynamoDBSchema:
+    """
+    How predictions are laid out in the table, shared by the sync and async
+    backends: the items and requests they send and how responses are read
+    back, without any I/O. Read requests are (operation, kwargs, key
+    attributes) tuples, where operation names a Table method.
+    """
+
+    def __init__(self, table_name: str = None, box_encoding: str = None, score_index: str = None,
+                 retention_days: float = None):
         if table_name is None:
             table_name = os.getenv("DYNAMODB_TABLE", "PredictionsDev-merry")
-        self.table = boto3.resource("dynamodb",region_name="eu-west-2").Table(table_name)
+        self.table_name = table_name
+        if box_encoding is None:
+            box_encoding = os.getenv("DYNAMODB_BOX_ENCODING", "decimal")
+        if box_encoding not in BOX_ENCODINGS:
+            raise ValueError(f"Unsupported DYNAMODB_BOX_ENCODING: {box_encoding}")
+        self.box_encoding = box_encoding
+        # An empty index name falls back to a (paginated) table scan
+        if score_index is None:
+            score_index = os.getenv("DYNAMODB_SCORE_INDEX", "ScoreBucketIndex")
+        self.score_index = score_index
+        # 0 keeps items forever
+        if retention_days is None:
+            retention_days = float(os.getenv("RETENTION_DAYS", "0"))
+        self.retention_days = retention_days
 
-    def save_prediction(self, uid: str, original_image: str, predicted_image: str) -> None:
-        self.table.put_item(Item={
+    def _expiry(self) -> Dict:
+        """The TTL attribute for an item written now, if items expire."""
+        if not self.retention_days:
+            return {}
+        return {TTL_ATTRIBUTE: Decimal(int(time.time() + self.retention_days * 86400))}
+
+    def _meta_item(self, uid: str, original_image: str, predicted_image: str) -> Dict:
+        return {
             "PK": f"PRED#{uid}",
             "SK": "META",
             "original_image": original_image,
-            "predicted_image": predicted_image
-        })
+            "predicted_image": predicted_image,
+            # Same format as SQLite's timestamps, for archives
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+            **self._expiry()
+        }
 
-    def save_detection(self, prediction_uid: str, label: str, score: float, box: List[float]) -> None:
-        detection_id = hashlib.md5(f"{label}-{score}-{box}".encode()).hexdigest()
-        item = {
+    def _detection_item(self, prediction_uid: str, label: str, score: float, box: List[float]) -> Dict:
+        return {
             "PK": f"PRED#{prediction_uid}",
-            "SK": f"DETECT#{label}#{detection_id}",
+            "SK": f"DETECT#{label}#{detection_id(label, score, box)}",
             "label": label,
             "score": Decimal(str(score)),
-            "box": [Decimal(str(x)) for x in box]
+            "score_bucket": score_bucket(score),
+            "box": encode_box(box, self.box_encoding),
+            "area": Decimal(str(box_area(box))),
+            **self._expiry()
         }
 
-        print(f"✅ Saving detection item: {item}")
-        try:
-            self.table.put_item(Item=item)
-        except Exception as e:
-            print(f"❌ Failed to save detection: {e}")
+    def _detection_items(self, uid: str, detections: List[Dict]) -> List[Dict]:
+        items = {}
+        for d in detections:
+            item = self._detection_item(uid, d["label"], d["score"], d["box"])
+            # A batch may not contain the same key twice; identical boxes collapse anyway
+            items[item["SK"]] = item
+        items = sorted(items.values(), key=lambda item: item["SK"])
+        top = min(items, key=lambda item: -item["score"], default=None)
+        labels = set()
+        for item in items:
+            item[FIRST_OF_LABEL] = item["label"] not in labels
+            item[TOP_SCORE] = item is top
+            labels.add(item["label"])
+        return items
 
-    def get_prediction(self, uid: str) -> Dict:
-        response = self.table.query(
-            KeyConditionExpression=Key("PK").eq(f"PRED#{uid}")
+    def _batch_requests(self, writes: List[Dict]) -> List[Dict]:
+        """BatchWriteItem RequestItems for the put/delete requests, in chunks of 25."""
+        return [
+            {self.table_name: writes[start:start + BATCH_WRITE_LIMIT]}
+            for start in range(0, len(writes), BATCH_WRITE_LIMIT)
+        ]
+
+    @staticmethod
+    def _puts(items: List[Dict]) -> List[Dict]:
+        return [{"PutRequest": {"Item": item}} for item in items]
+
+    @staticmethod
+    def _detections_query(uid: str) -> Dict:
+        """Query kwargs for the keys of a prediction's detections."""
+        return {
+            "KeyConditionExpression": Key("PK").eq(f"PRED#{uid}") & Key("SK").begins_with("DETECT#"),
+            "ProjectionExpression": "PK, SK",
+        }
+
+    @staticmethod
+    def _stale_deletes(saved: List[Dict], items: List[Dict]) -> List[Dict]:
+        """Delete requests for the detections of an earlier save that aren't among `items`."""
+        kept = {item["SK"] for item in items}
+        return [{"DeleteRequest": {"Key": {"PK": item["PK"], "SK": item["SK"]}}}
+                for item in saved if item["SK"] not in kept]
+
+    def _unprocessed_error(self, request: Dict) -> RuntimeError:
+        pending = len(request.get(self.table_name, []))
+        return RuntimeError(f"{pending} items still unprocessed after {BATCH_WRITE_RETRIES} attempts")
+
+    def _stats_updates(self, label_bins: Counter, hour: Optional[str]) -> List[Dict]:
+        """
+        TransactWriteItems Update actions that ADD to the aggregate counters:
+        per label its detection count and histogram bins, per hour the
+        number of predictions.
+        """
+        counters = {}
+        if hour:
+            counters["HOUR#" + hour] = {"predictions": 1}
+        for (label, score_bin), count in label_bins.items():
+            counts = counters.setdefault("LABEL#" + label, {"detections": 0})
+            counts["detections"] += count
+            counts[f"bin{score_bin}"] = count
+
+        actions = []
+        for sort_key, counts in counters.items():
+            update = {
+                "TableName": self.table_name,
+                "Key": {"PK": STATS_PK, "SK": sort_key},
+                "UpdateExpression": "ADD " + ", ".join(f"#a{i} :v{i}" for i in range(len(counts))),
+                "ExpressionAttributeNames": {f"#a{i}": name for i, name in enumerate(counts)},
+                "ExpressionAttributeValues": {f":v{i}": count for i, count in enumerate(counts.values())},
+            }
+            expiry = self._expiry()
+            if expiry and sort_key.startswith("HOUR#"):
+                # Hourly counters expire with the predictions they count; label
+                # totals are kept (TTL deletes don't decrement them)
+                update["UpdateExpression"] += " SET #ttl = :ttl"
+                update["ExpressionAttributeNames"]["#ttl"] = TTL_ATTRIBUTE
+                update["ExpressionAttributeValues"][":ttl"] = expiry[TTL_ATTRIBUTE]
+            actions.append({"Update": update})
+        return actions
+
+    def _save_actions(self, meta: Dict, items: List[Dict]) -> List[Dict]:
+        """
+        The META item is written last, in one transaction with the counter
+        updates and only if it doesn't exist yet, so a retried save isn't
+        counted twice. Only the first TRANSACT_WRITE_LIMIT actions go in the
+        transaction; the rest (more than 98 distinct labels) are updates
+        applied after it.
+        """
+        label_bins = Counter((item["label"], stats_bin(item["score"])) for item in items)
+        return [{"Put": {
+            "TableName": self.table_name,
+            "Item": meta,
+            "ConditionExpression": "attribute_not_exists(PK)",
+        }}] + self._stats_updates(label_bins, stats_hour())
+
+    def _hash_put(self, content_hash: str, prediction_uid: str) -> Dict:
+        # The first prediction of an image wins, until its hash item expires
+        return dict(
+            Item={"PK": f"HASH#{content_hash}", "SK": "META", "prediction_uid": prediction_uid, **self._expiry()},
+            ConditionExpression="attribute_not_exists(PK) OR #ttl < :now",
+            ExpressionAttributeNames={"#ttl": TTL_ATTRIBUTE},
+            ExpressionAttributeValues={":now": Decimal(int(time.time()))},
         )
-        items = response.get("Items", [])
+
+    @staticmethod
+    def _hash_prediction(item: Optional[Dict]) -> Optional[str]:
+        """
+        The prediction UID of a hash item, or None once it has expired. TTL
+        deletes items up to days late and in any order, so an expired hash
+        may outlive the prediction it points at.
+        """
+        if item is None or item.get(TTL_ATTRIBUTE, float("inf")) < time.time():
+            return None
+        return item["prediction_uid"]
+
+    @staticmethod
+    def _job_key(uid: str) -> Dict:
+        return {"PK": f"JOB#{uid}", "SK": "STATE"}
+
+    @staticmethod
+    def _job_state(item: Optional[Dict]) -> Optional[Dict]:
+        if item is None:
+            return None
+        lease_until = item.get("lease_until")
+        return {
+            "stage": item["stage"],
+            "data": json.loads(item.get("data", "{}")),
+            "owner": item.get("owner"),
+            "lease_until": float(lease_until) if lease_until is not None else None,
+        }
+
+    def _claim_update(self, uid: str, owner: str, lease_seconds: float) -> Dict:
+        now = time.time()
+        update = dict(
+            Key=self._job_key(uid),
+            UpdateExpression=(
+                "SET #owner = :owner, lease_until = :lease_until, "
+                "stage = if_not_exists(stage, :received), updated_at = if_not_exists(updated_at, :now)"
+            ),
+            ConditionExpression="attribute_not_exists(#owner) OR #owner = :owner OR lease_until < :now",
+            ExpressionAttributeNames={"#owner": "owner"},
+            ExpressionAttributeValues={
+                ":owner": owner,
+                ":lease_until": Decimal(str(now + lease_seconds)),
+                ":received": "received",
+                ":now": Decimal(str(now)),
+            },
+        )
+        expiry = self._expiry()
+        if expiry:
+            update["UpdateExpression"] += ", #ttl = :ttl"
+            update["ExpressionAttributeNames"]["#ttl"] = TTL_ATTRIBUTE
+            update["ExpressionAttributeValues"][":ttl"] = expiry[TTL_ATTRIBUTE]
+        return update
+
+    def _stage_update(self, uid: str, stage: str, data: Dict, lease_seconds: float) -> Dict:
+        now = time.time()
+        return dict(
+            Key=self._job_key(uid),
+            UpdateExpression="SET stage = :stage, #data = :data, lease_until = :lease_until, updated_at = :now",
+            ExpressionAttributeNames={"#data": "data"},
+            ExpressionAttributeValues={
+                ":stage": stage,
+                # Stored as a JSON string so floats don't need converting to Decimal
+                ":data": json.dumps(data),
+                ":lease_until": Decimal(str(now + lease_seconds)),
+                ":now": Decimal(str(now)),
+            },
+        )
+
+    def _release_update(self, uid: str, owner: str) -> Dict:
+        return dict(
+            Key=self._job_key(uid),
+            UpdateExpression="REMOVE #owner, lease_until",
+            ConditionExpression="#owner = :owner",
+            ExpressionAttributeNames={"#owner": "owner"},
+            ExpressionAttributeValues={":owner": owner},
+        )
+
+    @staticmethod
+    def _prediction(uid: str, items: List[Dict]) -> Dict:
+        """Shape the items under a prediction's partition key into get_prediction's result."""
         if not items:
             raise ValueError("Prediction not found")
 
@@ -52,7 +328,7 @@ class DynamoDBStorage(BaseStorage):
             {
                 "label": item["label"],
                 "score": item["score"],
-                "box": item["box"]
+                "box": decode_box(item["box"])
             }
             for item in items if item["SK"].startswith("DETECT#")
         ]
@@ -64,35 +340,334 @@ class DynamoDBStorage(BaseStorage):
             "detection_objects": detections
         }
 
-    def get_predictions_by_label(self, label: str) -> List[Dict]:
+    @staticmethod
+    def _stats_queries(hours: int) -> Tuple[Dict, Dict]:
+        """Query kwargs for the label counters and for the last `hours` hourly counters."""
+        now = time.time()
+        first_hour = stats_hour(now - (hours - 1) * 3600)
+        return (
+            {"KeyConditionExpression": Key("PK").eq(STATS_PK) & Key("SK").begins_with("LABEL#")},
+            {"KeyConditionExpression": Key("PK").eq(STATS_PK) & Key("SK").between(
+                "HOUR#" + first_hour, "HOUR#" + stats_hour(now)
+            )},
+        )
+
+    @staticmethod
+    def _stats(label_items: List[Dict], hour_items: List[Dict]) -> Dict:
+        label_bins = [
+            (item["SK"][len("LABEL#"):], score_bin, int(item.get(f"bin{score_bin}", 0)))
+            for item in label_items for score_bin in range(STATS_SCORE_BINS)
+        ]
+        hourly = [(item["SK"][len("HOUR#"):], int(item["predictions"])) for item in hour_items]
+        return build_stats(label_bins, hourly)
+
+    def _label_requests(self, label: str) -> List[Tuple]:
+        """
+        (operation, kwargs, key attributes, match, first) for reading
+        detections of a label; `match` is the same test as a filter on the
+        prediction's items, and `first(item)` tells from the item's markers
+        whether the prediction is returned at it (None when it can't tell).
+        """
+        return [("query", {
+            "IndexName": "LabelIndex",
+            "KeyConditionExpression": Key("label").eq(label),
+            "FilterExpression": Attr("SK").begins_with("DETECT#"),
+        }, ("PK", "SK", "label"), Attr("label").eq(label), lambda item: item.get(FIRST_OF_LABEL))]
+
+    def _score_requests(self, min_score: float) -> List[Tuple]:
+        """(operation, kwargs, key attributes, match, first) for reading detections scoring >= min_score."""
+        threshold = Decimal(str(min_score))
+        match = Attr("score").gte(threshold)
+        # A prediction matches exactly when its highest score does
+        def first(item):
+            return item.get(TOP_SCORE)
+
+        if not self.score_index:
+            return [("scan", {
+                "FilterExpression": Attr("SK").begins_with("DETECT#") & match,
+            }, ("PK", "SK"), match, first)]
+
+        # Only the buckets that can hold a match are read, highest scores
+        # first, and within the lowest bucket the sort key skips the rest.
+        # Whatever the index projects is read: indexes created before TOP_SCORE
+        # was projected only have the keys.
+        return [("query", {
+            "IndexName": self.score_index,
+            "KeyConditionExpression": Key("score_bucket").eq(bucket) & Key("score").gte(threshold),
+            "ScanIndexForward": False,
+            "Select": "ALL_PROJECTED_ATTRIBUTES",
+        }, ("PK", "SK", "score_bucket", "score"), match, first)
+            for bucket in range(SCORE_BUCKETS, score_bucket(min_score) - 1, -1)]
+
+    def _box_requests(self, label: Optional[str], region: Optional[Tuple[float, float, float, float]],
+                      min_area: Optional[float]) -> List[Tuple]:
+        # No spatial index here: read the label's detections through LabelIndex
+        # and filter them server-side
+        if label is None:
+            raise NotImplementedError("DynamoDB box queries need a label")
+        operation, kwargs, attributes, match, _ = self._label_requests(label)[0]
+        if region is not None:
+            if self.box_encoding != "decimal":
+                raise NotImplementedError("Region queries need DYNAMODB_BOX_ENCODING=decimal")
+            x1, y1, x2, y2 = (Decimal(str(v)) for v in region)
+            match = (match & Attr("box[0]").lte(x2) & Attr("box[2]").gte(x1)
+                     & Attr("box[1]").lte(y2) & Attr("box[3]").gte(y1))
+        if min_area is not None:
+            # Detections saved before the area attribute existed never match
+            match = match & Attr("area").gte(Decimal(str(min_area)))
+        # The label's first detection is the first match if it matches at all;
+        # after it, an earlier one may have been filtered out
+        return [(operation, dict(kwargs, FilterExpression=Attr("SK").begins_with("DETECT#") & match), attributes,
+                 match, lambda item: True if item.get(FIRST_OF_LABEL) else None)]
+
+    @staticmethod
+    def _with_projection(kwargs: Dict, attributes) -> Dict:
+        if "Select" in kwargs:
+            return kwargs
+        names = {f"#k{i}": name for i, name in enumerate((*attributes, FIRST_OF_LABEL, TOP_SCORE))}
+        return dict(kwargs, ProjectionExpression=", ".join(names), ExpressionAttributeNames=names)
+
+    @staticmethod
+    def _first_match(pk: str, match):
+        """
+        Steps (see `_page_steps`) returning the smallest sort key among the
+        prediction's detections passing `match`, or None if there are none.
+        """
+        kwargs = {
+            "KeyConditionExpression": Key("PK").eq(pk) & Key("SK").begins_with("DETECT#"),
+            "FilterExpression": match,
+            "ProjectionExpression": "SK",
+        }
+        while True:
+            response = yield "query", kwargs
+            items = response.get("Items", [])
+            # Sort keys come back in ascending order
+            if items:
+                return items[0]["SK"]
+            if not response.get("LastEvaluatedKey"):
+                return None
+            kwargs = dict(kwargs, ExclusiveStartKey=response["LastEvaluatedKey"])
+
+    def _page_steps(self, requests: List[Tuple], limit: int, cursor: Optional[str]):
+        """
+        Read detections until `limit` distinct predictions are found. The
+        cursor records which request we are in and the key of the last item
+        consumed. The indexes keep a prediction's detections apart, so each
+        prediction is only returned at one of them, which its markers point
+        out: the first of the label for label and box queries, the highest
+        score for score queries. It appears exactly once across all pages.
+        Detections the markers can't decide (saved before them, read
+        through a keys-only score index, or after the label's first in a
+        box query) fall back to the first matching detection by sort key,
+        found with one query of the prediction's items per page it shows
+        up on. Predictions come in index order (highest score first for
+        score queries), not by timestamp as in SQLite.
+
+        A generator so both backends can drive it: it yields the
+        (operation, kwargs) to call, is sent the response and returns the page
+        and the next cursor.
+        """
+        request_index, start_key = 0, None
+        if cursor is not None:
+            position = decode_cursor(cursor)
+            try:
+                request_index = int(position["request"])
+                if position["key"] is not None:
+                    start_key = {k: _deserializer.deserialize(v) for k, v in position["key"].items()}
+            except (KeyError, TypeError, ValueError):
+                raise InvalidCursorError("Invalid cursor")
+
+        page, first_matches = [], {}
+        while request_index < len(requests):
+            operation, kwargs, attributes, match, first = requests[request_index]
+            kwargs = dict(self._with_projection(kwargs, attributes), Limit=limit)
+            if start_key:
+                kwargs["ExclusiveStartKey"] = start_key
+            response = yield operation, kwargs
+            items = response.get("Items", [])
+            last_key = response.get("LastEvaluatedKey")
+
+            for i, item in enumerate(items):
+                pred_uid = item["PK"].split("#")[1]
+                is_first = first(item)
+                if is_first is None:
+                    if pred_uid not in first_matches:
+                        first_matches[pred_uid] = yield from self._first_match(item["PK"], match)
+                    is_first = item["SK"] == first_matches[pred_uid]
+                if is_first:
+                    first_matches[pred_uid] = item["SK"]
+                    page.append({"uid": pred_uid})
+                if len(page) == limit:
+                    exhausted = (i == len(items) - 1 and not last_key
+                                 and request_index == len(requests) - 1)
+                    if exhausted:
+                        return page, None
+                    # Resume right after this item
+                    key = {k: _serializer.serialize(item[k]) for k in attributes}
+                    return page, encode_cursor({"request": request_index, "key": key})
+
+            start_key = last_key
+            if not start_key:
+                request_index += 1
+
+        return page, None
+
+
+class DynamoDBStorage(DynamoDBSchema, BaseStorage):
+    def __init__(self, table_name: str = None, box_encoding: str = None, score_index: str = None,
+                 retention_days: float = None):
+        super().__init__(table_name, box_encoding, score_index, retention_days)
+        self.table = boto3.resource("dynamodb",region_name="eu-west-2").Table(self.table_name)
+
+    def _batch_write(self, writes: List[Dict]) -> None:
+        """
+        Apply put/delete requests with BatchWriteItem in chunks of 25,
+        retrying unprocessed items with exponential backoff and jitter.
+        """
+        client = self.table.meta.client
+        for request in self._batch_requests(writes):
+            for attempt in range(BATCH_WRITE_RETRIES):
+                response = client.batch_write_item(RequestItems=request)
+                request = response.get("UnprocessedItems") or {}
+                if not request:
+                    break
+                time.sleep(batch_write_delay(attempt))
+            else:
+                raise self._unprocessed_error(request)
+
+    def _add_stats(self, label_bins: Counter, hour: Optional[str]) -> None:
+        for action in self._stats_updates(label_bins, hour):
+            self.table.meta.client.update_item(**action["Update"])
+
+    def save_prediction(self, uid: str, original_image: str, predicted_image: str) -> None:
+        self.table.put_item(Item=self._meta_item(uid, original_image, predicted_image))
+        self._add_stats(Counter(), stats_hour())
+
+    def save_detection(self, prediction_uid: str, label: str, score: float, box: List[float]) -> None:
+        item = self._detection_item(prediction_uid, label, score, box)
+
+        logger.debug("Saving detection item: %s", item)
+        try:
+            self.table.put_item(Item=item)
+            self._add_stats(Counter({(label, stats_bin(score)): 1}), None)
+        except Exception as e:
+            logger.error("Failed to save detection: %s", e)
+
+    def save_prediction_with_detections(self, uid: str, original_image: str, predicted_image: str,
+                                        detections: List[Dict]) -> None:
+        items = self._detection_items(uid, detections)
+        logger.debug("Saving prediction %s with %d detections", uid, len(items))
+        self._batch_write(self._puts(items))
+
+        meta = self._meta_item(uid, original_image, predicted_image)
+        actions = self._save_actions(meta, items)
+        client = self.table.meta.client
+        try:
+            client.transact_write_items(TransactItems=actions[:TRANSACT_WRITE_LIMIT])
+        except client.exceptions.TransactionCanceledException as e:
+            if not is_condition_failure(e):
+                raise
+            # Saved before: replace the metadata without counting it again and
+            # drop the detections the new save doesn't have
+            self.table.put_item(Item=meta)
+            saved = list(self._paginate("query", **self._detections_query(uid)))
+            self._batch_write(self._stale_deletes(saved, items))
+            return
+        for action in actions[TRANSACT_WRITE_LIMIT:]:
+            client.update_item(**action["Update"])
+
+    def save_content_hash(self, content_hash: str, prediction_uid: str) -> None:
+        try:
+            self.table.put_item(**self._hash_put(content_hash, prediction_uid))
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    def find_prediction_by_hash(self, content_hash: str) -> Optional[str]:
+        response = self.table.get_item(Key={"PK": f"HASH#{content_hash}", "SK": "META"})
+        return self._hash_prediction(response.get("Item"))
+
+    def get_job_state(self, uid: str) -> Optional[Dict]:
+        return self._job_state(self.table.get_item(Key=self._job_key(uid), ConsistentRead=True).get("Item"))
+
+    def claim_job(self, uid: str, owner: str, lease_seconds: float) -> bool:
+        try:
+            self.table.update_item(**self._claim_update(uid, owner, lease_seconds))
+            return True
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def update_job_state(self, uid: str, stage: str, data: Dict, lease_seconds: float) -> None:
+        self.table.update_item(**self._stage_update(uid, stage, data, lease_seconds))
+
+    def release_job(self, uid: str, owner: str) -> None:
+        try:
+            self.table.update_item(**self._release_update(uid, owner))
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    def ping(self) -> None:
+        # One eventually consistent read of a key that never exists; raises if the
+        # table is missing or the credentials are wrong
+        self.table.get_item(Key={"PK": "PING", "SK": "META"})
+
+    def get_prediction(self, uid: str) -> Dict:
         response = self.table.query(
-            IndexName="LabelIndex",
-            KeyConditionExpression=Key("label").eq(label)
+            KeyConditionExpression=Key("PK").eq(f"PRED#{uid}")
         )
-        items = response.get("Items", [])
+        return self._prediction(uid, response.get("Items", []))
 
+    def _paginate(self, operation: str, **kwargs):
+        """Yield items from query/scan, following LastEvaluatedKey."""
+        while True:
+            response = getattr(self.table, operation)(**kwargs)
+            yield from response.get("Items", [])
+            last_key = response.get("LastEvaluatedKey")
+            if not last_key:
+                return
+            kwargs["ExclusiveStartKey"] = last_key
+
+    def _unique_predictions(self, requests: List[Tuple]) -> List[Dict]:
         predictions = {}
-        for item in items:
-            if item.get("SK", "").startswith("DETECT#"):
+        for operation, kwargs, attributes, *_ in requests:
+            for item in self._paginate(operation, **self._with_projection(kwargs, attributes)):
                 pred_uid = item["PK"].split("#")[1]
                 if pred_uid not in predictions:
                     predictions[pred_uid] = {"uid": pred_uid}
 
         return list(predictions.values())
 
+    def _unique_predictions_page(self, requests: List[Tuple], limit: int,
+                                 cursor: Optional[str]) -> Tuple[List[Dict], Optional[str]]:
+        steps = self._page_steps(requests, limit, cursor)
+        try:
+            operation, kwargs = next(steps)
+            while True:
+                operation, kwargs = steps.send(getattr(self.table, operation)(**kwargs))
+        except StopIteration as done:
+            return done.value
+
+    def get_stats(self, hours: int = 24) -> Dict:
+        label_query, hour_query = self._stats_queries(hours)
+        return self._stats(list(self._paginate("query", **label_query)), list(self._paginate("query", **hour_query)))
+
+    def get_predictions_by_label(self, label: str) -> List[Dict]:
+        return self._unique_predictions(self._label_requests(label))
+
     def get_predictions_by_score(self, min_score: float) -> List[Dict]:
-        # Full table scan (use GSI in production)
-        response = self.table.scan()
-        items = response.get("Items", [])
+        return self._unique_predictions(self._score_requests(min_score))
 
-        predictions = {}
-        for item in items:
-            if item.get("SK", "").startswith("DETECT#") and float(item.get("score", 0)) >= min_score:
-                pred_uid = item["PK"].split("#")[1]
-                if pred_uid not in predictions:
-                    predictions[pred_uid] = {"uid": pred_uid}
+    def get_predictions_by_label_page(self, label: str, limit: int,
+                                      cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        return self._unique_predictions_page(self._label_requests(label), limit, cursor)
 
-        return list(predictions.values())
+    def get_predictions_by_score_page(self, min_score: float, limit: int,
+                                      cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        return self._unique_predictions_page(self._score_requests(min_score), limit, cursor)
+
+    def get_predictions_by_box_page(self, label: Optional[str], region: Optional[Tuple[float, float, float, float]],
+                                    min_area: Optional[float], limit: int,
+                                    cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        return self._unique_predictions_page(self._box_requests(label, region, min_area), limit, cursor)
 
     def get_prediction_image_path(self, uid: str) -> str:
         response = self.table.get_item(
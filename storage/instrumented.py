@@ -0,0 +1,109 @@
+import functools
+import inspect
+import time
+import types
+
+import metrics
+from .base import BaseStorage
+
+storage_duration = metrics.histogram("storage.duration", "Time spent in a storage call", "s")
+storage_errors = metrics.counter("storage.errors", "Storage calls that raised")
+
+
+class InstrumentedStorage:
+    """
+    Wraps a storage backend and records the latency of every method call,
+    labelled with the backend and the method name. Coroutine methods (of the
+    async backends) are timed until they complete, and the iter_* generators
+    for the time spent producing their rows until they are exhausted or closed.
+    """
+
+    def __init__(self, storage: BaseStorage):
+        self._storage = storage
+        self._backend = type(storage).__name__
+
+    @property
+    def wrapped(self) -> BaseStorage:
+        return self._storage
+
+    def __getattr__(self, name):
+        attr = getattr(self._storage, name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+
+        attributes = {"backend": self._backend, "operation": name}
+
+        if inspect.iscoroutinefunction(attr):
+            @functools.wraps(attr)
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await attr(*args, **kwargs)
+                except Exception:
+                    storage_errors.add(1, attributes)
+                    raise
+                finally:
+                    storage_duration.record(time.perf_counter() - started, attributes)
+
+            setattr(self, name, timed)
+            return timed
+
+        @functools.wraps(attr)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                storage_errors.add(1, attributes)
+                storage_duration.record(time.perf_counter() - started, attributes)
+                raise
+            elapsed = time.perf_counter() - started
+            if isinstance(result, types.GeneratorType):
+                return _timed_rows(result, attributes, elapsed)
+            if isinstance(result, types.AsyncGeneratorType):
+                return _timed_rows_async(result, attributes, elapsed)
+            storage_duration.record(elapsed, attributes)
+            return result
+
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, timed)
+        return timed
+
+
+def _timed_rows(rows, attributes, elapsed: float):
+    # Only the time inside the storage's generator counts, not the caller's between rows
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            except Exception:
+                storage_errors.add(1, attributes)
+                raise
+            finally:
+                elapsed += time.perf_counter() - started
+            yield row
+    finally:
+        rows.close()
+        storage_duration.record(elapsed, attributes)
+
+
+async def _timed_rows_async(rows, attributes, elapsed: float):
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                row = await rows.__anext__()
+            except StopAsyncIteration:
+                return
+            except Exception:
+                storage_errors.add(1, attributes)
+                raise
+            finally:
+                elapsed += time.perf_counter() - started
+            yield row
+    finally:
+        await rows.aclose()
+        storage_duration.record(elapsed, attributes)
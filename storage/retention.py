@@ -0,0 +1,316 @@
+"""
+Retention of old predictions. Before they are removed, expired predictions
+can be exported to compressed Parquet files for offline analytics: one file
+of sessions and one of detections per run, written a chunk at a time.
+
+    python -m storage.retention prune-sqlite --days 90 [--db predictions.db] [--archive-dir archive]
+    python -m storage.retention archive-dynamodb [--day 2024-05-01] --archive-dir archive
+
+DynamoDB items expire by themselves through TTL (see
+`python -m storage.dynamodb_migrations enable-ttl`); archive-dynamodb exports
+the predictions that expire on a given day before TTL deletes them.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Only needed to export archives
+    pa = None
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+from storage.base import box_area
+from storage.dynamodb_storage import TTL_ATTRIBUTE, decode_box
+from storage.sqlite_storage import has_text_boxes, init_schema, row_box
+
+# Columns of the detections archive
+DETECTION_FIELDS = ("prediction_uid", "label", "score", "x1", "y1", "x2", "y2", "area")
+
+
+def archive_schemas() -> Dict[str, "pa.Schema"]:
+    """Schemas of the two archive files. Timestamps are UTC, as SQLite's CURRENT_TIMESTAMP."""
+    return {
+        "sessions": pa.schema([
+            ("uid", pa.string()),
+            ("timestamp", pa.timestamp("s", tz="UTC")),
+            ("original_image", pa.string()),
+            ("predicted_image", pa.string()),
+        ]),
+        "detections": pa.schema(
+            [("prediction_uid", pa.string()), ("label", pa.string())]
+            + [(name, pa.float64()) for name in DETECTION_FIELDS[2:]]
+        ),
+    }
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime.datetime]:
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc)
+
+
+class ParquetArchive:
+    """
+    Writes <name>.sessions.parquet and <name>.detections.parquet in
+    `directory`, one row group per `write`, so memory stays bounded by the
+    chunk size. The files get their final name only when the archive is
+    closed without an error, so an archive file that exists is complete.
+    Use as a context manager.
+    """
+
+    def __init__(self, directory: str, name: str, compression: str = "zstd"):
+        if pa is None:
+            raise RuntimeError("Archiving needs the pyarrow package (pip install pyarrow)")
+        os.makedirs(directory, exist_ok=True)
+        self.schemas = archive_schemas()
+        self.paths = {table: os.path.join(directory, f"{name}.{table}.parquet") for table in self.schemas}
+        self.rows = {table: 0 for table in self.schemas}
+        self._writers = {
+            table: pq.ParquetWriter(self.paths[table] + ".tmp", schema, compression=compression)
+            for table, schema in self.schemas.items()
+        }
+
+    def write(self, sessions: List[Dict], detections: List[Dict]) -> None:
+        for table, rows in (("sessions", sessions), ("detections", detections)):
+            if rows:
+                self._writers[table].write_table(pa.Table.from_pylist(rows, schema=self.schemas[table]))
+                self.rows[table] += len(rows)
+
+    def close(self) -> List[str]:
+        """Finish the files and return their paths; nothing is kept if no rows were written."""
+        if not self.rows["sessions"]:
+            self.abort()
+            return []
+        for table, writer in self._writers.items():
+            writer.close()
+            temporary = self.paths[table] + ".tmp"
+            # On disk before the rows it holds are deleted
+            with open(temporary, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(temporary, self.paths[table])
+        return list(self.paths.values())
+
+    def abort(self) -> None:
+        for table, writer in self._writers.items():
+            writer.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.paths[table] + ".tmp")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is not None:
+            self.abort()
+
+
+def _expired_sessions(conn: sqlite3.Connection, last: Tuple[str, str],
+                      batch_size: int) -> Iterator[List[sqlite3.Row]]:
+    """Sessions up to `last` in (timestamp, uid) order, `batch_size` at a time."""
+    after = None
+    while True:
+        condition, params = "(timestamp, uid) <= (?, ?)", tuple(last)
+        if after is not None:
+            condition += " AND (timestamp, uid) > (?, ?)"
+            params += after
+        rows = conn.execute(f"""
+            SELECT * FROM prediction_sessions WHERE {condition}
+            ORDER BY timestamp, uid LIMIT ?
+        """, params + (batch_size,)).fetchall()
+        if not rows:
+            return
+        yield rows
+        after = (rows[-1]["timestamp"], rows[-1]["uid"])
+
+
+def _export_sqlite(conn: sqlite3.Connection, last: Tuple[str, str], archive_dir: str, name: str,
+                   batch_size: int) -> List[str]:
+    text_boxes = has_text_boxes(conn)
+    with ParquetArchive(archive_dir, name) as archive:
+        for sessions in _expired_sessions(conn, last, batch_size):
+            uids = json.dumps([row["uid"] for row in sessions])
+            detections = conn.execute("""
+                SELECT * FROM detection_objects WHERE prediction_uid IN (SELECT value FROM json_each(?))
+            """, (uids,)).fetchall()
+            detection_rows = []
+            for row in detections:
+                box = row_box(row, text_boxes)
+                area = row["area"] if row["area"] is not None else box_area(box)
+                detection_rows.append(dict(zip(DETECTION_FIELDS, (
+                    row["prediction_uid"], row["label"], row["score"], *box, area
+                ))))
+            archive.write(
+                [dict(dict(row), timestamp=parse_timestamp(row["timestamp"])) for row in sessions],
+                detection_rows,
+            )
+        return archive.close()
+
+
+def incremental_vacuum(conn: sqlite3.Connection, pages_per_step: int = 1000) -> int:
+    """
+    Give free pages back to the file system, `pages_per_step` pages per
+    transaction so other writers are never blocked for long. Needs a
+    database with auto_vacuum=INCREMENTAL. Returns the number of pages freed.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        print("auto_vacuum is not INCREMENTAL, the file keeps its size; "
+              "see `python -m storage.sqlite_migrations enable-incremental-vacuum`")
+        return 0
+    freed = 0
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    while free:
+        conn.execute(f"PRAGMA incremental_vacuum({min(free, pages_per_step)})").fetchall()
+        conn.commit()
+        remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if remaining >= free:
+            break
+        freed += free - remaining
+        free = remaining
+    return freed
+
+
+def prune_sqlite(db_path: str, retention_days: float, archive_dir: Optional[str] = None,
+                 batch_size: int = 500, vacuum_pages: int = 1000,
+                 on_pruned: Optional[Callable[..., None]] = None) -> Dict:
+    """
+    Delete the predictions saved more than `retention_days` ago with their
+    detections, content hashes and job states, then shrink the file with
+    incremental vacuum. Triggers keep the R*Tree and the /stats aggregates
+    in step with the deletes.
+
+    With `archive_dir`, every expired prediction is first exported to
+    Parquet; nothing is deleted unless the export completed. Deletes run
+    `batch_size` predictions per transaction, so the service can keep
+    writing meanwhile, and an interrupted run picks up where it stopped.
+    `on_pruned(*uids)` is called after each batch is committed, e.g. to
+    drop the deleted predictions from a cache. Returns what was done: predictions deleted, job states deleted, pages
+    freed and the archive files written.
+    """
+    now = time.time()
+    cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - retention_days * 86400))
+
+    result = {"predictions": 0, "jobs": 0, "pages_freed": 0, "archived": []}
+    with contextlib.closing(sqlite3.connect(db_path)) as conn:
+        # Brings the schema (indexes, triggers) up to date
+        with conn:
+            init_schema(conn)
+        conn.row_factory = sqlite3.Row
+        # Everything up to the newest expired session is handled, so rows
+        # saved while the export runs are never deleted unexported
+        last = conn.execute("""
+            SELECT timestamp, uid FROM prediction_sessions WHERE timestamp < ?
+            ORDER BY timestamp DESC, uid DESC LIMIT 1
+        """, (cutoff,)).fetchone()
+        if last is not None:
+            last = (last["timestamp"], last["uid"])
+            if archive_dir:
+                name = "predictions-" + time.strftime("%Y%m%dT%H%M%S", time.gmtime(now))
+                result["archived"] = _export_sqlite(conn, last, archive_dir, name, batch_size)
+
+            while True:
+                with conn:
+                    uids = [row[0] for row in conn.execute("""
+                        SELECT uid FROM prediction_sessions WHERE (timestamp, uid) <= (?, ?)
+                        ORDER BY timestamp, uid LIMIT ?
+                    """, last + (batch_size,))]
+                    if not uids:
+                        break
+                    expired = json.dumps(uids)
+                    for table, column in (("detection_objects", "prediction_uid"), ("content_hashes", "prediction_uid"),
+                                          ("job_states", "uid"), ("prediction_sessions", "uid")):
+                        conn.execute(f"""
+                            DELETE FROM {table} WHERE {column} IN (SELECT value FROM json_each(?))
+                        """, (expired,))
+                result["predictions"] += len(uids)
+                if on_pruned is not None:
+                    on_pruned(*uids)
+
+        with conn:
+            # Jobs that never produced a prediction
+            result["jobs"] = conn.execute("""
+                DELETE FROM job_states WHERE updated_at < ?
+            """, (now - retention_days * 86400,)).rowcount
+            conn.execute("DELETE FROM label_stats WHERE count <= 0")
+            conn.execute("DELETE FROM hourly_stats WHERE count <= 0")
+        result["pages_freed"] = incremental_vacuum(conn, vacuum_pages)
+    return result
+
+
+def archive_dynamodb(table, day: datetime.date, archive_dir: str, page_size: int = 1000) -> List[str]:
+    """
+    Export the predictions whose TTL falls on `day` (UTC) to Parquet, one
+    scan page at a time. DynamoDB deletes expired items some time after
+    their expiry, so running this daily for the next day archives every
+    prediction before it disappears. The archive is named after the day and
+    running it again replaces it.
+    """
+    start = int(datetime.datetime.combine(day, datetime.time(), datetime.timezone.utc).timestamp())
+    kwargs = {
+        "FilterExpression": Attr("PK").begins_with("PRED#") & Attr(TTL_ATTRIBUTE).between(start, start + 86399),
+        "Limit": page_size,
+    }
+    with ParquetArchive(archive_dir, f"dynamodb-{day.isoformat()}") as archive:
+        while True:
+            response = table.scan(**kwargs)
+            sessions, detections = [], []
+            for item in response.get("Items", []):
+                uid = item["PK"][len("PRED#"):]
+                if item["SK"] == "META":
+                    sessions.append({
+                        "uid": uid,
+                        "timestamp": parse_timestamp(item.get("created_at")),
+                        "original_image": item["original_image"],
+                        "predicted_image": item["predicted_image"],
+                    })
+                elif item["SK"].startswith("DETECT#"):
+                    box = [float(v) for v in decode_box(item["box"])]
+                    area = float(item["area"]) if "area" in item else box_area(box)
+                    detections.append(dict(zip(DETECTION_FIELDS, (uid, item["label"], float(item["score"]), *box, area))))
+            archive.write(sessions, detections)
+            last_key = response.get("LastEvaluatedKey")
+            if not last_key:
+                break
+            kwargs["ExclusiveStartKey"] = last_key
+        return archive.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retention of old predictions")
+    parser.add_argument("command", choices=["prune-sqlite", "archive-dynamodb"])
+    parser.add_argument("--db", default="predictions.db")
+    parser.add_argument("--days", type=float, default=float(os.getenv("RETENTION_DAYS", "0")),
+                        help="retention period of prune-sqlite")
+    parser.add_argument("--archive-dir", default=os.getenv("ARCHIVE_DIR"))
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--table", default=os.getenv("DYNAMODB_TABLE", "PredictionsDev-merry"))
+    parser.add_argument("--day", type=datetime.date.fromisoformat,
+                        help="expiry day to archive, defaults to tomorrow (UTC)")
+    args = parser.parse_args()
+
+    if args.command == "prune-sqlite":
+        if args.days <= 0:
+            parser.error("--days (or RETENTION_DAYS) must be positive")
+        result = prune_sqlite(args.db, args.days, args.archive_dir, args.batch_size)
+        print(f"Deleted {result['predictions']} predictions and {result['jobs']} job states, "
+              f"freed {result['pages_freed']} pages")
+    else:
+        if not args.archive_dir:
+            parser.error("--archive-dir (or ARCHIVE_DIR) is required")
+        table = boto3.resource("dynamodb", region_name="eu-west-2").Table(args.table)
+        day = args.day or (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)).date()
+        result = {"archived": archive_dynamodb(table, day, args.archive_dir)}
+    for path in result["archived"]:
+        print(f"Archived to {path}")
+
+
+if __name__ == "__main__":
+    main()
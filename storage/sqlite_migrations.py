@@ -0,0 +1,99 @@
+"""
+One-off maintenance helpers for the SQLite predictions database.
+
+    python -m storage.sqlite_migrations migrate-boxes [--db predictions.db]
+    python -m storage.sqlite_migrations enable-incremental-vacuum [--db predictions.db]
+"""
+import argparse
+import sqlite3
+from contextlib import closing
+
+from storage.sqlite_storage import has_text_boxes, init_schema
+
+
+def migrate_boxes(db_path: str, batch_size: int = 10000, drop_text: bool = True) -> int:
+    """
+    Convert boxes stored as text (databases from before the numeric box
+    columns) into x1/y1/x2/y2/area, which also fills the R*Tree through its
+    triggers. Works in batches of `batch_size` rows, one transaction each, so
+    it can run next to a live service and be resumed. Once every row is
+    converted the text column is dropped unless `drop_text` is False; rows
+    whose text isn't a list of four numbers keep it. Running storages look
+    for the column again before copying boxes, so the drop is safe live too.
+    Returns the number of rows converted.
+    """
+    converted = 0
+    with closing(sqlite3.connect(db_path)) as conn:
+        # Adds the numeric columns, R*Tree and triggers if they are missing
+        with conn:
+            init_schema(conn)
+        if not has_text_boxes(conn):
+            print("Boxes are already numeric")
+            return 0
+
+        while True:
+            # The text is str() of a Python list, which is valid JSON
+            updated = conn.execute("""
+                UPDATE detection_objects SET
+                    x1 = json_extract(box, '$[0]'),
+                    y1 = json_extract(box, '$[1]'),
+                    x2 = json_extract(box, '$[2]'),
+                    y2 = json_extract(box, '$[3]'),
+                    area = max(json_extract(box, '$[2]') - json_extract(box, '$[0]'), 0)
+                         * max(json_extract(box, '$[3]') - json_extract(box, '$[1]'), 0)
+                WHERE id IN (
+                    SELECT id FROM detection_objects
+                    WHERE x1 IS NULL AND json_valid(box) AND json_array_length(box) = 4
+                    LIMIT ?
+                )
+            """, (batch_size,)).rowcount
+            conn.commit()
+            if not updated:
+                break
+            converted += updated
+            print(f"Converted {converted} boxes so far")
+
+        unreadable = conn.execute("""
+            SELECT COUNT(*) FROM detection_objects WHERE x1 IS NULL AND box IS NOT NULL
+        """).fetchone()[0]
+        if unreadable:
+            print(f"{unreadable} boxes could not be read, keeping the text column")
+        elif drop_text:
+            conn.execute("ALTER TABLE detection_objects DROP COLUMN box")
+            print("Dropped the text box column")
+
+    return converted
+
+
+def enable_incremental_vacuum(db_path: str) -> None:
+    """
+    Switch a database created before auto_vacuum=INCREMENTAL to it, so the
+    retention pruner can shrink the file. This rewrites the whole database
+    with VACUUM, which holds an exclusive lock and needs as much free disk as
+    the file takes: run it while the service is stopped.
+    """
+    with closing(sqlite3.connect(db_path)) as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            print("Incremental vacuum is already enabled")
+            return
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        print("Enabled incremental vacuum")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite predictions database migrations")
+    parser.add_argument("command", choices=["migrate-boxes", "enable-incremental-vacuum"])
+    parser.add_argument("--db", default="predictions.db")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--keep-text", action="store_true", help="keep the old text box column")
+    args = parser.parse_args()
+
+    if args.command == "enable-incremental-vacuum":
+        enable_incremental_vacuum(args.db)
+    else:
+        print(f"Converted {migrate_boxes(args.db, args.batch_size, not args.keep_text)} boxes")
+
+
+if __name__ == "__main__":
+    main()
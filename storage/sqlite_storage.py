@@ -1,53 +1,369 @@
+import json
 import sqlite3
-from typing import List, Dict
-from storage.base import BaseStorage
+import threading
+import time
+from typing import List, Dict, Optional, Tuple
+from storage.base import (
+    STATS_SCORE_BINS, BaseStorage, InvalidCursorError, box_area, build_stats, decode_cursor, encode_cursor
+)
 import os
 
 
+# Box coordinates and area, as stored in detection_objects
+BOX_COLUMNS = ("x1", "y1", "x2", "y2", "area")
+
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    # NORMAL is durable in WAL mode except for the last commits on power loss
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def box_values(box: List[float]) -> Tuple[float, ...]:
+    x1, y1, x2, y2 = (float(v) for v in box)
+    return x1, y1, x2, y2, box_area([x1, y1, x2, y2])
+
+
+def init_schema(conn: sqlite3.Connection) -> None:
+    """Create or upgrade the tables, indexes and triggers on an open connection."""
+    # Lets the retention pruner give freed pages back with incremental_vacuum.
+    # Only takes effect on a new database; `python -m storage.sqlite_migrations
+    # enable-incremental-vacuum` converts an existing one.
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS prediction_sessions (
+            uid TEXT PRIMARY KEY,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            original_image TEXT,
+            predicted_image TEXT
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS detection_objects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            prediction_uid TEXT,
+            label TEXT,
+            score REAL,
+            x1 REAL,
+            y1 REAL,
+            x2 REAL,
+            y2 REAL,
+            area REAL,
+            FOREIGN KEY (prediction_uid) REFERENCES prediction_sessions (uid)
+        )
+    """)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(detection_objects)")]
+    for column in BOX_COLUMNS:
+        if column not in columns:
+            conn.execute(f"ALTER TABLE detection_objects ADD COLUMN {column} REAL")
+
+    # Spatial index over the boxes, kept in sync by triggers
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS detection_boxes USING rtree (id, min_x, max_x, min_y, max_y)
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS detection_boxes_insert AFTER INSERT ON detection_objects
+        WHEN new.x1 IS NOT NULL BEGIN
+            INSERT INTO detection_boxes VALUES (new.id, new.x1, new.x2, new.y1, new.y2);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS detection_boxes_update AFTER UPDATE OF x1, y1, x2, y2 ON detection_objects
+        WHEN new.x1 IS NOT NULL BEGIN
+            INSERT OR REPLACE INTO detection_boxes VALUES (new.id, new.x1, new.x2, new.y1, new.y2);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS detection_boxes_delete AFTER DELETE ON detection_objects BEGIN
+            DELETE FROM detection_boxes WHERE id = old.id;
+        END
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS content_hashes (
+            hash TEXT PRIMARY KEY,
+            prediction_uid TEXT,
+            FOREIGN KEY (prediction_uid) REFERENCES prediction_sessions (uid)
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS job_states (
+            uid TEXT PRIMARY KEY,
+            stage TEXT NOT NULL,
+            data TEXT NOT NULL DEFAULT '{}',
+            owner TEXT,
+            lease_until REAL,
+            updated_at REAL
+        )
+    """)
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_prediction_uid ON detection_objects (prediction_uid)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_label ON detection_objects (label)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_score ON detection_objects (score)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_label_area ON detection_objects (label, area)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_area ON detection_objects (area)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_session_order ON prediction_sessions (timestamp, uid)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_hash_prediction ON content_hashes (prediction_uid)")
+    _init_stats(conn)
+
+
+def _init_stats(conn: sqlite3.Connection) -> None:
+    """
+    Summary tables behind get_stats. Triggers update them in the same
+    transaction as every insert or delete; a replaced prediction (upsert)
+    is not counted twice.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'label_stats'").fetchone()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS label_stats (
+            label TEXT NOT NULL,
+            score_bin INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (label, score_bin)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS hourly_stats (
+            hour TEXT PRIMARY KEY,
+            count INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    score_bin = f"min(max(CAST({{}} * {STATS_SCORE_BINS} AS INTEGER), 0), {STATS_SCORE_BINS - 1})".format
+    hour = "strftime('%Y-%m-%dT%H:00', {})".format
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS label_stats_insert AFTER INSERT ON detection_objects BEGIN
+            INSERT INTO label_stats VALUES (new.label, {score_bin("new.score")}, 1)
+            ON CONFLICT (label, score_bin) DO UPDATE SET count = count + 1;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS label_stats_delete AFTER DELETE ON detection_objects BEGIN
+            UPDATE label_stats SET count = count - 1
+            WHERE label = old.label AND score_bin = {score_bin("old.score")};
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS hourly_stats_insert AFTER INSERT ON prediction_sessions BEGIN
+            INSERT INTO hourly_stats VALUES ({hour("new.timestamp")}, 1)
+            ON CONFLICT (hour) DO UPDATE SET count = count + 1;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS hourly_stats_delete AFTER DELETE ON prediction_sessions BEGIN
+            UPDATE hourly_stats SET count = count - 1 WHERE hour = {hour("old.timestamp")};
+        END
+    """)
+    if not exists:
+        # First start on an existing database: count what is already there
+        conn.execute(f"""
+            INSERT INTO label_stats SELECT label, {score_bin("score")}, COUNT(*) FROM detection_objects
+            WHERE true GROUP BY 1, 2
+        """)
+        conn.execute(f"""
+            INSERT INTO hourly_stats SELECT {hour("timestamp")}, COUNT(*) FROM prediction_sessions WHERE true GROUP BY 1
+        """)
+
+
+def has_text_boxes(conn: sqlite3.Connection) -> bool:
+    # Databases created before boxes were numeric keep the old text column
+    # until `python -m storage.sqlite_migrations migrate-boxes` drops it
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(detection_objects)")]
+    return "box" in columns
+
+
+def row_box(row: sqlite3.Row, text_boxes: bool) -> List[float]:
+    if row["x1"] is None and text_boxes:
+        # Not migrated yet, the text is str() of a list
+        return json.loads(row["box"])
+    return [row["x1"], row["y1"], row["x2"], row["y2"]]
+
+
+def detection_match(condition: str) -> str:
+    """Match the sessions with a detection satisfying `condition` (on `do`)."""
+    return f"""EXISTS (
+        SELECT 1 FROM detection_objects do
+        WHERE do.prediction_uid = ps.uid AND {condition}
+    )"""
+
+
+def box_match(label: Optional[str], region: Optional[Tuple[float, float, float, float]],
+              min_area: Optional[float]) -> Tuple[str, tuple]:
+    """Match the sessions with a detection passing the box query filters."""
+    conditions, params = [], ()
+    source = "detection_objects do"
+    if region is not None:
+        x1, y1, x2, y2 = region
+        # The R*Tree finds the candidates; it stores float32 rounded
+        # outwards, so the exact test is repeated on the table's columns
+        source = "detection_boxes r JOIN detection_objects do ON do.id = r.id"
+        conditions.append("r.min_x <= ? AND r.max_x >= ? AND r.min_y <= ? AND r.max_y >= ?")
+        conditions.append("do.x1 <= ? AND do.x2 >= ? AND do.y1 <= ? AND do.y2 >= ?")
+        params += (x2, x1, y2, y1) * 2
+    if label is not None:
+        conditions.append("do.label = ?")
+        params += (label,)
+    if min_area is not None:
+        conditions.append("do.area >= ?")
+        params += (min_area,)
+    if not conditions:
+        raise ValueError("At least one of label, region and min_area is required")
+    return f"ps.uid IN (SELECT do.prediction_uid FROM {source} WHERE {' AND '.join(conditions)})", params
+
+
+def page_query(match: str, params: tuple, limit: int, cursor: Optional[str]) -> Tuple[str, tuple]:
+    """
+    SQL for one keyset page of the prediction_sessions rows matching `match`,
+    ordered by (timestamp, uid). One extra row is read to tell if there is a
+    next page.
+    """
+    after = ""
+    if cursor is not None:
+        position = decode_cursor(cursor)
+        if not (isinstance(position, list) and len(position) == 2):
+            raise InvalidCursorError("Invalid cursor")
+        after = "AND (ps.timestamp, ps.uid) > (?, ?)"
+        params = params + tuple(position)
+    return f"""
+        SELECT ps.uid, ps.timestamp
+        FROM prediction_sessions ps
+        WHERE {match}
+        {after}
+        ORDER BY ps.timestamp, ps.uid
+        LIMIT ?
+    """, params + (limit + 1,)
+
+
+def page_result(rows: List[sqlite3.Row], limit: int) -> Tuple[List[Dict], Optional[str]]:
+    page = [{"uid": row["uid"], "timestamp": row["timestamp"]} for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor([last["timestamp"], last["uid"]])
+    return page, next_cursor
+
+
 class SQLiteStorage(BaseStorage):
     def __init__(self, db_path: str = "predictions.db"):
         self.db_path = db_path
-        self._init_db()
-
-    def _init_db(self):
         with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS prediction_sessions (
-                    uid TEXT PRIMARY KEY,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    original_image TEXT,
-                    predicted_image TEXT
-                )
-            """)
+            init_schema(conn)
+            self._text_boxes = has_text_boxes(conn)
+        # Writes share one long-lived connection; the lock serializes the
+        # worker threads that use it.
+        self._write_lock = threading.Lock()
+        self._write_conn = self._connect_writer()
 
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS detection_objects (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    prediction_uid TEXT,
-                    label TEXT,
-                    score REAL,
-                    box TEXT,
-                    FOREIGN KEY (prediction_uid) REFERENCES prediction_sessions (uid)
-                )
-            """)
-
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_prediction_uid ON detection_objects (prediction_uid)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_label ON detection_objects (label)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_score ON detection_objects (score)")
+    def _connect_writer(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for pragma in WRITER_PRAGMAS:
+            conn.execute(pragma)
+        return conn
 
     def save_prediction(self, uid: str, original_image: str, predicted_image: str) -> None:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._write_lock, self._write_conn as conn:
             conn.execute("""
                 INSERT INTO prediction_sessions (uid, original_image, predicted_image)
                 VALUES (?, ?, ?)
             """, (uid, original_image, predicted_image))
 
     def save_detection(self, prediction_uid: str, label: str, score: float, box: List[float]) -> None:
+        with self._write_lock, self._write_conn as conn:
+            conn.execute("""
+                INSERT INTO detection_objects (prediction_uid, label, score, x1, y1, x2, y2, area)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (prediction_uid, label, score) + box_values(box))
+
+    def save_prediction_with_detections(self, uid: str, original_image: str, predicted_image: str,
+                                        detections: List[Dict]) -> None:
+        # One transaction (and one fsync) for the session row and all of its boxes.
+        # Saving again (a redelivered job) replaces the previous boxes.
+        with self._write_lock, self._write_conn as conn:
+            conn.execute("""
+                INSERT INTO prediction_sessions (uid, original_image, predicted_image)
+                VALUES (?, ?, ?)
+                ON CONFLICT (uid) DO UPDATE SET
+                    original_image = excluded.original_image, predicted_image = excluded.predicted_image
+            """, (uid, original_image, predicted_image))
+            conn.execute("DELETE FROM detection_objects WHERE prediction_uid = ?", (uid,))
+            conn.executemany("""
+                INSERT INTO detection_objects (prediction_uid, label, score, x1, y1, x2, y2, area)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(uid, d["label"], d["score"]) + box_values(d["box"]) for d in detections])
+
+    def save_content_hash(self, content_hash: str, prediction_uid: str) -> None:
+        with self._write_lock, self._write_conn as conn:
+            conn.execute("""
+                INSERT OR IGNORE INTO content_hashes (hash, prediction_uid)
+                VALUES (?, ?)
+            """, (content_hash, prediction_uid))
+
+    def find_prediction_by_hash(self, content_hash: str) -> Optional[str]:
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("""
+                SELECT prediction_uid FROM content_hashes WHERE hash = ?
+            """, (content_hash,)).fetchone()
+            return row[0] if row else None
+
+    def copy_prediction(self, source_uid: str, uid: str, original_image: str) -> None:
+        with self._write_lock, self._write_conn as conn:
+            copied = conn.execute("""
+                INSERT INTO prediction_sessions (uid, original_image, predicted_image)
+                SELECT ?, ?, predicted_image FROM prediction_sessions WHERE uid = ?
+                ON CONFLICT (uid) DO UPDATE SET
+                    original_image = excluded.original_image, predicted_image = excluded.predicted_image
+            """, (uid, original_image, source_uid)).rowcount
+            if not copied:
+                raise ValueError("Prediction not found")
+            conn.execute("DELETE FROM detection_objects WHERE prediction_uid = ?", (uid,))
+            # migrate-boxes may have dropped the text column since we looked
+            self._text_boxes = self._text_boxes and has_text_boxes(conn)
+            columns = "label, score, x1, y1, x2, y2, area" + (", box" if self._text_boxes else "")
+            conn.execute(f"""
+                INSERT INTO detection_objects (prediction_uid, {columns})
+                SELECT ?, {columns} FROM detection_objects WHERE prediction_uid = ?
+            """, (uid, source_uid))
+
+    def get_job_state(self, uid: str) -> Optional[Dict]:
         with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("""
+                SELECT stage, data, owner, lease_until FROM job_states WHERE uid = ?
+            """, (uid,)).fetchone()
+        if row is None:
+            return None
+        return {"stage": row[0], "data": json.loads(row[1]), "owner": row[2], "lease_until": row[3]}
+
+    def claim_job(self, uid: str, owner: str, lease_seconds: float) -> bool:
+        now = time.time()
+        with self._write_lock, self._write_conn as conn:
             conn.execute("""
-                INSERT INTO detection_objects (prediction_uid, label, score, box)
-                VALUES (?, ?, ?, ?)
-            """, (prediction_uid, label, score, str(box)))
+                INSERT OR IGNORE INTO job_states (uid, stage, updated_at) VALUES (?, 'received', ?)
+            """, (uid, now))
+            claimed = conn.execute("""
+                UPDATE job_states SET owner = ?, lease_until = ?
+                WHERE uid = ? AND (owner IS NULL OR owner = ? OR lease_until < ?)
+            """, (owner, now + lease_seconds, uid, owner, now)).rowcount
+        return claimed == 1
+
+    def update_job_state(self, uid: str, stage: str, data: Dict, lease_seconds: float) -> None:
+        now = time.time()
+        with self._write_lock, self._write_conn as conn:
+            conn.execute("""
+                UPDATE job_states SET stage = ?, data = ?, lease_until = ?, updated_at = ? WHERE uid = ?
+            """, (stage, json.dumps(data), now + lease_seconds, now, uid))
+
+    def release_job(self, uid: str, owner: str) -> None:
+        with self._write_lock, self._write_conn as conn:
+            conn.execute("""
+                UPDATE job_states SET owner = NULL, lease_until = NULL WHERE uid = ? AND owner = ?
+            """, (uid, owner))
+
+    def ping(self) -> None:
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("SELECT 1 FROM prediction_sessions LIMIT 1")
 
     def get_prediction(self, uid: str) -> Dict:
         with sqlite3.connect(self.db_path) as conn:
@@ -74,7 +390,7 @@ class SQLiteStorage(BaseStorage):
                         "id": row["id"],
                         "label": row["label"],
                         "score": row["score"],
-                        "box": row["box"]
+                        "box": row_box(row, self._text_boxes)
                     } for row in detections
                 ]
             }
@@ -103,6 +419,46 @@ class SQLiteStorage(BaseStorage):
 
             return [{"uid": row["uid"], "timestamp": row["timestamp"]} for row in rows]
 
+    def get_stats(self, hours: int = 24) -> Dict:
+        with sqlite3.connect(self.db_path) as conn:
+            label_bins = conn.execute("SELECT label, score_bin, count FROM label_stats").fetchall()
+            hourly = conn.execute("""
+                SELECT hour, count FROM hourly_stats
+                WHERE hour > strftime('%Y-%m-%dT%H:00', 'now', ?)
+            """, (f"-{hours} hours",)).fetchall()
+        return build_stats(label_bins, hourly)
+
+    def _sessions_page(self, condition: str, params: tuple, limit: int,
+                       cursor: Optional[str]) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Keyset pagination over prediction_sessions ordered by (timestamp, uid),
+        keeping only sessions with a detection matching `condition`.
+        """
+        return self._page(detection_match(condition), params, limit, cursor)
+
+    def _page(self, match: str, params: tuple, limit: int,
+              cursor: Optional[str]) -> Tuple[List[Dict], Optional[str]]:
+        """Keyset pagination over the prediction_sessions rows matching `match`."""
+        sql, params = page_query(match, params, limit, cursor)
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(sql, params).fetchall()
+        return page_result(rows, limit)
+
+    def get_predictions_by_label_page(self, label: str, limit: int,
+                                      cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        return self._sessions_page("do.label = ?", (label,), limit, cursor)
+
+    def get_predictions_by_score_page(self, min_score: float, limit: int,
+                                      cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        return self._sessions_page("do.score >= ?", (min_score,), limit, cursor)
+
+    def get_predictions_by_box_page(self, label: Optional[str], region: Optional[Tuple[float, float, float, float]],
+                                    min_area: Optional[float], limit: int,
+                                    cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        match, params = box_match(label, region, min_area)
+        return self._page(match, params, limit, cursor)
+
     def get_prediction_image_path(self, uid: str) -> str:
         with sqlite3.connect(self.db_path) as conn:
             row = conn.execute("""
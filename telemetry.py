@@ -0,0 +1,76 @@
+import os
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+try:
+    from opentelemetry import context as otel_context, propagate, trace
+except ImportError:  # OpenTelemetry is optional; spans become no-ops
+    otel_context = propagate = trace = None
+
+SERVICE_NAME = "yolo-service"
+
+
+def setup() -> None:
+    """
+    Export metrics and traces over OTLP when OTEL_EXPORTER_OTLP_ENDPOINT is set.
+
+    Metrics are always exported. Traces are only recorded when
+    TRACE_SAMPLE_RATIO is above 0; the ratio applies per SQS message, and
+    every stage span of a sampled job is kept.
+    """
+    if trace is None or not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return
+    try:
+        from opentelemetry import metrics as otel_metrics
+        from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    except ImportError as e:
+        print(f"⚠️ OpenTelemetry SDK not installed, telemetry is not exported: {e}")
+        return
+
+    resource = Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", SERVICE_NAME)})
+    otel_metrics.set_meter_provider(MeterProvider(
+        resource=resource,
+        metric_readers=[PeriodicExportingMetricReader(OTLPMetricExporter())],
+    ))
+
+    sample_ratio = float(os.getenv("TRACE_SAMPLE_RATIO", "0"))
+    if sample_ratio > 0:
+        provider = TracerProvider(resource=resource, sampler=ParentBased(TraceIdRatioBased(sample_ratio)))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+    print(f"📈 Exporting telemetry to {os.environ['OTEL_EXPORTER_OTLP_ENDPOINT']} (trace sample ratio {sample_ratio})")
+
+
+def current_context():
+    """The active trace context, to be handed to work running elsewhere."""
+    return otel_context.get_current() if otel_context else None
+
+
+def extract_context(message: Dict):
+    """Continue a trace started by the producer if the SQS message carries one."""
+    if propagate is None:
+        return None
+    carrier = {
+        key: value["StringValue"]
+        for key, value in message.get("MessageAttributes", {}).items()
+        if "StringValue" in value
+    }
+    return propagate.extract(carrier) if carrier else None
+
+
+@contextmanager
+def span(name: str, parent=None, attributes: Optional[Dict] = None):
+    """Record a span, as a child of `parent` if given. Does nothing without OpenTelemetry."""
+    if trace is None:
+        yield None
+        return
+    tracer = trace.get_tracer(SERVICE_NAME)
+    with tracer.start_as_current_span(name, context=parent, attributes=attributes) as current:
+        yield current
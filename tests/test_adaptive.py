@@ -0,0 +1,65 @@
+import asyncio
+import unittest
+
+from adaptive import AdaptiveLimiter
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+
+    def test_acquire_takes_only_free_slots(self):
+        async def scenario():
+            limiter = AdaptiveLimiter(initial=4)
+            self.assertEqual(await limiter.acquire(10), 4)
+            waiter = asyncio.create_task(limiter.acquire(10))
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiter.done())
+            limiter.release(2)
+            self.assertEqual(await waiter, 2)
+
+        asyncio.run(scenario())
+
+    def test_grows_when_limit_reached_and_backlog_waiting(self):
+        async def scenario():
+            limiter = AdaptiveLimiter(initial=2, maximum=3)
+            await limiter.acquire(2)
+            self.assertEqual(limiter.adjust(cpu_percent=50, backlog=100), 3)
+            self.assertEqual(limiter.adjust(cpu_percent=50, backlog=100), 3)
+
+            idle = AdaptiveLimiter(initial=2)
+            self.assertEqual(idle.adjust(cpu_percent=50, backlog=100), 2)
+            await idle.acquire(2)
+            self.assertEqual(idle.adjust(cpu_percent=50, backlog=0), 2)
+
+        asyncio.run(scenario())
+
+    def test_holds_when_cpu_saturated(self):
+        async def scenario():
+            limiter = AdaptiveLimiter(initial=2)
+            await limiter.acquire(2)
+            self.assertEqual(limiter.adjust(cpu_percent=99, backlog=100), 2)
+
+        asyncio.run(scenario())
+
+    def test_shrinks_when_a_stage_slows_down(self):
+        async def scenario():
+            limiter = AdaptiveLimiter(initial=8, minimum=2)
+            limiter.record_latency("infer", 0.1)
+            limiter.record_latency("upload", 0.001)
+            self.assertEqual(limiter.adjust(cpu_percent=50, backlog=0), 8)
+
+            limiter.record_latency("infer", 0.35)
+            self.assertEqual(limiter.adjust(cpu_percent=50, backlog=100), 6)
+            # Tiny absolute slowdowns are noise
+            limiter.record_latency("upload", 0.005)
+            self.assertEqual(limiter.adjust(cpu_percent=50, backlog=0), 6)
+
+            for _ in range(5):
+                limiter.record_latency("infer", 10.0)
+                limiter.adjust(cpu_percent=50, backlog=0)
+            self.assertEqual(limiter.limit, 2)
+
+        asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    unittest.main()
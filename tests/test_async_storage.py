@@ -0,0 +1,269 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+try:
+    import aiosqlite
+except ImportError:  # aiosqlite is only needed with ASYNC_STORAGE
+    aiosqlite = None
+try:
+    import aioboto3
+    import flask  # noqa: F401 - moto's server mode needs moto[server]
+    from moto.server import ThreadedMotoServer
+except ImportError:
+    aioboto3 = None
+
+from fastapi.testclient import TestClient
+
+import app as service
+from lazy import Lazy
+from storage.async_dynamodb_storage import AsyncDynamoDBStorage
+from storage.async_sqlite_storage import AsyncSQLiteStorage
+from storage.instrumented import InstrumentedStorage
+from storage.sqlite_migrations import migrate_boxes
+from storage.sqlite_storage import SQLiteStorage
+from tests.test_dynamodb_storage import TABLE_NAME, create_table
+
+DETECTIONS = [
+    {"label": "person", "score": 0.9, "box": [10, 20, 110, 220]},
+    {"label": "dog", "score": 0.4, "box": [0, 0, 5, 5]},
+]
+
+
+@unittest.skipIf(aiosqlite is None, "aiosqlite is not installed")
+class TestAsyncSQLiteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "predictions.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_with_storage(self, test):
+        async def run():
+            async with AsyncSQLiteStorage(self.db_path, readers=2) as storage:
+                return await test(storage)
+        return asyncio.run(run())
+
+    def test_round_trip_matches_the_sync_backend(self):
+        async def test(storage):
+            await storage.save_prediction_with_detections("uid-1", "a.jpg", "p.jpg", DETECTIONS)
+            # Saving again replaces the detections
+            await storage.save_prediction_with_detections("uid-1", "a.jpg", "p.jpg", DETECTIONS)
+            return await storage.get_prediction("uid-1")
+
+        prediction = self.run_with_storage(test)
+        self.assertEqual(prediction, SQLiteStorage(self.db_path).get_prediction("uid-1"))
+        self.assertEqual(len(prediction["detection_objects"]), 2)
+
+    def test_queries(self):
+        async def test(storage):
+            for i in range(5):
+                await storage.save_prediction_with_detections(f"uid-{i}", "a.jpg", "p.jpg", DETECTIONS[i % 2:])
+            with self.assertRaises(ValueError):
+                await storage.get_prediction_image_path("missing")
+
+            pages, cursor = [], None
+            while True:
+                page, cursor = await storage.get_predictions_by_label_page("dog", 2, cursor)
+                pages.append([p["uid"] for p in page])
+                if cursor is None:
+                    break
+            self.assertEqual(pages, [["uid-0", "uid-1"], ["uid-2", "uid-3"], ["uid-4"]])
+
+            self.assertEqual([p["uid"] for p in await storage.get_predictions_by_score(0.5)], ["uid-0", "uid-2", "uid-4"])
+            self.assertEqual(
+                [p["uid"] for p in await storage.get_predictions_by_box(None, (50, 50, 60, 60), None)],
+                ["uid-0", "uid-2", "uid-4"],
+            )
+            stats = await storage.get_stats()
+            self.assertEqual(stats["labels"]["dog"]["detections"], 5)
+
+        self.run_with_storage(test)
+
+    def test_jobs_hashes_and_copies(self):
+        async def test(storage):
+            self.assertTrue(await storage.claim_job("uid-1", "worker-a", 60))
+            self.assertFalse(await storage.claim_job("uid-1", "worker-b", 60))
+            await storage.update_job_state("uid-1", "inferred", {"labels": ["dog"]}, 60)
+            state = await storage.get_job_state("uid-1")
+            self.assertEqual((state["stage"], state["data"], state["owner"]), ("inferred", {"labels": ["dog"]}, "worker-a"))
+            await storage.release_job("uid-1", "worker-a")
+            self.assertTrue(await storage.claim_job("uid-1", "worker-b", 60))
+
+            await storage.save_prediction_with_detections("uid-1", "a.jpg", "p.jpg", DETECTIONS)
+            await storage.save_content_hash("abc", "uid-1")
+            await storage.save_content_hash("abc", "uid-2")
+            self.assertEqual(await storage.find_prediction_by_hash("abc"), "uid-1")
+            await storage.copy_prediction("uid-1", "uid-2", "b.jpg")
+            with self.assertRaises(ValueError):
+                await storage.copy_prediction("missing", "uid-3", "c.jpg")
+            return await storage.get_prediction("uid-2")
+
+        copy = self.run_with_storage(test)
+        self.assertEqual((copy["original_image"], copy["predicted_image"]), ("b.jpg", "p.jpg"))
+        self.assertEqual(len(copy["detection_objects"]), 2)
+
+    def test_copies_after_the_text_boxes_are_migrated(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("CREATE TABLE detection_objects (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "prediction_uid TEXT, label TEXT, score REAL, box TEXT)")
+
+        async def test(storage):
+            await storage.save_prediction_with_detections("uid-1", "a.jpg", "p.jpg", DETECTIONS)
+            await storage.copy_prediction("uid-1", "uid-2", "b.jpg")
+            await asyncio.to_thread(migrate_boxes, self.db_path)
+            await storage.copy_prediction("uid-1", "uid-3", "c.jpg")
+            return await storage.get_prediction("uid-3")
+
+        self.assertEqual([d["box"] for d in self.run_with_storage(test)["detection_objects"]],
+                         [[10, 20, 110, 220], [0, 0, 5, 5]])
+
+    def test_failed_transaction_is_rolled_back(self):
+        async def test(storage):
+            with self.assertRaises(KeyError):
+                await storage.save_prediction_with_detections("uid-1", "a.jpg", "p.jpg", [{"label": "dog"}])
+            with self.assertRaises(ValueError):
+                await storage.get_prediction("uid-1")
+            # The writer is usable again
+            await storage.save_prediction_with_detections("uid-1", "a.jpg", "p.jpg", DETECTIONS)
+
+        self.run_with_storage(test)
+
+    def test_concurrent_reads_share_the_pool(self):
+        async def test(storage):
+            await storage.save_prediction_with_detections("uid-1", "a.jpg", "p.jpg", DETECTIONS)
+            writes = [
+                storage.save_prediction_with_detections(f"uid-{i}", "a.jpg", "p.jpg", DETECTIONS) for i in range(2, 12)
+            ]
+            reads = [storage.get_prediction("uid-1") for _ in range(50)]
+            results = await asyncio.gather(*writes, *reads)
+            self.assertTrue(all(r["uid"] == "uid-1" for r in results[len(writes):]))
+            self.assertEqual(len(storage._connections), 3)
+
+        self.run_with_storage(test)
+
+
+@unittest.skipIf(aioboto3 is None, "aioboto3 or moto[server] is not installed")
+class TestAsyncDynamoDBStorage(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+        # aiobotocore goes through aiohttp, which mock_aws doesn't patch
+        self.server = ThreadedMotoServer(port=0, verbose=False)
+        self.server.start()
+        self.endpoint_url = f"http://127.0.0.1:{self.server.get_host_and_port()[1]}"
+        create_table(endpoint_url=self.endpoint_url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_round_trip(self):
+        async def run():
+            async with AsyncDynamoDBStorage(TABLE_NAME, endpoint_url=self.endpoint_url) as storage:
+                detections = [
+                    {"label": "person" if i % 2 else "car", "score": i / 60, "box": [i, i, i + 10, i + 20]}
+                    for i in range(60)
+                ]
+                await storage.save_prediction_with_detections("uid-1", "a.jpg", "p.jpg", detections)
+                # A retried save isn't counted twice
+                await storage.save_prediction_with_detections("uid-1", "a.jpg", "p.jpg", detections)
+                prediction = await storage.get_prediction("uid-1")
+                self.assertEqual(len(prediction["detection_objects"]), 60)
+                self.assertEqual(await storage.get_prediction_image_path("uid-1"), "p.jpg")
+
+                self.assertEqual(await storage.get_predictions_by_label("person"), [{"uid": "uid-1"}])
+                self.assertEqual(await storage.get_predictions_by_score_page(0.5, 10), ([{"uid": "uid-1"}], None))
+                self.assertEqual(await storage.get_predictions_by_box("car", (0, 0, 1, 1), None), [{"uid": "uid-1"}])
+                stats = await storage.get_stats()
+                self.assertEqual(stats["labels"]["person"]["detections"], 30)
+                self.assertEqual(sum(stats["predictions_per_hour"].values()), 1)
+
+                # Saving fewer detections drops the others
+                await storage.save_prediction_with_detections("uid-1", "a.jpg", "p.jpg", detections[:2])
+                prediction = await storage.get_prediction("uid-1")
+                self.assertEqual(len(prediction["detection_objects"]), 2)
+
+                self.assertTrue(await storage.claim_job("uid-1", "worker-a", 60))
+                self.assertFalse(await storage.claim_job("uid-1", "worker-b", 60))
+                await storage.update_job_state("uid-1", "persisted", {"labels": []}, 60)
+                await storage.release_job("uid-1", "worker-a")
+                state = await storage.get_job_state("uid-1")
+                self.assertEqual((state["stage"], state["owner"]), ("persisted", None))
+
+                await storage.save_content_hash("abc", "uid-1")
+                self.assertEqual(await storage.find_prediction_by_hash("abc"), "uid-1")
+                await storage.ping()
+                with self.assertRaises(ValueError):
+                    await storage.get_prediction("missing")
+
+        asyncio.run(run())
+
+
+class UnavailableStorage(AsyncSQLiteStorage):
+    """A backend whose queries fail, to check the status codes routes answer with."""
+
+    async def get_stats(self, hours: int = 24):
+        raise sqlite3.OperationalError("database is locked")
+
+    async def get_predictions_by_box_page(self, label, region, min_area, limit, cursor=None):
+        raise NotImplementedError("Box queries need a label")
+
+
+@unittest.skipIf(aiosqlite is None, "aiosqlite is not installed")
+class TestAsyncRoutes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmp.name, "predictions.db")
+        self.originals = (service.ASYNC_STORAGE, service.async_storage, service.storage)
+        service.ASYNC_STORAGE = True
+        self.db_path = db_path
+        service.async_storage = Lazy(lambda: AsyncSQLiteStorage(db_path))
+        service.storage = Lazy(lambda: SQLiteStorage(db_path))
+        self.client = TestClient(service.app)
+
+    def tearDown(self):
+        service.ASYNC_STORAGE, service.async_storage, service.storage = self.originals
+        self.tmp.cleanup()
+
+    def test_routes_await_the_async_backend(self):
+        service.storage.save_prediction_with_detections("uid-1", "a.jpg", "p.jpg", DETECTIONS)
+
+        response = self.client.get("/prediction/uid-1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["detection_objects"]), 2)
+
+        response = self.client.get("/predictions/score/0.5", params={"limit": 10})
+        self.assertEqual([p["uid"] for p in response.json()["items"]], ["uid-1"])
+        response = self.client.get("/predictions/boxes", params={"min_area": 100, "stream": "true"})
+        self.assertEqual(response.text.count("uid-1"), 1)
+        self.assertEqual(self.client.get("/stats").json()["labels"]["person"]["detections"], 1)
+        self.assertTrue(service.async_storage.loaded)
+
+    def test_storage_errors_are_server_errors(self):
+        service.async_storage = Lazy(lambda: UnavailableStorage(self.db_path))
+        response = self.client.get("/stats")
+        self.assertEqual(response.status_code, 500)
+        self.assertIn("database is locked", response.text)
+
+    def test_unsupported_stream_fails_before_the_headers(self):
+        service.async_storage = Lazy(lambda: UnavailableStorage(self.db_path))
+        response = self.client.get("/predictions/boxes", params={"min_area": 100, "stream": "true"})
+        self.assertEqual(response.status_code, 501)
+
+        service.ASYNC_STORAGE = False
+        service.storage = Lazy(lambda: InstrumentedStorage(SQLiteStorage(self.db_path)))
+        service.storage.save_prediction_with_detections("uid-1", "a.jpg", "p.jpg", DETECTIONS)
+        service.storage.save_prediction_with_detections("uid-2", "a.jpg", "p.jpg", DETECTIONS)
+        response = self.client.get("/predictions/boxes", params={"min_area": 100, "stream": "true"})
+        self.assertEqual([json.loads(line)["uid"] for line in response.text.splitlines()], ["uid-1", "uid-2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
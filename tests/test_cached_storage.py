@@ -0,0 +1,127 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+try:
+    import aiosqlite
+except ImportError:  # aiosqlite is only needed with ASYNC_STORAGE
+    aiosqlite = None
+
+from storage.async_sqlite_storage import AsyncSQLiteStorage
+from storage.cached import AsyncCachedStorage, CachedStorage, cache_hits, cache_misses
+from storage.sqlite_storage import SQLiteStorage
+
+
+class CountingStorage:
+    """Counts the calls that reach the real backend."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.calls = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self.storage, name)
+
+        def counted(*args, **kwargs):
+            self.calls += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+class TestCachedStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backend = CountingStorage(SQLiteStorage(os.path.join(self.tmp.name, "predictions.db")))
+        self.storage = CachedStorage(self.backend, max_entries=2, ttl=60, negative_ttl=60)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def save(self, uid, label="dog"):
+        self.storage.save_prediction_with_detections(uid, "a.jpg", f"{uid}.jpg", [
+            {"label": label, "score": 0.9, "box": [0, 0, 1, 1]},
+        ])
+
+    def test_repeated_lookups_hit_the_cache(self):
+        self.save("uid-1")
+        hits, misses = cache_hits.value, cache_misses.value
+        calls = self.backend.calls
+
+        for _ in range(3):
+            self.assertEqual(self.storage.get_prediction("uid-1")["uid"], "uid-1")
+            self.assertEqual(self.storage.get_prediction_image_path("uid-1"), "uid-1.jpg")
+
+        self.assertEqual(self.backend.calls - calls, 2)
+        self.assertEqual((cache_hits.value - hits, cache_misses.value - misses), (4, 2))
+
+    def test_not_found_is_cached_until_saved(self):
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                self.storage.get_prediction("uid-1")
+        calls = self.backend.calls
+
+        self.save("uid-1")
+        self.assertEqual(self.storage.get_prediction("uid-1")["uid"], "uid-1")
+        # The save and one lookup after the invalidation
+        self.assertEqual(self.backend.calls - calls, 2)
+
+    def test_saving_again_invalidates(self):
+        self.save("uid-1", "dog")
+        self.storage.get_prediction("uid-1")
+        self.save("uid-1", "cat")
+        self.assertEqual(self.storage.get_prediction("uid-1")["detection_objects"][0]["label"], "cat")
+
+        self.storage.copy_prediction("uid-1", "uid-2", "b.jpg")
+        self.assertEqual(self.storage.get_prediction("uid-2")["original_image"], "b.jpg")
+
+    def test_entries_expire_and_are_evicted(self):
+        self.save("uid-1")
+        storage = CachedStorage(self.backend, max_entries=2, ttl=0.05)
+        storage.get_prediction("uid-1")
+        time.sleep(0.1)
+        calls = self.backend.calls
+        storage.get_prediction("uid-1")
+        self.assertEqual(self.backend.calls - calls, 1)
+
+        self.save("uid-2")
+        self.save("uid-3")
+        for uid in ("uid-1", "uid-2", "uid-3"):
+            self.storage.get_prediction(uid)
+        calls = self.backend.calls
+        self.storage.get_prediction("uid-1")
+        self.assertEqual(self.backend.calls - calls, 1)
+
+    def test_other_calls_pass_through(self):
+        self.save("uid-1")
+        self.assertEqual([p["uid"] for p in self.storage.get_predictions_by_label("dog")], ["uid-1"])
+
+    @unittest.skipIf(aiosqlite is None, "aiosqlite is not installed")
+    def test_async_lookups_share_the_cache(self):
+        self.save("uid-1", "dog")
+
+        async def run():
+            async with AsyncSQLiteStorage(os.path.join(self.tmp.name, "predictions.db")) as backend:
+                storage = AsyncCachedStorage(backend, self.storage)
+                hits = cache_hits.value
+                for _ in range(2):
+                    self.assertEqual((await storage.get_prediction("uid-1"))["detection_objects"][0]["label"], "dog")
+                self.assertEqual(cache_hits.value - hits, 1)
+                # Served to the blocking code from the same cache
+                calls = self.backend.calls
+                self.storage.get_prediction("uid-1")
+                self.assertEqual(self.backend.calls, calls)
+
+                # A save through the blocking storage invalidates it for both
+                self.save("uid-1", "cat")
+                self.assertEqual((await storage.get_prediction("uid-1"))["detection_objects"][0]["label"], "cat")
+                with self.assertRaises(ValueError):
+                    await storage.get_prediction_image_path("uid-2")
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
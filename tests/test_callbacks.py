@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from callbacks import CallbackDispatcher
+
+
+class StubPolybot(ThreadingHTTPServer):
+    """Records callbacks and answers the first `failures` of them with a 503."""
+
+    def __init__(self, failures=0):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.failures = failures
+        self.requests = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server = self.server
+        server.requests.append((self.path, json.loads(body)))
+        status = 503 if len(server.requests) <= server.failures else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestCallbackDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.outbox = os.path.join(self.tmp.name, "callbacks.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def start_server(self, failures=0):
+        server = StubPolybot(failures)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def dispatcher(self, url, **kwargs):
+        kwargs.setdefault("backoff_base", 0.01)
+        kwargs.setdefault("sweep_interval", 0.05)
+        return CallbackDispatcher(url, outbox_path=self.outbox, **kwargs)
+
+    async def wait_until_delivered(self, dispatcher, timeout=5):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while dispatcher.pending():
+            if asyncio.get_running_loop().time() > deadline:
+                self.fail("callbacks were not delivered")
+            await asyncio.sleep(0.02)
+
+    def test_retries_until_delivered(self):
+        server = self.start_server(failures=2)
+        dispatcher = self.dispatcher(server.url)
+
+        async def run():
+            await dispatcher.start()
+            try:
+                await asyncio.to_thread(dispatcher.enqueue, "uid-1", {"chat_id": 1, "labels": ["dog"]})
+                await self.wait_until_delivered(dispatcher)
+            finally:
+                await dispatcher.stop()
+
+        asyncio.run(run())
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(server.requests[-1], ("/predictions/uid-1", {"chat_id": 1, "labels": ["dog"]}))
+
+    def test_undelivered_callbacks_survive_restart(self):
+        # Nothing is listening yet, so delivery keeps failing
+        unavailable = self.dispatcher("http://127.0.0.1:9", max_attempts=1, backoff_max=0.01, sweep_interval=60)
+
+        async def fail():
+            await unavailable.start()
+            unavailable.enqueue("uid-1", {"chat_id": 1, "labels": []})
+            await asyncio.sleep(0.2)
+            await unavailable.stop()
+
+        asyncio.run(fail())
+        self.assertEqual(unavailable.pending(), 1)
+
+        server = self.start_server()
+        dispatcher = self.dispatcher(server.url)
+
+        async def recover():
+            await dispatcher.start()
+            try:
+                await self.wait_until_delivered(dispatcher)
+            finally:
+                await dispatcher.stop()
+
+        asyncio.run(recover())
+        self.assertEqual([path for path, _ in server.requests], ["/predictions/uid-1"])
+
+    def test_pending_callbacks_are_coalesced(self):
+        server = self.start_server()
+        dispatcher = self.dispatcher(server.url)
+        # Enqueued before start: both land in the outbox, only the latest is sent
+        dispatcher.enqueue("uid-1", {"chat_id": 1, "labels": ["cat"]})
+        dispatcher.enqueue("uid-1", {"chat_id": 1, "labels": ["dog"]})
+
+        async def run():
+            await dispatcher.start()
+            try:
+                await self.wait_until_delivered(dispatcher)
+            finally:
+                await dispatcher.stop()
+
+        asyncio.run(run())
+        self.assertEqual(server.requests, [("/predictions/uid-1", {"chat_id": 1, "labels": ["dog"]})])
+
+
+if __name__ == "__main__":
+    unittest.main()
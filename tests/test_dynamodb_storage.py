@@ -0,0 +1,281 @@
+import os
+import unittest
+from decimal import Decimal
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto is only needed for these offline tests
+    mock_aws = None
+
+import boto3
+
+from storage.dynamodb_migrations import backfill_score_buckets, create_score_index
+from storage.dynamodb_storage import DynamoDBStorage
+
+TABLE_NAME = "PredictionsTest"
+
+
+def create_table(with_score_index=True, endpoint_url=None):
+    dynamodb = boto3.resource("dynamodb", region_name="eu-west-2", endpoint_url=endpoint_url)
+    table = dynamodb.create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{"AttributeName": "PK", "KeyType": "HASH"}, {"AttributeName": "SK", "KeyType": "RANGE"}],
+        AttributeDefinitions=[
+            {"AttributeName": "PK", "AttributeType": "S"},
+            {"AttributeName": "SK", "AttributeType": "S"},
+            {"AttributeName": "label", "AttributeType": "S"},
+        ],
+        GlobalSecondaryIndexes=[{
+            "IndexName": "LabelIndex",
+            "KeySchema": [{"AttributeName": "label", "KeyType": "HASH"}],
+            "Projection": {"ProjectionType": "ALL"},
+        }],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    if with_score_index:
+        create_score_index(table)
+    return table
+
+
+class CountingTable:
+    """Forwards to a Table, counting queries of a prediction's own items (not of an index)."""
+
+    def __init__(self, table):
+        self.table = table
+        self.prediction_queries = 0
+
+    def query(self, **kwargs):
+        if "IndexName" not in kwargs:
+            self.prediction_queries += 1
+        return self.table.query(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+
+def all_pages(fetch):
+    uids, cursor = [], None
+    while True:
+        page, cursor = fetch(cursor)
+        uids.extend(p["uid"] for p in page)
+        if cursor is None:
+            return uids
+
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+class TestDynamoDBStorage(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+        self.mock = mock_aws()
+        self.mock.start()
+        self.table = create_table()
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def detections(self, count):
+        return [
+            {"label": "person" if i % 2 else "car", "score": i / count, "box": [i, i + 1.5, i + 10, i + 20.25]}
+            for i in range(count)
+        ]
+
+    def test_batched_save_writes_all_items(self):
+        storage = DynamoDBStorage(TABLE_NAME)
+        # More than one BatchWriteItem chunk
+        storage.save_prediction_with_detections("uid-1", "a.jpg", "a.jpg", self.detections(60))
+
+        prediction = storage.get_prediction("uid-1")
+        self.assertEqual(prediction["predicted_image"], "a.jpg")
+        self.assertEqual(len(prediction["detection_objects"]), 60)
+        self.assertEqual(storage.get_predictions_by_label("person"), [{"uid": "uid-1"}])
+
+    def test_packed_box_encoding_round_trip(self):
+        storage = DynamoDBStorage(TABLE_NAME, box_encoding="packed")
+        storage.save_prediction_with_detections("uid-2", "b.jpg", "b.jpg", self.detections(3))
+
+        boxes = sorted(d["box"] for d in storage.get_prediction("uid-2")["detection_objects"])
+        self.assertEqual(boxes[0], [0.0, 1.5, 10.0, 20.25])
+
+    def test_predictions_by_score_uses_index(self):
+        storage = DynamoDBStorage(TABLE_NAME)
+        storage.save_prediction_with_detections("low", "a.jpg", "a.jpg", [{"label": "car", "score": 0.2, "box": [0, 0, 1, 1]}])
+        storage.save_prediction_with_detections("high", "b.jpg", "b.jpg", [
+            {"label": "car", "score": 0.55, "box": [0, 0, 1, 1]},
+            {"label": "dog", "score": 1.0, "box": [0, 0, 2, 2]},
+        ])
+        storage.save_prediction_with_detections("edge", "c.jpg", "c.jpg", [{"label": "car", "score": 0.5, "box": [0, 0, 1, 1]}])
+
+        self.assertEqual(sorted(p["uid"] for p in storage.get_predictions_by_score(0.5)), ["edge", "high"])
+        self.assertEqual(sorted(p["uid"] for p in storage.get_predictions_by_score(0.0)), ["edge", "high", "low"])
+        self.assertEqual(storage.get_predictions_by_score(1.0), [{"uid": "high"}])
+
+        scan_storage = DynamoDBStorage(TABLE_NAME, score_index="")
+        self.assertEqual(sorted(p["uid"] for p in scan_storage.get_predictions_by_score(0.5)), ["edge", "high"])
+
+    def test_backfill_score_buckets(self):
+        self.table.put_item(Item={"PK": "PRED#old", "SK": "META", "original_image": "o.jpg", "predicted_image": "o.jpg"})
+        self.table.put_item(Item={"PK": "PRED#old", "SK": "DETECT#car#x", "label": "car", "score": Decimal("0.75"), "box": []})
+
+        storage = DynamoDBStorage(TABLE_NAME)
+        self.assertEqual(storage.get_predictions_by_score(0.7), [])
+        self.assertEqual(backfill_score_buckets(self.table), 1)
+        self.assertEqual(storage.get_predictions_by_score(0.7), [{"uid": "old"}])
+        self.assertEqual(backfill_score_buckets(self.table), 0)
+
+    def test_score_pages_follow_cursor(self):
+        storage = DynamoDBStorage(TABLE_NAME)
+        for i in range(9):
+            storage.save_prediction_with_detections(f"uid-{i}", "a.jpg", "a.jpg", [
+                {"label": "car", "score": 0.1 * i + 0.05, "box": [0, 0, 1, 1]},
+            ])
+
+        uids, cursor = [], None
+        while True:
+            page, cursor = storage.get_predictions_by_score_page(0.3, 2, cursor)
+            self.assertLessEqual(len(page), 2)
+            uids.extend(p["uid"] for p in page)
+            if cursor is None:
+                break
+
+        # Highest scores first
+        self.assertEqual(uids, [f"uid-{i}" for i in range(8, 2, -1)])
+        self.assertEqual([p["uid"] for p in storage.iter_predictions_by_label("car")].count("uid-0"), 1)
+
+    def test_pages_never_repeat_a_prediction(self):
+        storage = DynamoDBStorage(TABLE_NAME)
+        # Several matching detections per prediction, spread across score buckets
+        for i in range(6):
+            storage.save_prediction_with_detections(f"uid-{i}", "a.jpg", "a.jpg", [
+                {"label": "car", "score": score, "box": [0, 0, 10, 10]} for score in (0.95, 0.75, 0.55, 0.35)
+            ])
+        storage.table = CountingTable(storage.table)
+
+        for fetch in (lambda cursor: storage.get_predictions_by_score_page(0.3, 2, cursor),
+                      lambda cursor: storage.get_predictions_by_label_page("car", 4, cursor)):
+            self.assertEqual(sorted(all_pages(fetch)), [f"uid-{i}" for i in range(6)])
+        # The markers on the index items were enough
+        self.assertEqual(storage.table.prediction_queries, 0)
+
+        # Box queries only check the label's later detections against the
+        # prediction when its first one came on an earlier page
+        uids = all_pages(lambda cursor: storage.get_predictions_by_box_page("car", (5, 5, 6, 6), None, 1, cursor))
+        self.assertEqual(sorted(uids), [f"uid-{i}" for i in range(6)])
+        self.assertLessEqual(storage.table.prediction_queries, len(uids))
+
+    def test_unmarked_detections_are_checked_against_the_prediction(self):
+        # Saved before the first-match markers existed
+        for i in range(3):
+            for score in ("0.9", "0.8"):
+                self.table.put_item(Item={"PK": f"PRED#old-{i}", "SK": f"DETECT#car#{score}", "label": "car",
+                                          "score": Decimal(score), "score_bucket": 8, "box": [0, 0, 10, 10]})
+        storage = DynamoDBStorage(TABLE_NAME)
+        storage.table = CountingTable(storage.table)
+
+        for fetch in (lambda cursor: storage.get_predictions_by_score_page(0.5, 1, cursor),
+                      lambda cursor: storage.get_predictions_by_label_page("car", 1, cursor)):
+            self.assertEqual(sorted(all_pages(fetch)), ["old-0", "old-1", "old-2"])
+        self.assertGreater(storage.table.prediction_queries, 0)
+
+    def test_content_hash_and_copy_prediction(self):
+        storage = DynamoDBStorage(TABLE_NAME)
+        storage.save_prediction_with_detections("uid-1", "a.jpg", "a-pred.jpg", self.detections(2))
+        storage.save_content_hash("abc", "uid-1")
+        storage.save_content_hash("abc", "uid-other")
+        self.assertEqual(storage.find_prediction_by_hash("abc"), "uid-1")
+        self.assertIsNone(storage.find_prediction_by_hash("def"))
+
+        storage.copy_prediction("uid-1", "uid-2", "b.jpg")
+        copy = storage.get_prediction("uid-2")
+        self.assertEqual(copy["predicted_image"], "a-pred.jpg")
+        self.assertEqual(len(copy["detection_objects"]), 2)
+
+        # Decimal boxes, one of them inverted, are copied too
+        storage.save_prediction_with_detections("uid-3", "c.jpg", "c.jpg", [
+            {"label": "car", "score": 0.5, "box": [10, 0, 2, 4.5]},
+            {"label": "dog", "score": 0.6, "box": [0, 0, 2, 4.5]},
+        ])
+        storage.copy_prediction("uid-3", "uid-4", "d.jpg")
+        self.assertEqual(sorted(p["uid"] for p in storage.get_predictions_by_box("dog", None, 9)), ["uid-3", "uid-4"])
+
+    def test_job_claims_and_state(self):
+        storage = DynamoDBStorage(TABLE_NAME)
+        self.assertIsNone(storage.get_job_state("uid-1"))
+        self.assertTrue(storage.claim_job("uid-1", "worker-a", 60))
+        self.assertFalse(storage.claim_job("uid-1", "worker-b", 60))
+
+        storage.update_job_state("uid-1", "uploaded", {"detections": [{"label": "cat", "score": 0.5}]}, 60)
+        state = storage.get_job_state("uid-1")
+        self.assertEqual(state["stage"], "uploaded")
+        self.assertEqual(state["data"], {"detections": [{"label": "cat", "score": 0.5}]})
+
+        storage.release_job("uid-1", "worker-a")
+        self.assertTrue(storage.claim_job("uid-1", "worker-b", 60))
+        self.assertEqual(storage.get_job_state("uid-1")["stage"], "uploaded")
+        # Job states stay out of the prediction queries
+        self.assertEqual(storage.get_predictions_by_score(0.0), [])
+
+    def test_expired_job_lease_can_be_taken_over(self):
+        storage = DynamoDBStorage(TABLE_NAME)
+        self.assertTrue(storage.claim_job("uid-1", "worker-a", -1))
+        self.assertTrue(storage.claim_job("uid-1", "worker-b", 60))
+
+    def test_box_queries_filter_a_label(self):
+        storage = DynamoDBStorage(TABLE_NAME)
+        storage.save_prediction_with_detections("small", "a.jpg", "a.jpg", [
+            {"label": "person", "score": 0.9, "box": [0, 0, 10, 10]},
+        ])
+        storage.save_prediction_with_detections("large", "b.jpg", "b.jpg", [
+            {"label": "person", "score": 0.9, "box": [100, 100, 300, 300]},
+        ])
+
+        def uids(region=None, min_area=None):
+            page, _ = storage.get_predictions_by_box_page("person", region, min_area, 10)
+            return sorted(p["uid"] for p in page)
+
+        self.assertEqual(uids(region=(5, 5, 6, 6)), ["small"])
+        self.assertEqual(uids(region=(0, 0, 500, 500)), ["large", "small"])
+        self.assertEqual(uids(min_area=1000), ["large"])
+        with self.assertRaises(NotImplementedError):
+            storage.get_predictions_by_box_page(None, (5, 5, 6, 6), None, 10)
+        with self.assertRaises(NotImplementedError):
+            packed = DynamoDBStorage(TABLE_NAME, box_encoding="packed")
+            packed.get_predictions_by_box_page("person", (5, 5, 6, 6), None, 10)
+
+    def test_stats_count_a_retried_save_once(self):
+        storage = DynamoDBStorage(TABLE_NAME)
+        detections = [
+            {"label": "dog", "score": 0.95, "box": [0, 0, 1, 1]},
+            {"label": "dog", "score": 0.3, "box": [0, 0, 2, 2]},
+            {"label": "cat", "score": 1.0, "box": [0, 0, 1, 1]},
+        ]
+        storage.save_prediction_with_detections("uid-1", "a.jpg", "a.jpg", detections)
+        storage.save_prediction_with_detections("uid-1", "a.jpg", "a.jpg", detections)
+        storage.save_prediction_with_detections("uid-2", "b.jpg", "b.jpg", detections[:1])
+
+        stats = storage.get_stats()
+        self.assertEqual(stats["labels"]["dog"]["detections"], 3)
+        self.assertEqual(stats["labels"]["dog"]["score_histogram"], [0, 0, 0, 1, 0, 0, 0, 0, 0, 2])
+        self.assertEqual(stats["labels"]["cat"]["score_histogram"][-1], 1)
+        self.assertEqual(sum(stats["predictions_per_hour"].values()), 2)
+        # The counter items don't show up as predictions
+        self.assertEqual(sorted(p["uid"] for p in storage.get_predictions_by_score(0.0)), ["uid-1", "uid-2"])
+
+    def test_saving_fewer_detections_replaces_them(self):
+        storage = DynamoDBStorage(TABLE_NAME)
+        storage.save_prediction_with_detections("uid-1", "a.jpg", "a.jpg", self.detections(30))
+        storage.save_prediction_with_detections("uid-1", "a.jpg", "b.jpg", self.detections(30)[:1])
+
+        prediction = storage.get_prediction("uid-1")
+        self.assertEqual(prediction["predicted_image"], "b.jpg")
+        self.assertEqual([d["label"] for d in prediction["detection_objects"]], ["car"])
+        self.assertEqual(storage.get_predictions_by_label("person"), [])
+
+    def test_unknown_box_encoding(self):
+        with self.assertRaises(ValueError):
+            DynamoDBStorage(TABLE_NAME, box_encoding="json")
+
+
+if __name__ == "__main__":
+    unittest.main()
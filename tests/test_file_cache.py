@@ -0,0 +1,75 @@
+import os
+import tempfile
+import time
+import unittest
+
+from file_cache import LocalFileCache
+
+
+class TestLocalFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp.name, "original")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, cache, name, size=10):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        cache.add(path)
+        return path
+
+    def test_sweep_deletes_least_recently_used_over_budget(self):
+        cache = LocalFileCache([self.directory], max_bytes=25)
+        a = self.write(cache, "a.jpg")
+        b = self.write(cache, "b.jpg")
+        self.assertTrue(cache.lookup(a))
+        c = self.write(cache, "c.jpg")
+
+        self.assertEqual(cache.sweep(), 1)
+        self.assertFalse(os.path.exists(b))
+        self.assertTrue(os.path.exists(a) and os.path.exists(c))
+        self.assertEqual(cache.size, 20)
+        self.assertFalse(cache.lookup(b))
+
+    def test_pinned_files_are_kept(self):
+        cache = LocalFileCache([self.directory], max_bytes=15)
+        a = self.write(cache, "a.jpg")
+        with cache.pinned(a):
+            b = self.write(cache, "b.jpg")
+            self.assertEqual(cache.sweep(), 1)
+            self.assertTrue(os.path.exists(a))
+            self.assertFalse(os.path.exists(b))
+        self.write(cache, "c.jpg")
+        cache.sweep()
+        self.assertFalse(os.path.exists(a))
+
+    def test_files_unused_past_max_age_are_deleted(self):
+        cache = LocalFileCache([self.directory], max_bytes=1000, max_age=60)
+        old = self.write(cache, "old.jpg")
+        new = self.write(cache, "new.jpg")
+        cache._entries[old] = (10, time.time() - 120)
+        cache._entries.move_to_end(old, last=False)
+
+        self.assertEqual(cache.sweep(), 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_index_is_rebuilt_from_disk(self):
+        cache = LocalFileCache([self.directory], max_bytes=1000)
+        first = self.write(cache, "first.jpg")
+        os.utime(first, (1, 1))
+        self.write(cache, "second.jpg", size=30)
+
+        rebuilt = LocalFileCache([self.directory], max_bytes=30)
+        self.assertEqual(rebuilt.size, 40)
+        rebuilt.sweep()
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual(rebuilt.size, 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from fastapi.testclient import TestClient
+
+import app as service
+from file_cache import LocalFileCache
+from lazy import Lazy
+from storage.instrumented import InstrumentedStorage
+from storage.sqlite_storage import SQLiteStorage
+
+
+class FakeModel:
+    names = {0: "person"}
+
+    def __init__(self):
+        self.warmed_up = False
+
+    def warmup(self):
+        self.warmed_up = True
+
+
+class FlakyModel(FakeModel):
+    """Fails to warm up the first `failures` times, like a model download that times out."""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.attempts = 0
+
+    def warmup(self):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise OSError("model download timed out")
+        super().warmup()
+
+
+class TestHealth(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.originals = (service.model, service.storage, service.s3_client, service.sqs_client, dict(service.startup),
+                          service.local_files, service.SQS_QUEUE_URL, service.WARM_UP_RETRY_SECONDS)
+        service.SQS_QUEUE_URL = None
+        service.WARM_UP_RETRY_SECONDS = 0
+        self.fake_model = FakeModel()
+        service.model = Lazy(lambda: self.fake_model)
+        service.storage = Lazy(lambda: InstrumentedStorage(SQLiteStorage(os.path.join(self.tmp.name, "p.db"))))
+        service.s3_client = Lazy(object)
+        service.sqs_client = Lazy(object)
+        service.local_files = Lazy(lambda: LocalFileCache([os.path.join(self.tmp.name, "uploads")], 1024))
+        # Without a context manager the startup event (and the SQS worker) never runs
+        self.client = TestClient(service.app)
+
+    def tearDown(self):
+        (service.model, service.storage, service.s3_client, service.sqs_client, startup, service.local_files,
+         service.SQS_QUEUE_URL, service.WARM_UP_RETRY_SECONDS) = self.originals
+        service.app.state.worker = None
+        service.startup.clear()
+        service.startup.update(startup)
+        self.tmp.cleanup()
+
+    def test_import_does_not_load_the_model(self):
+        self.assertFalse(self.originals[0].loaded)
+        self.assertGreater(service.startup["import_seconds"], 0)
+
+    def test_live_before_ready(self):
+        self.assertEqual(self.client.get("/health/live").status_code, 200)
+        response = self.client.get("/health/ready")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["checks"]["model"], False)
+
+    def test_ready_after_warm_up(self):
+        asyncio.run(service.warm_up())
+        self.assertTrue(self.fake_model.warmed_up)
+
+        response = self.client.get("/health/ready")
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["checks"], {"model": True, "storage": True})
+        self.assertGreaterEqual(body["ready_seconds"], body["import_seconds"])
+
+    def test_warm_up_is_retried(self):
+        model = FlakyModel(failures=2)
+        service.model = Lazy(lambda: model)
+        # Warm-up succeeds on the third attempt; the worker then stops on the missing queue URL
+        with self.assertRaisesRegex(RuntimeError, "SQS_QUEUE_URL"):
+            asyncio.run(service.start_worker())
+        self.assertEqual(model.attempts, 3)
+        self.assertTrue(service.startup["model_warm"])
+
+        model = FlakyModel(failures=service.WARM_UP_ATTEMPTS)
+        service.model = Lazy(lambda: model)
+        with self.assertRaises(OSError):
+            asyncio.run(service.start_worker())
+        self.assertEqual(model.attempts, service.WARM_UP_ATTEMPTS)
+
+    def test_not_live_once_the_worker_failed(self):
+        service.model = Lazy(lambda: FlakyModel(failures=service.WARM_UP_ATTEMPTS))
+
+        async def start():
+            service.app.state.worker = asyncio.create_task(service.start_worker())
+            await asyncio.wait([service.app.state.worker])
+
+        asyncio.run(start())
+        response = self.client.get("/health/live")
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("model download timed out", response.json()["error"])
+        self.assertEqual(self.client.get("/health").status_code, 503)
+
+
+if __name__ == "__main__":
+    unittest.main()
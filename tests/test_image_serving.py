@@ -0,0 +1,174 @@
+import os
+import tempfile
+import unittest
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto is only needed for these offline tests
+    mock_aws = None
+
+import boto3
+from fastapi.testclient import TestClient
+
+import app as service
+from file_cache import LocalFileCache
+from image_responses import RangeNotSatisfiable, parse_range
+from lazy import Lazy
+from render_cache import RenderCache
+from storage.sqlite_storage import SQLiteStorage
+
+BUCKET = "images-test"
+IMAGE = bytes(range(256)) * 4
+
+
+class TestParseRange(unittest.TestCase):
+
+    def test_ranges(self):
+        self.assertEqual(parse_range("bytes=0-9", 100), (0, 9))
+        self.assertEqual(parse_range("bytes=90-", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=50-500", 100), (50, 99))
+
+    def test_ignored_ranges(self):
+        self.assertIsNone(parse_range("items=0-9", 100))
+        self.assertIsNone(parse_range("bytes=0-1,5-6", 100))
+        self.assertIsNone(parse_range("bytes=a-b", 100))
+
+    def test_unsatisfiable_range(self):
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range("bytes=100-", 100)
+
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+class TestImageServing(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+        self.mock = mock_aws()
+        self.mock.start()
+        self.s3 = boto3.client("s3", region_name="us-east-1")
+        self.s3.create_bucket(Bucket=BUCKET)
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.originals = (service.storage, service.s3_client, service.S3_BUCKET_NAME,
+                          service.image_cache, service.IMAGE_S3_REDIRECT, service.local_files)
+        service.storage = Lazy(lambda: SQLiteStorage("p.db"))
+        service.s3_client = self.s3
+        service.S3_BUCKET_NAME = BUCKET
+        service.image_cache = RenderCache(1024 * 1024, name="image_cache")
+        service.local_files = LocalFileCache([service.UPLOAD_DIR, service.PREDICTED_DIR], 1024 * 1024)
+        self.client = TestClient(service.app)
+
+    def tearDown(self):
+        (service.storage, service.s3_client, service.S3_BUCKET_NAME,
+         service.image_cache, service.IMAGE_S3_REDIRECT, service.local_files) = self.originals
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+        self.mock.stop()
+
+    def test_local_file_etag_and_range(self):
+        with open(os.path.join(service.UPLOAD_DIR, "a.jpg"), "wb") as f:
+            f.write(IMAGE)
+
+        response = self.client.get("/image/original/a.jpg")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, IMAGE)
+        self.assertEqual(response.headers["cache-control"], service.IMAGE_CACHE_CONTROL)
+        etag = response.headers["etag"]
+
+        response = self.client.get("/image/original/a.jpg", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get("/image/original/a.jpg", headers={"Range": "bytes=10-19"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, IMAGE[10:20])
+
+    def test_missing_file_is_served_from_s3_and_cached(self):
+        self.s3.put_object(Bucket=BUCKET, Key="b.jpg", Body=IMAGE)
+
+        response = self.client.get("/image/original/b.jpg")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, IMAGE)
+        self.assertEqual(response.headers["content-type"], "image/jpeg")
+        etag = response.headers["etag"]
+
+        # Served from the read-through cache from now on
+        self.s3.delete_object(Bucket=BUCKET, Key="b.jpg")
+        response = self.client.get("/image/original/b.jpg", headers={"Range": "bytes=-4"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, IMAGE[-4:])
+        self.assertEqual(response.headers["content-range"], f"bytes {len(IMAGE) - 4}-{len(IMAGE) - 1}/{len(IMAGE)}")
+
+        response = self.client.get("/image/original/b.jpg", headers={"If-None-Match": f"W/{etag}"})
+        self.assertEqual(response.status_code, 304)
+
+    def test_prediction_image_falls_back_to_s3(self):
+        service.storage.save_prediction_with_detections("p1", "c.jpg", "c.jpg", [])
+        self.s3.put_object(Bucket=BUCKET, Key="c.jpg", Body=b"original")
+        self.s3.put_object(Bucket=BUCKET, Key="predicted/c.jpg", Body=IMAGE)
+
+        response = self.client.get("/prediction/p1/image", headers={"Accept": "image/jpeg"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, IMAGE)
+
+    def test_original_and_predicted_images_have_their_own_keys(self):
+        self.s3.put_object(Bucket=BUCKET, Key="e.jpg", Body=b"original")
+        self.s3.put_object(Bucket=BUCKET, Key="predicted/e.jpg", Body=b"annotated")
+
+        self.assertEqual(self.client.get("/image/original/e.jpg").content, b"original")
+        self.assertEqual(self.client.get("/image/predicted/e.jpg").content, b"annotated")
+
+    def test_predicted_images_from_before_the_prefix_are_still_served(self):
+        service.storage.save_prediction_with_detections("p2", "f.jpg", "f.jpg", [])
+        self.s3.put_object(Bucket=BUCKET, Key="f.jpg", Body=b"annotated")
+
+        self.assertEqual(self.client.get("/image/predicted/f.jpg").content, b"annotated")
+        response = self.client.get("/prediction/p2/image", headers={"Accept": "image/jpeg"})
+        self.assertEqual(response.content, b"annotated")
+
+        service.IMAGE_S3_REDIRECT = True
+        response = self.client.get("/image/predicted/f.jpg", follow_redirects=False)
+        self.assertIn("/f.jpg", response.headers["location"])
+        self.assertNotIn("predicted/f.jpg", response.headers["location"])
+
+    def test_only_image_files_are_served(self):
+        self.s3.put_object(Bucket=BUCKET, Key="secrets.env", Body=b"TOKEN=1")
+        self.assertEqual(self.client.get("/image/original/secrets.env").status_code, 404)
+        self.assertEqual(self.client.get("/image/predicted/secrets.env").status_code, 404)
+
+    def test_streamed_image_honours_range(self):
+        service.image_cache = RenderCache(100, name="image_cache")
+        self.s3.put_object(Bucket=BUCKET, Key="big.jpg", Body=IMAGE)
+
+        response = self.client.get("/image/original/big.jpg")
+        self.assertEqual((response.status_code, response.content), (200, IMAGE))
+        etag = response.headers["etag"]
+
+        response = self.client.get("/image/original/big.jpg", headers={"Range": "bytes=10-19"})
+        self.assertEqual((response.status_code, response.content), (206, IMAGE[10:20]))
+        self.assertEqual(response.headers["content-range"], f"bytes 10-19/{len(IMAGE)}")
+
+        response = self.client.get("/image/original/big.jpg", headers={"Range": f"bytes={len(IMAGE)}-"})
+        self.assertEqual(response.status_code, 416)
+
+        # A range of an older version is answered with the whole image
+        response = self.client.get("/image/original/big.jpg", headers={"Range": "bytes=0-9", "If-Range": '"old"'})
+        self.assertEqual((response.status_code, response.content), (200, IMAGE))
+        response = self.client.get("/image/original/big.jpg", headers={"Range": "bytes=0-9", "If-Range": etag})
+        self.assertEqual(response.status_code, 206)
+
+    def test_presigned_redirect(self):
+        service.IMAGE_S3_REDIRECT = True
+        response = self.client.get("/image/predicted/d.jpg", follow_redirects=False)
+        self.assertEqual(response.status_code, 307)
+        self.assertIn("d.jpg", response.headers["location"])
+
+    def test_missing_everywhere_is_404(self):
+        self.assertEqual(self.client.get("/image/original/nope.jpg").status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
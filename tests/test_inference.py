@@ -0,0 +1,191 @@
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from imaging import EXIF_ORIENTATION, decode_fitted, decode_image, letterbox, prepare_image
+from inference.base import results_from_detections
+from inference.exported_engine import ExportedEngine
+
+
+class FakeEngine(ExportedEngine):
+    """An exported engine whose 'network' returns a fixed raw output."""
+
+    export_format = "fake"
+    cache_suffix = ".fake"
+
+    def __init__(self, raw_output):
+        self.imgsz = 640
+        self.conf, self.iou, self.max_det = 0.25, 0.7, 300
+        self._names = {0: "person", 1: "car"}
+        self.raw_output = raw_output
+
+    def _load(self):
+        pass
+
+    def _run(self, batch):
+        self.batch_shape = batch.shape
+        return np.repeat(self.raw_output[None], batch.shape[0], axis=0)
+
+
+class ExportingEngine(ExportedEngine):
+    """An exported engine whose export writes a placeholder file, slowly, and counts the exports."""
+
+    export_format = "fake"
+    cache_suffix = ".fake"
+    exports = 0
+    lock = threading.Lock()
+
+    def _export_model(self, weights, int8):
+        with self.lock:
+            type(self).exports += 1
+        exported = os.path.join(os.path.dirname(self.model_path), f"export-{threading.get_ident()}.fake")
+        with open(exported, "w") as f:
+            f.write("model")
+        time.sleep(0.1)
+        return exported, {0: "person"}
+
+    def _load(self):
+        with open(self.model_path) as f:
+            self.loaded_model = f.read()
+
+    def _run(self, batch):
+        raise NotImplementedError
+
+
+def raw_detection(cx, cy, w, h, class_scores):
+    return [cx, cy, w, h] + class_scores
+
+
+class TestLetterbox(unittest.TestCase):
+
+    def test_wide_image_is_padded_vertically(self):
+        image = np.zeros((320, 1280, 3), dtype=np.uint8)
+        padded, ratio, pad = letterbox(image, 640)
+        self.assertEqual(padded.shape, (640, 640, 3))
+        self.assertEqual(ratio, 0.5)
+        self.assertEqual(pad, (0, 240))
+        self.assertTrue((padded[:240] == 114).all())
+        self.assertTrue((padded[240:400] == 0).all())
+
+
+def photo(width, height, orientation=None):
+    """A JPEG with a white square a tenth of the way in from the top left corner."""
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    image[height // 10:height // 10 + height // 5, width // 10:width // 10 + height // 5] = 255
+    exif = Image.Exif()
+    if orientation:
+        exif[EXIF_ORIENTATION] = orientation
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, "JPEG", quality=95, exif=exif)
+    return buffer.getvalue()
+
+
+class TestReducedDecode(unittest.TestCase):
+
+    def test_large_photo_is_decoded_small_and_boxes_map_back(self):
+        data = photo(4000, 3000)
+        padded, transform = prepare_image(data, 640)
+        self.assertEqual(padded.shape, (640, 640, 3))
+        self.assertEqual(transform.full_size, (4000, 3000))
+        # DCT scaling picked 1/4: 1000x750, then letterboxed to 640x480
+        self.assertEqual(transform.scale, (0.25, 0.25))
+        self.assertEqual(transform.pad, (0, 80))
+
+        ys, xs = np.nonzero(padded[..., 0] > 128)
+        box = [xs.min(), ys.min(), xs.max() + 1, ys.max() + 1]
+        np.testing.assert_allclose(transform.restore([box])[0], [400, 300, 1000, 900], atol=8)
+
+    def test_restore_clips_to_the_image(self):
+        _, transform = prepare_image(photo(4000, 3000), 640)
+        np.testing.assert_allclose(transform.restore([[-5, 0, 700, 700]]), [[0, 0, 4000, 3000]])
+
+    def test_small_image_is_decoded_in_full(self):
+        padded, transform = prepare_image(photo(320, 240), 640)
+        self.assertEqual((transform.ratio, transform.scale), (2.0, (1.0, 1.0)))
+        self.assertEqual(padded.shape, (640, 640, 3))
+
+    def test_exif_orientation_is_applied_like_opencv(self):
+        data = photo(800, 600, orientation=6)
+        expected = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        decoded = decode_image(data)
+        self.assertEqual(decoded.shape, expected.shape)
+        self.assertLess(np.abs(decoded.astype(int) - expected).mean(), 2)
+
+        padded, transform = prepare_image(data, 640)
+        self.assertEqual(transform.full_size, (600, 800))
+        ys, xs = np.nonzero(padded[..., 0] > 128)
+        box = [xs.min(), ys.min(), xs.max() + 1, ys.max() + 1]
+        # The square was top left before rotating clockwise, so it ends up top right
+        np.testing.assert_allclose(transform.restore([box])[0], [420, 80, 540, 200], atol=8)
+
+    def test_fitted_decode_caps_the_size(self):
+        image, scale = decode_fitted(photo(4000, 3000), 1280)
+        self.assertEqual(image.shape, (960, 1280, 3))
+        self.assertEqual(scale, (0.32, 0.32))
+
+        image, scale = decode_fitted(photo(400, 300), 0)
+        self.assertEqual((image.shape, scale), ((300, 400, 3), (1.0, 1.0)))
+
+
+class TestExportedEngine(unittest.TestCase):
+
+    def test_postprocess_maps_boxes_back_to_original_image(self):
+        # Columns are anchors: one confident car, one duplicate of it, one low-score box
+        raw = np.array([
+            raw_detection(320, 320, 100, 50, [0.1, 0.9]),
+            raw_detection(321, 320, 100, 50, [0.1, 0.8]),
+            raw_detection(100, 100, 10, 10, [0.2, 0.1]),
+        ], dtype=np.float32).T
+
+        engine = FakeEngine(raw)
+        image = np.zeros((320, 1280, 3), dtype=np.uint8)
+        results = engine.predict([image, image])
+
+        self.assertEqual(engine.batch_shape, (2, 3, 640, 640))
+        self.assertEqual(len(results), 2)
+        boxes = results[0].boxes
+        self.assertEqual(len(boxes), 1)
+        self.assertEqual(results[0].names[int(boxes.cls[0])], "car")
+        self.assertAlmostEqual(float(boxes.conf[0]), 0.9, places=5)
+        # (270, 295, 370, 345) in letterboxed pixels -> scale 0.5, pad y 240
+        self.assertTrue(torch.allclose(boxes.xyxy[0], torch.tensor([540.0, 110.0, 740.0, 210.0])))
+
+    def test_concurrent_starts_export_once(self):
+        with tempfile.TemporaryDirectory() as cache_dir, ThreadPoolExecutor(max_workers=4) as executor:
+            engines = list(executor.map(lambda _: ExportingEngine(cache_dir=cache_dir), range(4)))
+
+            self.assertEqual(ExportingEngine.exports, 1)
+            for engine in engines:
+                self.assertEqual((engine.loaded_model, engine.names), ("model", {0: "person"}))
+            # Nothing staged is left behind
+            self.assertEqual(sorted(name for name in os.listdir(cache_dir) if not name.endswith(".lock")),
+                             ["yolov8n-640.fake", "yolov8n.names.json"])
+
+
+class TestResultsFromDetections(unittest.TestCase):
+
+    def test_stored_detections_can_be_plotted_again(self):
+        image = np.zeros((100, 200, 3), dtype=np.uint8)
+        detections = [{"label": "dog", "score": 0.8, "box": [10.0, 20.0, 50.0, 60.0]}]
+        result = results_from_detections(image, detections, {0: "person", 1: "dog"})
+
+        self.assertEqual(result.boxes.cls.tolist(), [1.0])
+        self.assertEqual(result.boxes.xyxy[0].tolist(), [10.0, 20.0, 50.0, 60.0])
+        self.assertEqual(result.plot().shape, image.shape)
+
+    def test_no_detections(self):
+        image = np.zeros((10, 10, 3), dtype=np.uint8)
+        self.assertEqual(len(results_from_detections(image, [], {0: "person"}).boxes), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import app as service
+import metrics
+from imaging import load_image
+from lazy import Lazy
+from pipeline import BatchStage, Pipeline, Stage
+
+
+class TestPipeline(unittest.TestCase):
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def test_jobs_pass_through_all_stages_in_order(self):
+        def add(name):
+            return lambda job: job.append(name)
+
+        async def scenario():
+            pipeline = Pipeline([Stage("a", add("a")), Stage("b", add("b")), Stage("c", add("c"))])
+            await pipeline.start()
+            try:
+                return await asyncio.gather(*(pipeline.submit([]) for _ in range(5)))
+            finally:
+                await pipeline.stop()
+
+        for job in self.run_async(scenario()):
+            self.assertEqual(job, ["a", "b", "c"])
+
+    def test_stage_exception_is_raised_to_submitter(self):
+        def fail(job):
+            raise ValueError("boom")
+
+        async def scenario():
+            pipeline = Pipeline([Stage("ok", lambda job: None), Stage("fail", fail)])
+            await pipeline.start()
+            try:
+                with self.assertRaises(ValueError):
+                    await pipeline.submit({})
+                # The pipeline keeps running after a failed job
+                with self.assertRaises(ValueError):
+                    await pipeline.submit({})
+            finally:
+                await pipeline.stop()
+
+        self.run_async(scenario())
+
+    def test_stage_concurrency_limit(self):
+        lock = threading.Lock()
+        state = {"active": 0, "peak": 0}
+
+        def slow(job):
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            time.sleep(0.02)
+            with lock:
+                state["active"] -= 1
+
+        async def scenario():
+            executor = ThreadPoolExecutor(max_workers=8)
+            pipeline = Pipeline([Stage("slow", slow, executor, concurrency=2)])
+            await pipeline.start()
+            try:
+                await asyncio.gather(*(pipeline.submit({}) for _ in range(10)))
+            finally:
+                await pipeline.stop()
+                executor.shutdown()
+
+        self.run_async(scenario())
+        self.assertEqual(state["peak"], 2)
+
+    def test_stages_overlap_between_jobs(self):
+        def sleep(job):
+            time.sleep(0.05)
+
+        async def scenario():
+            executor = ThreadPoolExecutor(max_workers=4)
+            pipeline = Pipeline([Stage("io", sleep, executor), Stage("cpu", sleep, executor)])
+            await pipeline.start()
+            try:
+                start = time.perf_counter()
+                await asyncio.gather(*(pipeline.submit({}) for _ in range(4)))
+                return time.perf_counter() - start
+            finally:
+                await pipeline.stop()
+                executor.shutdown()
+
+        # Sequential would take 8 * 0.05s; overlapped stages need about 5 * 0.05s
+        self.assertLess(self.run_async(scenario()), 0.35)
+
+    def test_batch_stage_groups_queued_jobs(self):
+        batch_sizes = []
+
+        def record(jobs):
+            batch_sizes.append(len(jobs))
+            for job in jobs:
+                job["batched"] = True
+
+        async def scenario():
+            pipeline = Pipeline([BatchStage("batch", record, max_batch_size=4, max_wait=0.2)], queue_size=10)
+            await pipeline.start()
+            try:
+                return await asyncio.gather(*(pipeline.submit({}) for _ in range(6)))
+            finally:
+                await pipeline.stop()
+
+        jobs = self.run_async(scenario())
+        self.assertTrue(all(job["batched"] for job in jobs))
+        self.assertEqual(batch_sizes, [4, 2])
+
+    def test_batch_stage_failure_fails_whole_batch(self):
+        def fail(jobs):
+            raise RuntimeError("inference failed")
+
+        async def scenario():
+            pipeline = Pipeline([BatchStage("batch", fail, max_batch_size=3, max_wait=0.1)])
+            await pipeline.start()
+            try:
+                return await asyncio.gather(*(pipeline.submit({}) for _ in range(3)), return_exceptions=True)
+            finally:
+                await pipeline.stop()
+
+        results = self.run_async(scenario())
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+    def test_batch_stage_can_isolate_a_failing_job(self):
+        calls = []
+
+        def fail_on_bad(jobs):
+            calls.append(len(jobs))
+            if any(job.get("bad") for job in jobs):
+                raise RuntimeError("bad job")
+            for job in jobs:
+                job["done"] = True
+
+        async def scenario():
+            pipeline = Pipeline([BatchStage("batch", fail_on_bad, max_batch_size=3, max_wait=0.1,
+                                            isolate_failures=True)])
+            await pipeline.start()
+            try:
+                jobs = [{}, {"bad": True}, {}]
+                return await asyncio.gather(*(pipeline.submit(job) for job in jobs), return_exceptions=True)
+            finally:
+                await pipeline.stop()
+
+        good, bad, other = self.run_async(scenario())
+        self.assertEqual((good, other), ({"done": True}, {"done": True}))
+        self.assertIsInstance(bad, RuntimeError)
+        self.assertEqual(calls, [3, 1, 1, 1])
+
+    def test_submit_requires_started_pipeline(self):
+        async def scenario():
+            pipeline = Pipeline([Stage("a", lambda job: None)])
+            with self.assertRaises(RuntimeError):
+                await pipeline.submit({})
+
+        self.run_async(scenario())
+
+    def test_stage_durations_are_recorded(self):
+        async def scenario():
+            pipeline = Pipeline([Stage("timed-sleep", lambda job: time.sleep(0.02))])
+            await pipeline.start()
+            try:
+                await asyncio.gather(*(pipeline.submit({}) for _ in range(2)))
+            finally:
+                await pipeline.stop()
+
+        self.run_async(scenario())
+        durations = metrics.histogram_snapshot()["pipeline.stage.duration"]["stage=timed-sleep"]
+        self.assertEqual(durations["count"], 2)
+        self.assertGreaterEqual(durations["mean"], 0.02)
+
+
+class DecodingModel:
+    """Stands in for YOLO: decodes every image in the batch, so one unreadable file fails the call."""
+    names = {0: "person"}
+
+    def predict(self, sources):
+        return [load_image(source).shape for source in sources]
+
+
+class TestInferenceBatches(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.original_model = service.model
+        service.model = Lazy(DecodingModel)
+
+    def tearDown(self):
+        service.model = self.original_model
+        self.tmp.cleanup()
+
+    def job(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return service.PredictionJob(name, "chat", name, path, path + ".predicted.jpg")
+
+    def test_undecodable_image_only_fails_its_own_job(self):
+        with open(os.path.join(os.path.dirname(__file__), "test_image.jpg"), "rb") as f:
+            image = f.read()
+        jobs = [self.job("a.jpg", image), self.job("corrupt.jpg", b"not an image"), self.job("b.jpg", image)]
+        infer = next(stage for stage in service.pipeline.stages if stage.name == "infer")
+
+        async def scenario():
+            pipeline = Pipeline([BatchStage("infer", infer.func, max_batch_size=3, max_wait=0.2,
+                                            isolate_failures=infer.isolate_failures)])
+            await pipeline.start()
+            try:
+                return await asyncio.gather(*(pipeline.submit(job) for job in jobs), return_exceptions=True)
+            finally:
+                await pipeline.stop()
+
+        first, corrupt, second = asyncio.run(scenario())
+        self.assertEqual((first.result, second.result), ((1024, 1024, 3), (1024, 1024, 3)))
+        self.assertIsInstance(corrupt, Exception)
+
+
+if __name__ == "__main__":
+    unittest.main()
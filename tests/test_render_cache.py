@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from render_cache import RenderCache
+
+
+class TestRenderCache(unittest.TestCase):
+
+    def test_get_returns_put_value(self):
+        cache = RenderCache(100)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", b"12345")
+        self.assertEqual(cache.get("a"), b"12345")
+        self.assertEqual(cache.size, 5)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = RenderCache(10)
+        cache.put("a", b"1234")
+        cache.put("b", b"1234")
+        cache.get("a")
+        cache.put("c", b"1234")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"1234")
+        self.assertEqual(cache.get("c"), b"1234")
+        self.assertEqual(cache.size, 8)
+
+    def test_value_larger_than_cache_is_not_kept(self):
+        cache = RenderCache(4)
+        cache.put("a", b"12345")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.size, 0)
+
+    def test_replacing_a_key_updates_size(self):
+        cache = RenderCache(100)
+        cache.put("a", b"1234")
+        cache.put("a", b"12")
+        self.assertEqual(cache.get("a"), b"12")
+        self.assertEqual(cache.size, 2)
+
+    def test_directory_cache_evicts_files_and_survives_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = RenderCache(10, directory)
+            cache.put("a", b"1234")
+            cache.put("b", b"1234")
+            cache.put("c", b"1234")
+            self.assertEqual(len(os.listdir(directory)), 2)
+            self.assertIsNone(cache.get("a"))
+
+            reopened = RenderCache(10, directory)
+            self.assertEqual(reopened.size, 8)
+            self.assertEqual(reopened.get("b"), b"1234")
+            self.assertEqual(reopened.get("c"), b"1234")
+
+    def test_directory_cache_ignores_deleted_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = RenderCache(10, directory)
+            cache.put("a", b"1234")
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(cache.size, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
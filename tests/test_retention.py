@@ -0,0 +1,245 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is only needed to export archives
+    pq = None
+try:
+    from moto import mock_aws
+except ImportError:  # moto is only needed for these offline tests
+    mock_aws = None
+
+import app as service
+from lazy import Lazy
+from storage.base import stage_reached
+from storage.cached import CachedStorage
+from storage.dynamodb_migrations import enable_ttl
+from storage.dynamodb_storage import TTL_ATTRIBUTE, DynamoDBStorage
+from storage.retention import archive_dynamodb, prune_sqlite
+from storage.sqlite_migrations import enable_incremental_vacuum
+from storage.sqlite_storage import SQLiteStorage
+from tests.test_dynamodb_storage import TABLE_NAME, create_table
+
+DETECTIONS = [
+    {"label": "person", "score": 0.9, "box": [10, 20, 110, 220]},
+    {"label": "dog", "score": 0.4, "box": [0, 0, 5, 5]},
+]
+
+
+class TestSQLiteRetention(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "predictions.db")
+        self.storage = SQLiteStorage(self.db_path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def save_old(self, uid, days_ago, detections=DETECTIONS):
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - days_ago * 86400))
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("""
+                INSERT INTO prediction_sessions (uid, timestamp, original_image, predicted_image) VALUES (?, ?, ?, ?)
+            """, (uid, timestamp, f"{uid}.jpg", f"{uid}-predicted.jpg"))
+        for d in detections:
+            self.storage.save_detection(uid, d["label"], d["score"], d["box"])
+
+    def count(self, sql):
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute(sql).fetchone()[0]
+
+    def test_prune_removes_expired_predictions_everywhere(self):
+        for i in range(7):
+            self.save_old(f"old-{i}", 40)
+        self.storage.save_content_hash("old-hash", "old-0")
+        self.storage.claim_job("old-0", "worker-a", 60)
+        self.storage.save_prediction_with_detections("new-1", "a.jpg", "p.jpg", DETECTIONS[:1])
+        self.storage.save_content_hash("new-hash", "new-1")
+
+        result = prune_sqlite(self.db_path, 30, batch_size=3)
+
+        self.assertEqual(result["predictions"], 7)
+        self.assertEqual(self.count("SELECT COUNT(*) FROM prediction_sessions"), 1)
+        self.assertEqual(self.count("SELECT COUNT(*) FROM detection_objects"), 1)
+        self.assertEqual(self.count("SELECT COUNT(*) FROM detection_boxes"), 1)
+        self.assertIsNone(self.storage.find_prediction_by_hash("old-hash"))
+        self.assertEqual(self.storage.find_prediction_by_hash("new-hash"), "new-1")
+        self.assertIsNone(self.storage.get_job_state("old-0"))
+        self.assertEqual(self.storage.get_predictions_by_box(None, (0, 0, 5, 5), None), [])
+
+        # The aggregates only count what is left, without empty rows
+        stats = self.storage.get_stats()
+        self.assertEqual(list(stats["labels"]), ["person"])
+        self.assertEqual(stats["labels"]["person"]["detections"], 1)
+        self.assertEqual(self.count("SELECT COUNT(*) FROM label_stats"), 1)
+        self.assertEqual(self.count("SELECT SUM(count) FROM hourly_stats"), 1)
+
+        self.assertEqual(prune_sqlite(self.db_path, 30)["predictions"], 0)
+
+    def test_pruned_predictions_leave_the_cache(self):
+        self.save_old("old-1", 40)
+        cached = CachedStorage(self.storage)
+        self.assertEqual(cached.get_prediction("old-1")["uid"], "old-1")
+
+        pruned = []
+        prune_sqlite(self.db_path, 30, on_pruned=lambda *uids: (pruned.extend(uids), cached.invalidate(*uids)))
+        self.assertEqual(pruned, ["old-1"])
+        with self.assertRaises(ValueError):
+            cached.get_prediction("old-1")
+
+    def test_incremental_vacuum_shrinks_the_file(self):
+        self.assertEqual(self.count("PRAGMA auto_vacuum"), 2)
+        many = [{"label": f"label-{i}", "score": 0.5, "box": [i, i, i + 1, i + 1]} for i in range(50)]
+        for i in range(100):
+            self.save_old(f"old-{i}", 40, many)
+
+        result = prune_sqlite(self.db_path, 30)
+
+        self.assertGreater(result["pages_freed"], 0)
+        self.assertEqual(self.count("PRAGMA freelist_count"), 0)
+
+    def test_enable_incremental_vacuum_on_an_existing_database(self):
+        path = os.path.join(self.tmp.name, "old.db")
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE prediction_sessions (uid TEXT PRIMARY KEY, timestamp DATETIME, "
+                         "original_image TEXT, predicted_image TEXT)")
+        SQLiteStorage(path)
+        with sqlite3.connect(path) as conn:
+            self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 0)
+
+        enable_incremental_vacuum(path)
+        with sqlite3.connect(path) as conn:
+            self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+
+    def test_duplicate_of_a_pruned_prediction_starts_over(self):
+        self.save_old("old-1", 40)
+        job = service.PredictionJob("new-1", "chat", "a.jpg", "a.jpg", "p.jpg", content_hash="abc",
+                                    duplicate_of="old-1")
+        self.storage.claim_job("new-1", "worker-a", 60)
+        original = service.storage
+        service.storage = Lazy(lambda: self.storage)
+        try:
+            prune_sqlite(self.db_path, 30)
+            with self.assertRaises(ValueError):
+                service.persist_stage(job)
+        finally:
+            service.storage = original
+
+        # The redelivered message keeps the hash but runs inference
+        state = self.storage.get_job_state("new-1")
+        self.assertEqual(state["stage"], "received")
+        self.assertEqual((state["data"]["content_hash"], state["data"]["duplicate_of"]), ("abc", None))
+        self.assertFalse(stage_reached(state, "inferred"))
+
+    @unittest.skipIf(pq is None, "pyarrow is not installed")
+    def test_expired_predictions_are_archived_first(self):
+        for i in range(5):
+            self.save_old(f"old-{i}", 40)
+        self.storage.save_prediction_with_detections("new-1", "a.jpg", "p.jpg", DETECTIONS)
+        archive_dir = os.path.join(self.tmp.name, "archive")
+
+        result = prune_sqlite(self.db_path, 30, archive_dir, batch_size=2)
+
+        sessions_path, detections_path = sorted(result["archived"], reverse=True)
+        sessions = pq.read_table(sessions_path).to_pylist()
+        self.assertEqual(sorted(s["uid"] for s in sessions), [f"old-{i}" for i in range(5)])
+        self.assertEqual(sessions[0]["original_image"], f"{sessions[0]['uid']}.jpg")
+        self.assertLess(sessions[0]["timestamp"], datetime.datetime.now(datetime.timezone.utc))
+        detections = pq.read_table(detections_path).to_pylist()
+        self.assertEqual(len(detections), 10)
+        person = next(d for d in detections if d["label"] == "person")
+        self.assertEqual([person[k] for k in ("x1", "y1", "x2", "y2", "area")], [10, 20, 110, 220, 20000])
+        self.assertEqual(sorted(os.listdir(archive_dir)), sorted(os.path.basename(p) for p in result["archived"]))
+
+        # Nothing expired, no files
+        self.assertEqual(prune_sqlite(self.db_path, 30, archive_dir)["archived"], [])
+
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+class TestDynamoDBRetention(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+        self.mock = mock_aws()
+        self.mock.start()
+        self.table = create_table()
+        self.storage = DynamoDBStorage(TABLE_NAME, retention_days=2)
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def test_items_carry_an_expiry(self):
+        self.storage.save_prediction_with_detections("uid-1", "a.jpg", "p.jpg", DETECTIONS)
+        self.storage.save_content_hash("abc", "uid-1")
+        self.storage.claim_job("uid-1", "worker-a", 60)
+
+        items = {(item["PK"], item["SK"]): item for item in self.table.scan()["Items"]}
+        expected = time.time() + 2 * 86400
+        for key, item in items.items():
+            if key[1].startswith("LABEL#"):
+                # Totals across the retention period, never expire
+                self.assertNotIn(TTL_ATTRIBUTE, item)
+            else:
+                self.assertAlmostEqual(float(item[TTL_ATTRIBUTE]), expected, delta=60)
+        self.assertIn("created_at", items[("PRED#uid-1", "META")])
+
+        enable_ttl(self.table)
+        enable_ttl(self.table)
+        status = self.table.meta.client.describe_time_to_live(TableName=TABLE_NAME)["TimeToLiveDescription"]
+        self.assertEqual((status["TimeToLiveStatus"], status["AttributeName"]), ("ENABLED", TTL_ATTRIBUTE))
+
+    def test_expired_hash_is_a_miss(self):
+        self.storage.save_content_hash("abc", "uid-1")
+        self.table.update_item(Key={"PK": "HASH#abc", "SK": "META"}, UpdateExpression="SET #ttl = :past",
+                               ExpressionAttributeNames={"#ttl": TTL_ATTRIBUTE},
+                               ExpressionAttributeValues={":past": int(time.time()) - 60})
+        # TTL hasn't deleted it yet, but the prediction may already be gone
+        self.assertIsNone(self.storage.find_prediction_by_hash("abc"))
+
+        self.storage.save_content_hash("abc", "uid-2")
+        self.assertEqual(self.storage.find_prediction_by_hash("abc"), "uid-2")
+        self.storage.save_content_hash("abc", "uid-3")
+        self.assertEqual(self.storage.find_prediction_by_hash("abc"), "uid-2")
+
+    def test_no_expiry_by_default(self):
+        DynamoDBStorage(TABLE_NAME, retention_days=0).save_prediction_with_detections("uid-1", "a.jpg", "p.jpg",
+                                                                                     DETECTIONS)
+        self.assertFalse(any(TTL_ATTRIBUTE in item for item in self.table.scan()["Items"]))
+
+    @unittest.skipIf(pq is None, "pyarrow is not installed")
+    def test_archive_the_predictions_expiring_on_a_day(self):
+        for i in range(3):
+            self.storage.save_prediction_with_detections(f"uid-{i}", "a.jpg", "p.jpg", DETECTIONS)
+        DynamoDBStorage(TABLE_NAME, retention_days=5).save_prediction_with_detections("later", "a.jpg", "p.jpg",
+                                                                                     DETECTIONS)
+        day = datetime.datetime.fromtimestamp(time.time() + 2 * 86400, datetime.timezone.utc).date()
+        archive_dir = os.path.join(self.tmp_dir(), "archive")
+
+        paths = archive_dynamodb(self.table, day, archive_dir, page_size=4)
+
+        sessions_path, detections_path = sorted(paths, reverse=True)
+        self.assertTrue(sessions_path.endswith(f"dynamodb-{day.isoformat()}.sessions.parquet"))
+        sessions = pq.read_table(sessions_path).to_pylist()
+        self.assertEqual(sorted(s["uid"] for s in sessions), ["uid-0", "uid-1", "uid-2"])
+        self.assertIsNotNone(sessions[0]["timestamp"])
+        detections = pq.read_table(detections_path).to_pylist()
+        self.assertEqual(len(detections), 6)
+        self.assertEqual(
+            sorted(d["area"] for d in detections if d["prediction_uid"] == "uid-0"), [25.0, 20000.0]
+        )
+
+    def tmp_dir(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return tmp.name
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,261 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import metrics
+from storage.base import InvalidCursorError
+from storage.instrumented import InstrumentedStorage
+from storage.sqlite_migrations import migrate_boxes
+from storage.sqlite_storage import SQLiteStorage
+
+
+class TestSQLiteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = SQLiteStorage(os.path.join(self.tmp.name, "predictions.db"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_save_prediction_with_detections(self):
+        detections = [
+            {"label": "person", "score": 0.9, "box": [1.0, 2.0, 3.0, 4.0]},
+            {"label": "dog", "score": 0.4, "box": [5.0, 6.0, 7.0, 8.0]},
+        ]
+        self.storage.save_prediction_with_detections("uid-1", "a.jpg", "a.jpg", detections)
+
+        prediction = self.storage.get_prediction("uid-1")
+        self.assertEqual(prediction["original_image"], "a.jpg")
+        self.assertEqual(
+            sorted(d["label"] for d in prediction["detection_objects"]), ["dog", "person"]
+        )
+        self.assertEqual([p["uid"] for p in self.storage.get_predictions_by_label("dog")], ["uid-1"])
+        self.assertEqual([p["uid"] for p in self.storage.get_predictions_by_score(0.5)], ["uid-1"])
+
+    def test_save_prediction_with_detections_is_atomic(self):
+        with self.assertRaises(KeyError):
+            self.storage.save_prediction_with_detections(
+                "uid-1", "b.jpg", "b.jpg", [{"label": "cat", "score": 0.5, "box": [0, 0, 1, 1]}, {"label": "dog"}]
+            )
+        with self.assertRaises(ValueError):
+            self.storage.get_prediction("uid-1")
+        self.assertEqual(self.storage.get_predictions_by_label("cat"), [])
+
+    def test_saving_a_prediction_again_replaces_it(self):
+        detections = [{"label": "cat", "score": 0.5, "box": [0, 0, 1, 1]}]
+        self.storage.save_prediction_with_detections("uid-1", "a.jpg", "a.jpg", detections)
+        self.storage.save_prediction_with_detections("uid-1", "a.jpg", "a.jpg", detections)
+        self.assertEqual(len(self.storage.get_prediction("uid-1")["detection_objects"]), 1)
+
+    def test_job_claims_and_state(self):
+        self.assertIsNone(self.storage.get_job_state("uid-1"))
+        self.assertTrue(self.storage.claim_job("uid-1", "worker-a", 60))
+        self.assertFalse(self.storage.claim_job("uid-1", "worker-b", 60))
+        self.assertTrue(self.storage.claim_job("uid-1", "worker-a", 60))
+
+        self.storage.update_job_state("uid-1", "inferred", {"labels": ["cat"]}, 60)
+        state = self.storage.get_job_state("uid-1")
+        self.assertEqual((state["stage"], state["data"], state["owner"]), ("inferred", {"labels": ["cat"]}, "worker-a"))
+
+        self.storage.release_job("uid-1", "worker-a")
+        self.assertTrue(self.storage.claim_job("uid-1", "worker-b", 60))
+        # Claiming again keeps the progress made so far
+        self.assertEqual(self.storage.get_job_state("uid-1")["stage"], "inferred")
+
+    def test_expired_job_lease_can_be_taken_over(self):
+        self.assertTrue(self.storage.claim_job("uid-1", "worker-a", -1))
+        self.assertTrue(self.storage.claim_job("uid-1", "worker-b", 60))
+
+    def test_label_pages_cover_all_predictions_once(self):
+        for i in range(7):
+            self.storage.save_prediction_with_detections(f"uid-{i}", "a.jpg", "a.jpg", [
+                {"label": "person", "score": 0.5, "box": [0, 0, 1, 1]},
+                {"label": "person", "score": 0.7, "box": [1, 1, 2, 2]},
+            ])
+
+        uids, cursor, pages = [], None, 0
+        while True:
+            page, cursor = self.storage.get_predictions_by_label_page("person", 3, cursor)
+            uids.extend(p["uid"] for p in page)
+            pages += 1
+            if cursor is None:
+                break
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(uids, [f"uid-{i}" for i in range(7)])
+        self.assertEqual([p["uid"] for p in self.storage.iter_predictions_by_score(0.6)], uids)
+
+    def test_content_hash_and_copy_prediction(self):
+        self.assertIsNone(self.storage.find_prediction_by_hash("abc"))
+        self.storage.save_prediction_with_detections("uid-1", "a.jpg", "a-pred.jpg", [
+            {"label": "dog", "score": 0.8, "box": [1.0, 2.0, 3.0, 4.0]},
+        ])
+        self.storage.save_content_hash("abc", "uid-1")
+        self.storage.save_content_hash("abc", "uid-other")
+        self.assertEqual(self.storage.find_prediction_by_hash("abc"), "uid-1")
+
+        self.storage.copy_prediction("uid-1", "uid-2", "b.jpg")
+        copy = self.storage.get_prediction("uid-2")
+        self.assertEqual((copy["original_image"], copy["predicted_image"]), ("b.jpg", "a-pred.jpg"))
+        self.assertEqual([d["label"] for d in copy["detection_objects"]], ["dog"])
+
+        with self.assertRaises(ValueError):
+            self.storage.copy_prediction("missing", "uid-3", "c.jpg")
+
+    def test_boxes_are_numeric(self):
+        self.storage.save_prediction_with_detections("uid-1", "a.jpg", "a.jpg", [
+            {"label": "dog", "score": 0.8, "box": [1.5, 2.0, 3.0, 4.0]},
+        ])
+        self.assertEqual(self.storage.get_prediction("uid-1")["detection_objects"][0]["box"], [1.5, 2.0, 3.0, 4.0])
+
+    def test_box_queries(self):
+        self.storage.save_prediction_with_detections("small", "a.jpg", "a.jpg", [
+            {"label": "person", "score": 0.9, "box": [0, 0, 10, 10]},
+        ])
+        self.storage.save_prediction_with_detections("large", "b.jpg", "b.jpg", [
+            {"label": "person", "score": 0.9, "box": [100, 100, 300, 300]},
+            {"label": "dog", "score": 0.9, "box": [0, 0, 5, 5]},
+        ])
+
+        def uids(label=None, region=None, min_area=None):
+            page, _ = self.storage.get_predictions_by_box_page(label, region, min_area, 10)
+            return sorted(p["uid"] for p in page)
+
+        self.assertEqual(uids(region=(5, 5, 6, 6)), ["large", "small"])
+        self.assertEqual(uids("person", region=(5, 5, 6, 6)), ["small"])
+        self.assertEqual(uids(region=(200, 200, 400, 400)), ["large"])
+        self.assertEqual(uids(region=(20, 20, 30, 30)), [])
+        self.assertEqual(uids(min_area=1000), ["large"])
+        self.assertEqual(uids("dog", min_area=1000), [])
+        with self.assertRaises(ValueError):
+            uids()
+
+        # Replacing a prediction replaces its boxes in the spatial index too
+        self.storage.save_prediction_with_detections("small", "a.jpg", "a.jpg", [])
+        self.assertEqual(uids(region=(5, 5, 6, 6)), ["large"])
+
+    def test_box_pages(self):
+        for i in range(5):
+            self.storage.save_prediction_with_detections(f"uid-{i}", "a.jpg", "a.jpg", [
+                {"label": "person", "score": 0.5, "box": [0, 0, 10, 10]},
+                {"label": "person", "score": 0.6, "box": [5, 5, 15, 15]},
+            ])
+        self.assertEqual(
+            [p["uid"] for p in self.storage.iter_predictions_by_box("person", (8, 8, 9, 9), None)],
+            [f"uid-{i}" for i in range(5)],
+        )
+        page, cursor = self.storage.get_predictions_by_box_page("person", None, 50, 2)
+        self.assertEqual([p["uid"] for p in page], ["uid-0", "uid-1"])
+        self.assertIsNotNone(cursor)
+
+    def test_migrate_text_boxes(self):
+        path = os.path.join(self.tmp.name, "old.db")
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE prediction_sessions (uid TEXT PRIMARY KEY, "
+                         "timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, original_image TEXT, predicted_image TEXT)")
+            conn.execute("CREATE TABLE detection_objects (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "prediction_uid TEXT, label TEXT, score REAL, box TEXT)")
+            conn.execute("INSERT INTO prediction_sessions (uid, original_image, predicted_image) "
+                         "VALUES ('uid-1', 'a.jpg', 'a.jpg')")
+            conn.executemany("INSERT INTO detection_objects (prediction_uid, label, score, box) VALUES (?, ?, ?, ?)", [
+                ("uid-1", "person", 0.9, str([0.0, 0.0, 10.0, 20.0])),
+                ("uid-1", "dog", 0.5, str([50.0, 50.0, 60.0, 60.0])),
+            ])
+
+        storage = SQLiteStorage(path)
+        # Readable before the migration too
+        self.assertEqual(storage.get_prediction("uid-1")["detection_objects"][0]["box"], [0.0, 0.0, 10.0, 20.0])
+        storage.copy_prediction("uid-1", "uid-2", "b.jpg")
+
+        # The storage stays open, like a live service, while the column is dropped
+        self.assertEqual(migrate_boxes(path, batch_size=3), 4)
+        storage.copy_prediction("uid-1", "uid-3", "c.jpg")
+        self.assertEqual(len(storage.get_prediction("uid-3")["detection_objects"]), 2)
+        boxes = [d["box"] for d in storage.get_prediction("uid-2")["detection_objects"]]
+        self.assertEqual(boxes, [[0.0, 0.0, 10.0, 20.0], [50.0, 50.0, 60.0, 60.0]])
+        page, _ = storage.get_predictions_by_box_page("person", (5, 15, 6, 16), 200, 10)
+        self.assertEqual(sorted(p["uid"] for p in page), ["uid-1", "uid-2", "uid-3"])
+        with sqlite3.connect(path) as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(detection_objects)")]
+        self.assertNotIn("box", columns)
+
+    def test_stats_follow_every_write(self):
+        self.storage.save_prediction_with_detections("uid-1", "a.jpg", "a.jpg", [
+            {"label": "dog", "score": 0.95, "box": [0, 0, 1, 1]},
+            {"label": "dog", "score": 1.0, "box": [0, 0, 2, 2]},
+            {"label": "cat", "score": 0.12, "box": [0, 0, 1, 1]},
+        ])
+        # Replacing a prediction replaces its counts
+        self.storage.save_prediction_with_detections("uid-1", "a.jpg", "a.jpg", [
+            {"label": "dog", "score": 0.55, "box": [0, 0, 1, 1]},
+        ])
+        self.storage.copy_prediction("uid-1", "uid-2", "b.jpg")
+
+        stats = self.storage.get_stats()
+        self.assertEqual(list(stats["labels"]), ["dog"])
+        self.assertEqual(stats["labels"]["dog"]["detections"], 2)
+        self.assertEqual(stats["labels"]["dog"]["score_histogram"], [0, 0, 0, 0, 0, 2, 0, 0, 0, 0])
+        self.assertEqual(sum(stats["predictions_per_hour"].values()), 2)
+
+    def test_stats_are_counted_for_an_existing_database(self):
+        path = os.path.join(self.tmp.name, "old.db")
+        SQLiteStorage(path).save_prediction_with_detections("uid-1", "a.jpg", "a.jpg", [
+            {"label": "dog", "score": 0.95, "box": [0, 0, 1, 1]},
+        ])
+        with sqlite3.connect(path) as conn:
+            conn.execute("DROP TABLE label_stats")
+            conn.execute("DROP TABLE hourly_stats")
+
+        stats = SQLiteStorage(path).get_stats()
+        self.assertEqual(stats["labels"]["dog"]["detections"], 1)
+        self.assertEqual(sum(stats["predictions_per_hour"].values()), 1)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(InvalidCursorError):
+            self.storage.get_predictions_by_label_page("person", 3, "not-a-cursor")
+
+    def test_uses_wal_journal(self):
+        mode = self.storage._write_conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
+
+class SlowPagesStorage(SQLiteStorage):
+    """A backend whose result pages take a while to come back."""
+
+    def get_predictions_by_score_page(self, min_score, limit, cursor=None):
+        time.sleep(0.02)
+        return super().get_predictions_by_score_page(min_score, limit, cursor)
+
+
+class TestInstrumentedStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = InstrumentedStorage(SlowPagesStorage(os.path.join(self.tmp.name, "predictions.db")))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_iteration_is_timed_without_the_callers_work(self):
+        detections = [{"label": "person", "score": 0.9, "box": [1.0, 2.0, 3.0, 4.0]}]
+        for uid in ("uid-1", "uid-2"):
+            self.storage.save_prediction_with_detections(uid, "a.jpg", "a.jpg", detections)
+
+        uids = []
+        for prediction in self.storage.iter_predictions_by_score(0.5):
+            uids.append(prediction["uid"])
+            time.sleep(0.1)
+
+        self.assertEqual(sorted(uids), ["uid-1", "uid-2"])
+        durations = metrics.histogram_snapshot()["storage.duration"][
+            "backend=SlowPagesStorage,operation=iter_predictions_by_score"]
+        self.assertEqual(durations["count"], 1)
+        self.assertGreaterEqual(durations["mean"], 0.02)
+        self.assertLess(durations["mean"], 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()